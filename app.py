@@ -15,8 +15,13 @@ from traces_api.modules.unit.controller import ns as dataset_namespace
 from traces_api.modules.annotated_unit.controller import ns as annotated_unit_namespace
 from traces_api.modules.mix.controller import ns as mix_namespace
 
-from traces_api.trace_tools import TraceAnalyzer, TraceNormalizer, TraceMixing
+from traces_api.trace_tools import TraceAnalyzer, NativeTraceAnalyzer, CachedTraceAnalyzer, TraceNormalizer, TraceMixing
+from traces_api.trace_tools import NativeTraceNormalizer, CachedTraceNormalizer
 from traces_api.compression import Compression
+from traces_api.containers import DockerRunner, ContainerPool
+from traces_api.cache import FileCache
+from traces_api.analysis import AnalysisLimits
+from traces_api.jobs import JobQueue
 
 
 APP_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -119,30 +124,209 @@ class FlaskApp:
             return config_value
         return "{}/{}".format(APP_DIR, config_value)
 
+    def _create_tool_runner(self):
+        """
+        Create runner of trace-tools commands, container pool is used when enabled in config
+
+        :return: DockerRunner or ContainerPool
+        """
+        pool_size = int(self._config.get("tools", "pool_size") or 0)
+        if pool_size <= 0:
+            return DockerRunner()
+
+        shared_dirs = [d.strip() for d in (self._config.get("tools", "pool_shared_dirs") or "").split(",") if d.strip()]
+        shared_dirs += [
+            self._abs_storage_path(self._config.get("storage", key))
+            for key in ("ann_units_dir", "units_dir", "mixes_dir")
+        ]
+
+        pool = ContainerPool(
+            pool_size,
+            shared_dirs,
+            max_jobs=int(self._config.get("tools", "pool_max_jobs") or 100),
+            max_age=int(self._config.get("tools", "pool_max_age") or 3600),
+            health_check_interval=int(self._config.get("tools", "pool_health_check_interval") or 60),
+        )
+        pool.start()
+        return pool
+
+    def _create_cache(self):
+        """
+        Create cache of tool results
+
+        :return: FileCache or None when cache is disabled in config
+        """
+        cache_dir = self._config.get("cache", "dir")
+        if not cache_dir:
+            return None
+
+        max_age = int(self._config.get("cache", "max_age") or 0)
+        return FileCache(
+            self._abs_storage_path(cache_dir),
+            max_size=int(self._config.get("cache", "max_size")),
+            max_age=max_age or None,
+        )
+
+    def _create_checkpoint_cache(self):
+        """
+        Create cache of intermediate mixes of chained mixing
+
+        :return: FileCache or None when checkpoints are disabled in config
+        """
+        checkpoint_dir = self._config.get("mixer", "checkpoint_dir")
+        if not checkpoint_dir:
+            return None
+
+        return FileCache(
+            self._abs_storage_path(checkpoint_dir),
+            max_size=int(self._config.get("mixer", "checkpoint_max_size")),
+        )
+
+    def _create_trace_analyzer(self, runner, cache):
+        """
+        Create trace analyzer using backend selected in config
+
+        :param runner: runner of trace-tools commands
+        :param cache: FileCache for analysis results, None to disable caching
+        :return: trace analyzer
+        """
+        approximate_threshold, limits, spill_max_entries = self._analysis_limits()
+
+        if self._config.get("analyzer", "backend") == "native":
+            trace_analyzer = NativeTraceAnalyzer(limits, approximate_threshold, spill_max_entries)
+        elif limits is not None:
+            # docker tools always analyze exactly, large files are analyzed in-process
+            trace_analyzer = TraceAnalyzer(runner, NativeTraceAnalyzer(limits), approximate_threshold)
+        else:
+            trace_analyzer = TraceAnalyzer(runner)
+
+        if cache is not None:
+            return CachedTraceAnalyzer(trace_analyzer, cache)
+        return trace_analyzer
+
+    def _analysis_limits(self):
+        """
+        Limits of native analysis set in config
+
+        :return: tuple (approximate threshold, AnalysisLimits or None, spill max entries or None)
+        """
+        approximate_threshold = int(self._config.get("analyzer", "approximate_threshold") or 0)
+        if approximate_threshold > 0:
+            limits = AnalysisLimits(**{
+                key: int(self._config.get("analyzer", "approximate_" + key) or default)
+                for key, default in AnalysisLimits()._asdict().items()
+            })
+        else:
+            limits = None
+
+        spill_max_entries = int(self._config.get("analyzer", "spill_max_entries") or 0) or None
+        return approximate_threshold, limits, spill_max_entries
+
+    def _create_normalized_analyzer(self, trace_analyzer):
+        """
+        Create analyzer of normalized captures (statistics of annotated units)
+
+        :param trace_analyzer: analyzer of uploaded units
+        :return: trace analyzer, NativeTraceAnalyzer analyzes captures while they are normalized
+        """
+        if self._config.get("normalizer", "analysis") == "analyzer":
+            return trace_analyzer
+        approximate_threshold, limits, spill_max_entries = self._analysis_limits()
+        return NativeTraceAnalyzer(limits, approximate_threshold, spill_max_entries)
+
+    def _create_trace_normalizer(self, runner, cache):
+        """
+        Create trace normalizer using backend selected in config
+
+        :param runner: runner of trace-tools commands
+        :param cache: FileCache for normalized captures, None to disable caching
+        :return: trace normalizer
+        """
+        if self._config.get("normalizer", "backend") == "native":
+            trace_normalizer = NativeTraceNormalizer(
+                chunk_size=int(self._config.get("normalizer", "parallel_chunk_size") or 0) or None,
+                workers=int(self._config.get("normalizer", "parallel_workers") or 0) or None,
+            )
+        else:
+            trace_normalizer = TraceNormalizer(runner)
+
+        if cache is not None and self._config.get("normalizer", "cache") == "true":
+            return CachedTraceNormalizer(trace_normalizer, cache)
+        return trace_normalizer
+
+    def _create_job_queue(self):
+        """
+        Create queue of background jobs (mix generation) processed by traces_api.worker
+
+        :return: JobQueue
+        """
+        return JobQueue(
+            self._session_maker,
+            max_attempts=int(self._config.get("worker", "max_attempts") or 3),
+            retry_delay=int(self._config.get("worker", "retry_delay") or 30),
+            stale_timeout=int(self._config.get("worker", "stale_timeout") or 120),
+        )
+
     def configure(self, binder):
         """
         Configure application, setup binder
 
         :param binder:
         """
+        for service_type, service in self.create_services().items():
+            binder.bind(service_type, to=service)
+
+    def create_services(self):
+        """
+        Create services of application
+
+        :return: dict service class -> service, runner of trace-tools commands is stored under DockerRunner
+            (e.g. to be closed by worker processes)
+        """
 
         from traces_api.modules.unit.service import UnitService
         from traces_api.modules.annotated_unit.service import AnnotatedUnitService
         from traces_api.modules.mix.service import MixService
         from traces_api.storage import FileStorage
 
+        runner = self._create_tool_runner()
+        cache = self._create_cache()
+        trace_analyzer = self._create_trace_analyzer(runner, cache)
+        trace_normalizer = self._create_trace_normalizer(runner, cache)
+
         annotated_unit_storage = FileStorage(self._abs_storage_path(self._config.get("storage", "ann_units_dir")), compression=Compression())
-        annotated_unit_service = AnnotatedUnitService(self._session_maker, annotated_unit_storage, TraceAnalyzer(), TraceNormalizer())
+        annotated_unit_service = AnnotatedUnitService(
+            self._session_maker, annotated_unit_storage, trace_analyzer, trace_normalizer,
+            normalized_analyzer=self._create_normalized_analyzer(trace_analyzer)
+        )
 
         unit_storage = FileStorage(self._abs_storage_path(self._config.get("storage", "units_dir")), compression=Compression(), subdirectories=False)
-        unit_service = UnitService(self._session_maker, annotated_unit_service, unit_storage, TraceAnalyzer())
-
+        unit_service = UnitService(
+            self._session_maker, annotated_unit_service, unit_storage, trace_analyzer,
+            analysis_workers=int(self._config.get("unit", "analysis_workers") or 2),
+            normalize_workers=int(self._config.get("unit", "normalize_workers") or 0) or None,
+            normalize_processes=self._config.get("unit", "normalize_executor") == "process"
+        )
+
+        job_queue = self._create_job_queue()
         mix_storage = FileStorage(self._abs_storage_path(self._config.get("storage", "mixes_dir")), compression=Compression())
-        mix_service = MixService(self._session_maker, self._engine, annotated_unit_service, mix_storage, TraceNormalizer(), TraceMixing())
-
-        binder.bind(UnitService, to=unit_service)
-        binder.bind(AnnotatedUnitService, to=annotated_unit_service)
-        binder.bind(MixService, to=mix_service)
+        mix_service = MixService(
+            self._session_maker, self._engine, annotated_unit_service, mix_storage, trace_normalizer, TraceMixing(runner, self._config.get("mixer", "timestamp_generation")),
+            single_run=self._config.get("mixer", "mode") == "single",
+            prepare_units=self._config.get("mixer", "prepare_units") == "true",
+            prepare_workers=int(self._config.get("mixer", "prepare_workers") or 0) or None,
+            checkpoint_cache=self._create_checkpoint_cache(),
+            # without workers mixes are generated synchronously by API process (e.g. in tests)
+            job_queue=job_queue if int(self._config.get("worker", "workers") or 0) else None
+        )
+
+        return {
+            UnitService: unit_service,
+            AnnotatedUnitService: annotated_unit_service,
+            MixService: mix_service,
+            JobQueue: job_queue,
+            DockerRunner: runner,
+        }
 
     def create_app(self):
         """
@@ -38,13 +38,17 @@ as an input for a trace normalization and annotation.
 
 Currently available information: TCP conversations, caputre file properties, and MAC-IP pairs.
 
+Combined mode (-a) extracts all the information from a single tshark pass over the capture file
+instead of running tshark and capinfos for each of them.
+
 Requirements:
     * tshark
-    * capinfos
+    * capinfos (capture file properties without combined mode)
     * Python 3
 
 Usage:
     $ ./trace-analyzer.py -f <capture_file> -t -p -c
+    $ ./trace-analyzer.py -f <capture_file> -a
 """
 
 # Common python modules
@@ -54,16 +58,30 @@ import subprocess  # Executes commands in shell
 import re  # Regular expressions support
 import shlex  # Split the string s using shell-like syntax
 import json  # JSON processing functions
+import struct  # Binary data parsing
+import hashlib  # Secure hashes
+import os  # Common operating system functions
+import tempfile  # Temporary files
+import zlib  # Gzip compressed files support
+import threading  # Capture file is fed to tshark from separate thread
 from distutils.spawn import find_executable  # Check if required tool is available in PATH
 
 
-def check_requirements():
+class CommandError(Exception):
+    """
+    Command exited with non-zero exit status.
+    """
+    pass
+
+
+def check_requirements(tools):
     """
     Checks if all necessary programs are installed.
 
+    :param tools: names of required programs
     :return: True if all tools are available, False otherwise
     """
-    for tool in ["capinfos", "tshark"]:
+    for tool in tools:
         if not find_executable(tool):
             return False
     return True
@@ -217,6 +235,258 @@ def get_mac_ip_pairs(filename, quiet):
     return pairs_result
 
 
+# Fields extracted by tshark in combined mode, order matters
+COMBINED_FIELDS = ["frame.time_epoch", "frame.time_relative", "frame.len", "eth.src", "eth.dst", "ip.src", "ip.dst",
+                   "ipv6.src", "ipv6.dst", "tcp.srcport", "tcp.dstport"]
+
+ENCAPSULATION_NAMES = {0: "NULL/Loopback", 1: "Ethernet", 101: "Raw IP", 113: "Linux cooked-mode capture v1"}
+
+
+def run_command_stream(command, quiet, feed=None):
+    """
+    Run given command and provide its standard output as a stream of lines.
+
+    :param command: command to be run
+    :param quiet: set to true to not print any information output
+    :param feed: function writing standard input of the command, it is called from separate thread with the stream
+    :return: generator of decoded output lines
+    :raise CommandError: command exited with non-zero exit status
+    """
+    if not quiet:
+        print("[info] Running command: " + command)
+    # Errors are collected in temporary file, so the pipe can not block while output is being read
+    with tempfile.TemporaryFile() as stderr_file:
+        command_process = subprocess.Popen(
+            shlex.split(command), stdin=subprocess.PIPE if feed else None, stdout=subprocess.PIPE, stderr=stderr_file
+        )
+        feeder = None
+        if feed:
+            feeder = threading.Thread(target=feed, args=(command_process.stdin,), daemon=True)
+            feeder.start()
+
+        for line in command_process.stdout:
+            yield line.decode('utf-8').rstrip('\n')
+
+        returncode = command_process.wait()
+        if feeder:
+            feeder.join()
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+
+    if stderr:
+        print("[error] Command \"{command}\" returned an error:\n{error}".format(command=command, error=stderr))
+    if returncode != 0:
+        raise CommandError("Command \"{command}\" exited with status {status}".format(command=command, status=returncode))
+
+
+class CaptureFileReader:
+    """
+    Read capture file for tshark, file hashes and header are computed from the same read of the file.
+
+    Gzip compressed file is decompressed, so tshark can read it from a pipe.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: capture file to read
+        """
+        self.filename = filename
+        self.hashes = [("SHA256", hashlib.sha256()), ("RIPEMD160", None), ("SHA1", hashlib.sha1())]
+        try:
+            self.hashes[1] = ("RIPEMD160", hashlib.new("ripemd160"))
+        except ValueError:
+            del self.hashes[1]
+        self.compressed = None
+        self.header = b""
+        self._decompressor = None
+
+    def feed(self, stream):
+        """
+        Write content of capture file to given stream, the stream is closed afterwards.
+
+        :param stream: standard input of tshark
+        """
+        try:
+            with open(self.filename, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    for _, h in self.hashes:
+                        h.update(chunk)
+                    if self.compressed is None:
+                        self.compressed = chunk[:2] == b"\x1f\x8b"
+                    if self.compressed:
+                        chunk = self._decompress(chunk)
+                    if len(self.header) < 256:
+                        self.header += chunk[:256 - len(self.header)]
+                    stream.write(chunk)
+            stream.close()
+        except (OSError, zlib.error) as e:
+            # tshark exited or it can not read the file, exit status of tshark reports the error
+            print("[error] Capture file \"{filename}\" can not be read:\n{error}".format(filename=self.filename, error=e))
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+    def _decompress(self, chunk):
+        output = b""
+        while chunk:
+            if self._decompressor is None:
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            output += self._decompressor.decompress(chunk)
+            chunk = self._decompressor.unused_data
+            if self._decompressor.eof:
+                # Gzip file can consist of more members
+                self._decompressor = None
+        return output
+
+    def properties(self):
+        """
+        Capture file properties stored in file header and file hashes, the whole file has to be fed first.
+
+        :return: dictionary with parsed properties
+        """
+        properties = parse_header_properties(self.header, self.compressed)
+        properties["File size"] = "{} bytes".format(os.path.getsize(self.filename))
+        for name, h in self.hashes:
+            properties[name] = h.hexdigest()
+        return properties
+
+
+def parse_header_properties(header, compressed):
+    """
+    Parse capture file properties stored in file header.
+
+    :param header: the first bytes of (decompressed) capture file
+    :param compressed: True if capture file is gzip compressed
+    :return: dictionary with parsed properties
+    """
+    properties = {}
+    if header[:4] == b"\x0a\x0d\x0d\x0a":
+        endian = "<" if header[8:12] == b"\x4d\x3c\x2b\x1a" else ">"
+        properties["File type"] = "Wireshark/... - pcapng"
+        shb_length, = struct.unpack_from(endian + "I", header, 4)
+        if len(header) >= shb_length + 16 and struct.unpack_from(endian + "I", header, shb_length)[0] == 1:
+            linktype, _, snaplen = struct.unpack_from(endian + "HHI", header, shb_length + 8)
+            properties["File encapsulation"] = ENCAPSULATION_NAMES.get(linktype, str(linktype))
+            properties["Packet size limit"] = "file hdr: {} bytes".format(snaplen)
+    elif len(header) >= 24:
+        magic = header[:4]
+        endian = "<" if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1") else ">"
+        snaplen, linktype = struct.unpack_from(endian + "II", header, 16)
+        properties["File type"] = "Wireshark/tcpdump/... - pcap"
+        properties["File encapsulation"] = ENCAPSULATION_NAMES.get(linktype, str(linktype))
+        nanoseconds = magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d")
+        properties["File timestamp precision"] = "nanoseconds (9)" if nanoseconds else "microseconds (6)"
+        properties["Packet size limit"] = "file hdr: {} bytes".format(snaplen)
+
+    if compressed and "File type" in properties:
+        properties["File type"] += " (gzip compressed)"
+    return properties
+
+
+def get_all_combined(filename, quiet):
+    """
+    Compute TCP conversations, MAC-IP pairs and capture file properties from a single tshark pass.
+
+    :param filename: capture file to analyse
+    :param quiet: set to true to not print any information output
+    :return: tuple (TCP conversations, MAC-IP pairs, capture file properties) in the same format as provided
+             by get_tcp_conversations, get_mac_ip_pairs and get_capture_file_properties
+    """
+    # File is read only once, tshark reads it from standard input while hashes are computed
+    command = "tshark -nr - -T fields {fields} -E separator=/t".format(
+        fields=" ".join("-e " + field for field in COMBINED_FIELDS)
+    )
+    reader = CaptureFileReader(filename)
+
+    conversations = {}
+    pairs_src = set()
+    pairs_dst = set()
+    packets = 0
+    data_size = 0
+    first_time = None
+    last_time = None
+    previous_time = None
+    strict_time_order = True
+
+    for line in run_command_stream(command, quiet, feed=reader.feed):
+        fields = line.split("\t")
+        if len(fields) != len(COMBINED_FIELDS):
+            continue
+        time_epoch, time_relative, frame_len, eth_src, eth_dst, ip_src, ip_dst, ipv6_src, ipv6_dst, \
+            tcp_src, tcp_dst = fields
+
+        time_epoch = float(time_epoch)
+        frame_len = int(frame_len)
+        packets += 1
+        data_size += frame_len
+        if first_time is None:
+            first_time = last_time = time_epoch
+        else:
+            if time_epoch < previous_time:
+                strict_time_order = False
+            first_time = min(first_time, time_epoch)
+            last_time = max(last_time, time_epoch)
+        previous_time = time_epoch
+
+        if eth_src or ip_src:
+            pairs_src.add((eth_src, ip_src))
+            pairs_dst.add((eth_dst, ip_dst))
+
+        if tcp_src and tcp_dst:
+            side_src = (ip_src.split(",")[0] or ipv6_src.split(",")[0], int(tcp_src.split(",")[0]))
+            side_dst = (ip_dst.split(",")[0] or ipv6_dst.split(",")[0], int(tcp_dst.split(",")[0]))
+            key = (side_src, side_dst) if side_src <= side_dst else (side_dst, side_src)
+            conversation = conversations.get(key)
+            if conversation is None:
+                conversation = conversations[key] = dict(
+                    side_a=side_src, side_b=side_dst, frames_ab=0, bytes_ab=0, frames_ba=0, bytes_ba=0,
+                    start=float(time_relative)
+                )
+            if conversation["side_a"] == side_src:
+                conversation["frames_ab"] += 1
+                conversation["bytes_ab"] += frame_len
+            else:
+                conversation["frames_ba"] += 1
+                conversation["bytes_ba"] += frame_len
+
+    tcp_conversations = [{
+        "IP A": c["side_a"][0],
+        "Port A": c["side_a"][1],
+        "IP B": c["side_b"][0],
+        "Port B": c["side_b"][1],
+        "Frames B-A": c["frames_ba"],
+        "Bytes B-A": c["bytes_ba"],
+        "Frames A-B": c["frames_ab"],
+        "Bytes A-B": c["bytes_ab"],
+        "Frames": c["frames_ab"] + c["frames_ba"],
+        "Bytes": c["bytes_ab"] + c["bytes_ba"],
+        "Relative start": c["start"]
+    } for c in conversations.values()]
+    tcp_conversations.sort(key=lambda c: c["Frames"], reverse=True)
+
+    mac_ip_pairs = [{"MAC": mac, "IP": ip} for mac, ip in pairs_src] + \
+                   [{"MAC": mac, "IP": ip} for mac, ip in pairs_dst]
+
+    capture_info = {"File name": filename}
+    capture_info.update(reader.properties())
+    capture_info["Number of packets"] = str(packets)
+    capture_info["Data size"] = "{} bytes".format(data_size)
+    if packets:
+        duration = last_time - first_time
+        capture_info["Capture duration"] = "{:.6f} seconds".format(duration)
+        capture_info["First packet time"] = "{:.6f}".format(first_time)
+        capture_info["Last packet time"] = "{:.6f}".format(last_time)
+        if duration > 0:
+            capture_info["Data byte rate"] = "{:.2f} bytes/s".format(data_size / duration)
+            capture_info["Data bit rate"] = "{:.2f} bits/s".format(data_size * 8 / duration)
+            capture_info["Average packet rate"] = "{:.2f} packets/s".format(packets / duration)
+        capture_info["Average packet size"] = "{:.2f} bytes".format(data_size / packets)
+    capture_info["Strict time order"] = str(strict_time_order)
+
+    return tcp_conversations, mac_ip_pairs, capture_info
+
+
 if __name__ == "__main__":
     # Argument parser automatically creates -h argument
     parser = argparse.ArgumentParser()
@@ -228,14 +498,31 @@ if __name__ == "__main__":
                         action='store_true', required=False)
     parser.add_argument("-c", "--capture_info", help="Show capture file properties.",
                         action='store_true', required=False)
+    parser.add_argument("-a", "--all", help="Show TCP conversations, MAC-IP pairs and capture file properties "
+                                            "computed from a single pass over the capture file.",
+                        action='store_true', required=False)
     parser.add_argument("-q", "--quiet", help="Do not print any information",
                         action='store_true', required=False)
     args = parser.parse_args()
 
-    if not check_requirements():
-        print("[error] Script requirements not satisfied. Please install \"tshark\" and \"capinfos\" tools!")
+    required_tools = ["tshark"] if args.all or not args.capture_info else ["tshark", "capinfos"]
+    if not check_requirements(required_tools):
+        print("[error] Script requirements not satisfied. Please install {} tools!".format(
+            " and ".join("\"{}\"".format(tool) for tool in required_tools)
+        ))
         sys.exit(1)
 
+    if args.all:
+        try:
+            tcp_conversations, mac_ip_pairs, capture_info = get_all_combined(args.filename, args.quiet)
+        except CommandError as e:
+            print("[error] {}".format(e))
+            sys.exit(1)
+        print(json.dumps(tcp_conversations))
+        print(json.dumps(mac_ip_pairs))
+        print(json.dumps(capture_info))
+        sys.exit(0)
+
     if args.tcp_conversations:
         tcp_conversations = get_tcp_conversations(args.filename, args.quiet)
         print(json.dumps(tcp_conversations))
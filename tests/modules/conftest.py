@@ -8,9 +8,10 @@ from traces_api.modules.unit.service import Mapping, IPDetails
 
 from traces_api.modules.annotated_unit.service import AnnotatedUnitService
 from traces_api.modules.unit.service import UnitService
+from traces_api.modules.mix.service import MixService
 
 from traces_api.storage import FileStorage
-from traces_api.trace_tools import TraceNormalizer, TraceAnalyzer
+from traces_api.trace_tools import TraceNormalizer, TraceAnalyzer, TraceMixing
 from traces_api.compression import Compression
 
 from pathlib import Path
@@ -36,6 +37,15 @@ def service_unit(sqlalchemy_session, service_annotated_unit):
     return UnitService(sqlalchemy_session, service_annotated_unit, FileStorage(storage_folder="{}/storage/units".format(APP_DIR), compression=Compression(), subdirectories=False), TraceAnalyzer())
 
 
+@pytest.fixture()
+def service_mix(sqlalchemy_session, sqlalchemy_engine, service_annotated_unit):
+    return MixService(
+        sqlalchemy_session, sqlalchemy_engine, service_annotated_unit,
+        FileStorage(storage_folder="{}/storage/mixes".format(APP_DIR), compression=Compression()),
+        TraceNormalizer(), TraceMixing(timestamp_generation="shift")
+    )
+
+
 @pytest.fixture()
 def ann_unit1(service_unit):
     return create_ann_unit(service_unit, "My annotated unit")
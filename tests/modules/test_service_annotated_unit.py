@@ -1,6 +1,12 @@
+import json
 import pytest
 
-from traces_api.modules.annotated_unit.service import AnnotatedUnitDoesntExistsException, OperatorEnum
+from traces_api.compression import Compression
+from traces_api.modules.annotated_unit.service import AnnotatedUnitService, AnnotatedUnitDoesntExistsException, OperatorEnum
+from traces_api.modules.unit.service import Mapping, IPDetails
+from traces_api.storage import FileStorage, File
+from traces_api.tools import escape
+from traces_api.trace_tools import NativeTraceAnalyzer, NativeTraceNormalizer
 from .conftest import create_ann_unit
 
 
@@ -138,3 +144,49 @@ def test_update(service_annotated_unit, ann_unit1):
     assert ann_unit2.name == "New name"
     assert ann_unit2.description == "New desc"
     assert {l.label for l in ann_unit2.labels} == {"abc"}
+
+
+def test_create_fused_normalize_and_analyze(sqlalchemy_session, tmp_path):
+    storage = FileStorage(str(tmp_path), compression=Compression(), subdirectories=False)
+    analyzer = NativeTraceAnalyzer()
+    service = AnnotatedUnitService(sqlalchemy_session, storage, analyzer, NativeTraceNormalizer())
+
+    ann_unit = service.create_annotated_unit(
+        name="Fused",
+        description="",
+        mac_mapping=Mapping.create_from_dict([], keys=("mac", "ips")),
+        tcp_timestamp_mapping=Mapping.create_from_dict([], keys=("ip", "min")),
+        ip_details=IPDetails(target_nodes=["240.125.0.2"], intermediate_nodes=[], source_nodes=["240.0.1.2"]),
+        unit_file=File("tests/fixtures/hydra-1_tasks.pcap"),
+        labels=["fused"],
+    )
+
+    # Statistics computed while normalizing equal analysis of the stored capture
+    stats = json.loads(ann_unit.stats)
+    expected = escape(analyzer.analyze(storage.get_file(ann_unit.file_location).location))
+    for key in ("tcp_conversations", "pairs_mac_ip", "ip.occurrences", "mac.associations"):
+        assert stats[key] == expected[key]
+    assert json.loads(ann_unit.ip_details)["source_nodes"] == ["240.0.0.2"]
+
+
+def test_normalized_analyzer_is_used_instead_of_trace_analyzer(sqlalchemy_session, tmp_path):
+    class NotStreamingAnalyzer:
+        def analyze(self, filepath):
+            raise AssertionError("normalized capture must not be analyzed again")
+
+    storage = FileStorage(str(tmp_path), compression=Compression(), subdirectories=False)
+    service = AnnotatedUnitService(
+        sqlalchemy_session, storage, NotStreamingAnalyzer(), NativeTraceNormalizer(),
+        normalized_analyzer=NativeTraceAnalyzer()
+    )
+
+    ann_unit = service.create_annotated_unit(
+        name="Fused",
+        description="",
+        mac_mapping=Mapping.create_from_dict([], keys=("mac", "ips")),
+        tcp_timestamp_mapping=Mapping.create_from_dict([], keys=("ip", "min")),
+        ip_details=IPDetails(target_nodes=["240.125.0.2"], intermediate_nodes=[], source_nodes=["240.0.1.2"]),
+        unit_file=File("tests/fixtures/hydra-1_tasks.pcap"),
+        labels=["fused"],
+    )
+    assert json.loads(ann_unit.stats)["tcp_conversations"]
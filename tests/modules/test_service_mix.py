@@ -0,0 +1,97 @@
+import io
+import os.path
+from datetime import datetime
+
+from traces_api.database.model.annotated_unit import ModelAnnotatedUnit
+from traces_api.database.model.mix import ModelMixFileGeneration
+from traces_api.modules.mix.service import MixService
+from traces_api.trace_tools import TraceMixer, TraceMixing
+
+
+def create_mix(service_mix, ann_unit, name):
+    return service_mix.create_mix(name, "Description %s" % name, ["MIX"], [dict(
+        id_annotated_unit=ann_unit.id_annotated_unit,
+        ip_mapping=[dict(original="240.0.0.2", replacement="10.0.0.1")],
+        mac_mapping=[],
+        port_mapping=[],
+        timestamp=1500000000,
+    )])
+
+
+def test_generation_of_the_same_mix_is_reused(service_mix, ann_unit1):
+    mix1 = create_mix(service_mix, ann_unit1, "Mix 1")
+    mix2 = create_mix(service_mix, ann_unit1, "Mix 2")
+    fingerprint = service_mix._mix_fingerprint(mix1)
+    assert service_mix._mix_fingerprint(mix2) == fingerprint
+
+    file_location = service_mix._file_storage.save_file(io.BytesIO(b"MIX"), "pcap")
+    service_mix._session.add(ModelMixFileGeneration(
+        id_mix=mix1.id_mix, creation_time=datetime.now(), expired=False, progress=100,
+        file_location=file_location, fingerprint=fingerprint,
+    ))
+    service_mix._session.commit()
+
+    id_mix_generation = service_mix.start_mix_generation(mix2.id_mix)
+
+    mix_generation = service_mix.get_mix_generation_by_id_generation(id_mix_generation)
+    assert mix_generation.progress == 100
+    assert mix_generation.file_location == file_location
+
+    # shared file is removed with the last mix using it
+    stored = service_mix._file_storage.get_file(file_location).location
+    service_mix.delete_mix(mix1.id_mix)
+    assert os.path.exists(stored)
+    service_mix.delete_mix(mix2.id_mix)
+    assert not os.path.exists(stored)
+
+
+def test_shared_mix_file_is_removed_with_last_generation(service_mix):
+    # annotated unit is only stored in database, mixes are never generated
+    ann_unit = ModelAnnotatedUnit(
+        name="Unit", description="", creation_time=datetime.now(), stats="{}", ip_details="{}", file_location="unit.pcap"
+    )
+    service_mix._session.add(ann_unit)
+    service_mix._session.commit()
+
+    mix1 = create_mix(service_mix, ann_unit, "Mix 1")
+    mix2 = create_mix(service_mix, ann_unit, "Mix 2")
+    mix3 = create_mix(service_mix, ann_unit, "Mix 3")
+    file_location = service_mix._file_storage.save_file(io.BytesIO(b"MIX"), "pcap")
+    service_mix._session.add(ModelMixFileGeneration(
+        id_mix=mix1.id_mix, creation_time=datetime.now(), expired=False, progress=100,
+        file_location=file_location, fingerprint=service_mix._mix_fingerprint(mix1),
+    ))
+    service_mix._session.commit()
+
+    # mix 1 has two generations of the same file, other mixes reuse it
+    for mix in (mix1, mix2, mix3):
+        id_mix_generation = service_mix.start_mix_generation(mix.id_mix)
+        assert service_mix.get_mix_generation_by_id_generation(id_mix_generation).file_location == file_location
+
+    stored = service_mix._file_storage.get_file(file_location).location
+    service_mix.delete_mix(mix1.id_mix)
+    service_mix.delete_mix(mix3.id_mix)
+    assert os.path.exists(stored)
+    service_mix.delete_mix(mix2.id_mix)
+    assert not os.path.exists(stored)
+
+
+def test_annotated_units_are_prepared_only_when_enabled(tmp_path):
+    unit = "tests/fixtures/hydra-1_tasks.pcap"
+    config = TraceMixer.prepare_configuration(None, None, None)
+    mixing = TraceMixing(timestamp_generation="shift")
+    mixer = TraceMixer(str(tmp_path / "mix.pcap"))
+
+    # ID2T rewrites annotated units itself by default
+    service = MixService(None, None, None, None, None, mixing)
+    assert service._prepare_annotated_units(mixer, [(unit, config, 1500000000)], str(tmp_path)) == [
+        (unit, config, 1500000000)
+    ]
+
+    service = MixService(None, None, None, None, None, mixing, prepare_units=True)
+    (prepared, prepared_config, at_timestamp), = service._prepare_annotated_units(
+        mixer, [(unit, config, 1500000000)], str(tmp_path)
+    )
+    assert prepared == str(tmp_path / "prepared_0.pcap") and os.path.exists(prepared)
+    assert at_timestamp == 1500000000
+    assert service._mixer_version != MixService(None, None, None, None, None, mixing)._mixer_version
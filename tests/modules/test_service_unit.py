@@ -1,16 +1,23 @@
+import time
 import pytest
+import threading
 from io import BytesIO
+from unittest import mock
 
 from traces_api.modules.unit.service import (
     UnitDoesntExistsException, Mapping, IPDetails,
     IPDetailsUnknownIPException, 
 )
+from traces_api.database.model.unit import ModelUnit
 
 from traces_api.trace_tools import TraceNormalizerError
+from traces_api.modules.unit.service import UnitService
+from traces_api.storage import FileStorage
+from traces_api.compression import Compression
 
 import werkzeug.datastructures
 
-from .conftest import get_empty_pcap
+from .conftest import get_empty_pcap, APP_DIR
 
 
 def test_unit_upload(service_unit, get_empty_pcap):
@@ -162,6 +169,34 @@ def test_unit_normalize_invalid_ip_details(service_unit, file_hydra_1_binary):
     assert annotated_unit.id_annotated_unit
 
 
+def test_unit_normalize_batch(service_unit, file_hydra_1_binary):
+    id_units = []
+    for i in range(3):
+        file = werkzeug.datastructures.FileStorage(stream=BytesIO(file_hydra_1_binary), content_type="application/vnd.tcpdump.pcap", filename="file.pcap")
+        unit, _ = service_unit.unit_upload(file)
+        service_unit.unit_annotate(unit.id_unit, "Unit #%s" % i, "Desc", ["L1"])
+        id_units.append(unit.id_unit)
+    file = werkzeug.datastructures.FileStorage(stream=BytesIO(file_hydra_1_binary), content_type="application/vnd.tcpdump.pcap", filename="file.pcap")
+    not_annotated, _ = service_unit.unit_upload(file)
+
+    def item(id_unit):
+        return dict(
+            id_unit=id_unit,
+            mac_mapping=Mapping.create_from_dict([]),
+            ip_details=IPDetails(target_nodes=["1.2.3.4"], intermediate_nodes=[], source_nodes=[]),
+            tcp_timestamp_mapping=Mapping()
+        )
+
+    results = service_unit.unit_normalize_batch(
+        [item(id_unit) for id_unit in id_units] + [item(id_units[0]), item(not_annotated.id_unit), item(123456)]
+    )
+
+    assert [r.status for r in results] == ["created"] * 3 + ["duplicate", "invalid_stage", "not_found"]
+    assert len({r.id_annotated_unit for r in results[:3]}) == 3
+    assert all(r.id_annotated_unit is None for r in results[3:])
+    assert service_unit._session.query(ModelUnit).filter(ModelUnit.id_unit.in_(id_units)).count() == 0
+
+
 def test_find(service_unit, get_empty_pcap):
     file = werkzeug.datastructures.FileStorage(stream=BytesIO(get_empty_pcap), content_type="application/vnd.tcpdump.pcap", filename="dump.pcap")
 
@@ -186,3 +221,68 @@ def test_find(service_unit, get_empty_pcap):
 
     units = service_unit.get_units()
     assert len(units) == 0
+
+
+def wait_for_analysis(service_unit, id_unit, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        analysis = service_unit.get_unit_analysis(id_unit)
+        if analysis.stage != "analyzing":
+            return analysis
+        time.sleep(0.1)
+    raise TimeoutError()
+
+
+def test_unit_upload_async(service_unit, file_hydra_1_binary):
+    file = werkzeug.datastructures.FileStorage(stream=BytesIO(file_hydra_1_binary), content_type="application/vnd.tcpdump.pcap", filename="file.pcap")
+
+    unit = service_unit.unit_upload_async(file)
+
+    analysis = wait_for_analysis(service_unit, unit.id_unit)
+    assert analysis.stage == "upload"
+    assert analysis.error is None
+    assert len(analysis.analytical_data["tcp_conversations"]) == 61
+
+    service_unit.unit_annotate(unit.id_unit, "Unit #1", "Desc unit #1", ["L1", "L2"])
+
+
+def test_unit_upload_async_invalid_file(service_unit):
+    file = werkzeug.datastructures.FileStorage(stream=BytesIO(b"INVALID"), content_type="application/vnd.tcpdump.pcap", filename="file.pcap")
+
+    unit = service_unit.unit_upload_async(file)
+
+    analysis = wait_for_analysis(service_unit, unit.id_unit)
+    assert analysis.stage == "analysis_failed"
+    assert analysis.analytical_data is None
+    assert analysis.error
+
+
+def test_unit_analysis_is_not_read_stale(sqlalchemy_session, service_annotated_unit, file_hydra_1_binary):
+    analysis_started = threading.Event()
+    finish_analysis = threading.Event()
+
+    def analyze(location):
+        analysis_started.set()
+        finish_analysis.wait(10)
+        return dict(tcp_conversations=[])
+
+    analyzer = mock.Mock()
+    analyzer.analyze.side_effect = analyze
+    service_unit = UnitService(sqlalchemy_session, service_annotated_unit, FileStorage(storage_folder="{}/storage/units".format(APP_DIR), compression=Compression(), subdirectories=False), analyzer)
+
+    file = werkzeug.datastructures.FileStorage(stream=BytesIO(file_hydra_1_binary), content_type="application/vnd.tcpdump.pcap", filename="file.pcap")
+    unit = service_unit.unit_upload_async(file)
+
+    # unit is loaded to session of the caller before background analysis finishes
+    assert analysis_started.wait(10)
+    assert service_unit.get_unit_analysis(unit.id_unit).stage == "analyzing"
+    finish_analysis.set()
+
+    analysis = wait_for_analysis(service_unit, unit.id_unit, timeout=10)
+    assert analysis.stage == "upload"
+    assert analysis.analytical_data == dict(tcp_conversations=[])
+
+
+def test_get_unit_analysis_invalid_id(service_unit):
+    with pytest.raises(UnitDoesntExistsException):
+        service_unit.get_unit_analysis(123456)
@@ -0,0 +1,172 @@
+import io
+import gzip
+import struct
+import shutil
+import pytest
+
+from traces_api.analysis import CaptureAnalysis, AnalysisLimits
+from traces_api.trace_tools import NativeTraceAnalyzer, TraceAnalyzerError
+from traces_api.storage import FileStorage
+from traces_api.compression import Compression
+from traces_api.pcap import PcapWriter
+
+from .test_trace_tools import compare_list_dict
+
+
+HYDRA_FILE = "tests/fixtures/hydra-1_tasks.pcap"
+
+
+@pytest.fixture()
+def analyzer():
+    return NativeTraceAnalyzer()
+
+
+def test_analyze_invalid_input(analyzer):
+    with pytest.raises(TraceAnalyzerError):
+        analyzer.analyze("/tmp/NON_EXISTING_FILE____")
+
+
+def test_analyze_invalid_format(analyzer, tmp_path):
+    path = tmp_path / "invalid.pcap"
+    path.write_bytes(b"INVALID CAPTURE FILE")
+    with pytest.raises(TraceAnalyzerError):
+        analyzer.analyze(str(path))
+
+
+def test_pairs_mac_ip(analyzer):
+    response = analyzer.analyze(HYDRA_FILE)["pairs_mac_ip"]
+
+    expected = [{'MAC': '08:00:27:bd:c2:37', 'IP': '240.125.0.2'},
+                {'MAC': '08:00:27:90:8f:c4', 'IP': '240.0.1.2'},
+                {'MAC': '08:00:27:bd:c2:37', 'IP': '240.125.0.2'},
+                {'MAC': '08:00:27:90:8f:c4', 'IP': '240.0.1.2'}]
+
+    assert compare_list_dict(response, expected)
+
+
+def test_tcp_conversations(analyzer):
+    response = analyzer.analyze(HYDRA_FILE)["tcp_conversations"]
+
+    assert len(response) == 61
+    for r in response:
+        assert set(r.keys()) == {'IP A', 'Port A', 'IP B', 'Port B', 'Frames B-A', 'Bytes B-A', 'Frames A-B',
+                                 'Bytes A-B', 'Frames', 'Bytes', 'Relative start'}
+        assert r["Frames"] == r["Frames A-B"] + r["Frames B-A"]
+        assert r["IP A"] == "240.0.1.2"
+        assert r["Port B"] == 22
+
+    assert sum(r["Frames"] for r in response) == 2486
+
+
+def test_capture_info(analyzer):
+    response = analyzer.analyze(HYDRA_FILE)["capture_info"]
+
+    assert response["Number of packets"] == "2486"
+    assert response["File encapsulation"] == "Ethernet"
+    assert response["File size"] == "431492 bytes"
+
+
+def test_crawler_fields(analyzer):
+    response = analyzer.analyze(HYDRA_FILE)
+
+    assert response["ip.groups"] == dict(source=["240.0.1.2"], intermediate=[], destination=["240.125.0.2"])
+    assert {t["ip"] for t in response["tcp.timestamp.min"]} == {"240.0.1.2", "240.125.0.2"}
+    assert compare_list_dict(response["ip.occurrences"], [
+        dict(ip="240.0.1.2", count=2486, first_observed=0),
+        dict(ip="240.125.0.2", count=2486, first_observed=0),
+    ])
+    assert sorted((a["mac"], a["ips"]) for a in response["mac.associations"]) == [
+        ("08:00:27:90:8f:c4", ["240.0.1.2"]),
+        ("08:00:27:bd:c2:37", ["240.125.0.2"]),
+    ]
+
+
+def test_compressed_file(analyzer, tmp_path):
+    compressed = str(tmp_path / "hydra.pcap.gz")
+    with open(HYDRA_FILE, "rb") as f_in, gzip.open(compressed, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+
+    expected = analyzer.analyze(HYDRA_FILE)
+    response = analyzer.analyze(compressed)
+
+    assert response["tcp_conversations"] == expected["tcp_conversations"]
+    assert response["ip.occurrences"] == expected["ip.occurrences"]
+
+
+def test_feed_in_chunks():
+    with open(HYDRA_FILE, "rb") as f:
+        data = f.read()
+
+    analysis = CaptureAnalysis("hydra-1_tasks.pcap")
+    for i in range(0, len(data), 4096):
+        analysis.feed(data[i:i + 4096])
+
+    assert analysis.result() == CaptureAnalysis.analyze_file(HYDRA_FILE)
+
+
+def test_stream_analysis(analyzer, tmp_path):
+    storage = FileStorage(str(tmp_path), compression=Compression(), subdirectories=False)
+
+    analysis = analyzer.stream_analysis("hydra-1_tasks.pcap")
+    with open(HYDRA_FILE, "rb") as f:
+        file_name = storage.save_file(f, "pcap", observers=[analysis])
+
+    assert analysis.result() == analyzer.analyze(HYDRA_FILE)
+    assert analyzer.analyze(storage.get_file(file_name).location)["tcp_conversations"] == \
+        analysis.result()["tcp_conversations"]
+
+
+def test_stream_analysis_invalid_format(analyzer):
+    analysis = analyzer.stream_analysis("invalid.pcap")
+    analysis.feed(b"INVALID CAPTURE FILE")
+
+    with pytest.raises(TraceAnalyzerError):
+        analysis.result()
+
+
+def test_approximate_analysis():
+    exact = CaptureAnalysis.analyze_file(HYDRA_FILE)
+    response = CaptureAnalysis.analyze_file(HYDRA_FILE, AnalysisLimits(max_conversations=5, max_ips=1, max_flows=10))
+
+    assert len(response["tcp_conversations"]) == 5
+    assert response["tcp_conversations"] == exact["tcp_conversations"][:5]
+    assert len(response["ip.occurrences"]) == 1
+    assert response["capture_info"] == exact["capture_info"]
+    assert "tcp_conversations" in response["approximate"]
+    assert "ip.occurrences" in response["approximate"]
+    assert response["estimates"]["tcp_conversations"] == 61
+    assert response["estimates"]["distinct_ips"] == 2
+
+
+def test_approximate_analysis_threshold():
+    response = CaptureAnalysis.analyze_file(HYDRA_FILE, AnalysisLimits(), approximate_threshold=10 ** 9)
+    assert "approximate" not in response
+
+    response = CaptureAnalysis.analyze_file(HYDRA_FILE, AnalysisLimits(), approximate_threshold=0)
+    assert response["approximate"] == []
+    assert len(response["tcp_conversations"]) == 61
+
+
+def test_ipv6_protocols():
+    segment = struct.pack("!HHIIBBHHH", 1024, 80, 1, 0, 5 << 4, 0x02, 1024, 0, 0)
+    ip = struct.pack("!IHBB", 6 << 28, len(segment), 6, 64) + bytes(15) + b"\x01" + bytes(15) + b"\x02"
+    output = io.BytesIO()
+    PcapWriter(output).write(1500000000 * 10 ** 9, bytes(12) + b"\x86\xdd" + ip + segment)
+
+    analysis = CaptureAnalysis("ipv6.pcap")
+    analysis.feed(output.getvalue())
+
+    # IP version 6 and TCP protocol number 6 are different protocols
+    assert analysis.result()["ip.searched_protocols"] == [
+        dict(ip="::1", protocols=["<class 'scapy.layers.inet.TCP'>", "<class 'scapy.layers.inet6.IPv6'>"]),
+        dict(ip="::2", protocols=["<class 'scapy.layers.inet.TCP'>", "<class 'scapy.layers.inet6.IPv6'>"]),
+    ]
+
+
+def test_approximate_analysis_does_not_keep_syn_flows():
+    analysis = CaptureAnalysis("hydra.pcap", AnalysisLimits(max_flows=10), approximate_threshold=0)
+    with open(HYDRA_FILE, "rb") as f:
+        analysis.feed(f.read())
+
+    assert len(analysis._flows) <= 20
+    assert len(analysis._syn_flows) == 0
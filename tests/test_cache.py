@@ -0,0 +1,234 @@
+import io
+import logging
+import os
+import gzip
+import shutil
+import pickle
+import pytest
+
+from traces_api.cache import FileCache
+from traces_api.trace_tools import NativeTraceAnalyzer, CachedTraceAnalyzer
+from traces_api.trace_tools import NativeTraceNormalizer, CachedTraceNormalizer
+from traces_api.trace_tools import MixCheckpoints, MergeTraceMixer, TraceMixing
+
+
+HYDRA_FILE = "tests/fixtures/hydra-1_tasks.pcap"
+
+
+class CountingAnalyzer(NativeTraceAnalyzer):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def analyze(self, filepath):
+        self.calls += 1
+        return super().analyze(filepath)
+
+
+class CountingNormalizer(NativeTraceNormalizer):
+
+    def __init__(self, version="native-normalizer-1"):
+        super().__init__()
+        self.calls = 0
+        self._version = version
+
+    @property
+    def version(self):
+        return self._version
+
+    def normalize_stream(self, target_file_location, output_stream, configuration):
+        self.calls += 1
+        return super().normalize_stream(target_file_location, output_stream, configuration)
+
+
+NORMALIZER_CONFIGURATION = {
+    "ip.groups": {"source": ["240.0.1.2"], "intermediate": ["240.125.0.2"], "destination": ["240.125.1.2"]},
+    "mac.associations": {},
+    "tcp.timestamp.min": [],
+}
+
+
+@pytest.fixture()
+def cache(tmp_path):
+    return FileCache(str(tmp_path / "cache"), max_size=1024 * 1024)
+
+
+def test_put_get(cache):
+    key = FileCache.key("test", 1)
+    assert cache.get(key) is None
+
+    cache.put(key, {"a.txt": b"content"})
+    path = cache.get(key)
+    with open(os.path.join(path, "a.txt"), "rb") as f:
+        assert f.read() == b"content"
+
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["entries"] == 1
+
+
+def test_put_moves_file(cache, tmp_path):
+    source = tmp_path / "source.pcap"
+    source.write_bytes(b"data")
+
+    path = cache.put(FileCache.key("file"), {"output.pcap": str(source)})
+    assert not source.exists()
+    assert open(os.path.join(path, "output.pcap"), "rb").read() == b"data"
+
+
+def test_stats_are_shared_by_processes(cache):
+    # cache of another process using the same folder
+    other = FileCache(cache.folder, max_size=1024 * 1024)
+    key = FileCache.key("shared")
+    other.put(key, {"a.txt": b"content"})
+
+    cache.get(key)
+    other.get(key)
+    other.get(FileCache.key("missing"))
+
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (2, 1)
+    assert other.stats()["hits"] == 2
+
+
+def test_lru_eviction(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), max_size=250)
+
+    keys = [FileCache.key(i) for i in range(3)]
+    cache.put(keys[0], {"data": b"0" * 100})
+    cache.put(keys[1], {"data": b"1" * 100})
+    # Make first entry the most recently used one
+    os.utime(cache.get(keys[1]), (0, 0))
+    assert cache.get(keys[0]) is not None
+
+    cache.put(keys[2], {"data": b"2" * 100})
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+    assert (cache.stats()["evictions"], cache.stats()["entries"], cache.stats()["size"]) == (1, 2, 200)
+
+
+def test_folder_is_scanned_only_over_limit(tmp_path, monkeypatch):
+    cache = FileCache(str(tmp_path / "cache"), max_size=250)
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or entries())
+
+    cache.put(FileCache.key(0), {"data": b"0" * 100})
+    cache.put(FileCache.key(1), {"data": b"1" * 100})
+    assert scans == []
+
+    cache.put(FileCache.key(2), {"data": b"2" * 100})
+    assert scans == [1]
+    assert cache.stats()["size"] == 200
+
+
+def test_cached_analyzer(cache, tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    analyzer = CountingAnalyzer()
+    cached_analyzer = CachedTraceAnalyzer(analyzer, cache)
+
+    result = cached_analyzer.analyze(HYDRA_FILE)
+
+    # Same capture stored in different file is found in cache
+    compressed = str(tmp_path / "copy.pcap.gz")
+    with open(HYDRA_FILE, "rb") as f_in, gzip.open(compressed, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    cached_result = cached_analyzer.analyze(compressed)
+
+    assert analyzer.calls == 1
+    assert cached_result == result
+    assert cached_analyzer.hits == 1
+    assert cached_analyzer.misses == 1
+    # statistics are logged with every lookup
+    lookups = [r.getMessage() for r in caplog.records if r.name == "traces_api.trace_tools"]
+    assert len(lookups) == 2 and "'hits': 1, 'misses': 1" in lookups[1]
+
+
+def test_cached_normalizer(cache, tmp_path):
+    normalizer = CountingNormalizer()
+    cached_normalizer = CachedTraceNormalizer(normalizer, cache)
+
+    output = io.BytesIO()
+    labels = cached_normalizer.normalize_stream(HYDRA_FILE, output, NORMALIZER_CONFIGURATION)
+
+    # Equivalent configuration, capture is read from cache
+    configuration = dict(NORMALIZER_CONFIGURATION, **{"mac.associations": []})
+    cached_output = str(tmp_path / "output.pcap")
+    cached_labels = cached_normalizer.normalize(HYDRA_FILE, cached_output, configuration)
+
+    assert normalizer.calls == 1
+    assert cached_labels == labels
+    with open(cached_output, "rb") as f:
+        assert f.read() == output.getvalue()
+    assert (cached_normalizer.hits, cached_normalizer.misses) == (1, 1)
+    assert [name for name in os.listdir(cache.folder) if name.startswith(".")] == []
+
+    # Cached capture is stored compressed
+    key = cached_normalizer._key(HYDRA_FILE, NORMALIZER_CONFIGURATION)
+    with gzip.open(os.path.join(cache.get(key), CachedTraceNormalizer.CAPTURE_FILE), "rb") as f:
+        assert f.read() == output.getvalue()
+
+
+def test_cached_normalizer_key(cache):
+    normalizer = CountingNormalizer()
+    cached_normalizer = CachedTraceNormalizer(normalizer, cache)
+    cached_normalizer.normalize_stream(HYDRA_FILE, io.BytesIO(), NORMALIZER_CONFIGURATION)
+
+    # Different configuration
+    configuration = dict(NORMALIZER_CONFIGURATION, **{"tcp.timestamp.min": [dict(ip="240.0.1.2", min=10)]})
+    cached_normalizer.normalize_stream(HYDRA_FILE, io.BytesIO(), configuration)
+    assert normalizer.calls == 2
+
+    # Different tool version
+    normalizer = CountingNormalizer(version="native-normalizer-2")
+    CachedTraceNormalizer(normalizer, cache).normalize_stream(HYDRA_FILE, io.BytesIO(), NORMALIZER_CONFIGURATION)
+    assert normalizer.calls == 1
+
+
+def test_cache_pickle(cache):
+    cache.put_json("a" * 64, {"x": 1})
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.get_json("a" * 64) == {"x": 1}
+
+
+def test_mix_checkpoints(cache, tmp_path):
+    units = []
+    for i in range(3):
+        unit = str(tmp_path / ("unit_%s.pcap" % i))
+        shutil.copyfile(HYDRA_FILE, unit)
+        units.append((unit, MergeTraceMixer.prepare_configuration(None, None, None), 1500000000 + i))
+    mixing = TraceMixing(timestamp_generation="shift")
+    checkpoints = MixCheckpoints(cache, mixing.version)
+    keys = checkpoints.prefix_keys(units)
+
+    mixer = mixing.create_new_mixer(str(tmp_path / "mix.pcap"))
+    for key, unit in zip(keys[:2], units):
+        mixer.mix(*unit)
+        checkpoints.store(key, mixer.get_mixed_file_location())
+    stored_inode = os.stat(mixer.get_mixed_file_location()).st_ino
+    stored = (tmp_path / "mix.pcap").read_bytes()
+    mixer.mix(*units[2])
+
+    # the same prefix with changed last annotated unit
+    changed = units[:2] + [(units[2][0], units[2][1], 1500000010)]
+    changed_keys = checkpoints.prefix_keys(changed)
+    assert changed_keys[:2] == keys[:2] and changed_keys[2] != keys[2]
+    assert checkpoints.find(keys[2:]) == (0, None)
+
+    num_mixed, checkpoint = checkpoints.find(keys)
+    assert num_mixed == 2
+    # checkpoint is hard link of intermediate mix, which was not changed by following mixing
+    assert os.stat(checkpoint).st_ino == stored_inode
+    with open(checkpoint, "rb") as f:
+        assert f.read() == stored
+    resumed = mixing.create_new_mixer(str(tmp_path / "resumed.pcap"))
+    resumed.resume(checkpoint)
+    assert os.stat(resumed.get_mixed_file_location()).st_ino == stored_inode
+    resumed.mix(*units[2])
+    with open(checkpoint, "rb") as f:
+        assert f.read() == stored
+
+    with open(mixer.get_mixed_file_location(), "rb") as f, open(resumed.get_mixed_file_location(), "rb") as f_resumed:
+        assert f.read() == f_resumed.read()
@@ -0,0 +1,100 @@
+import io
+import struct
+import pytest
+
+from traces_api.capture_filter import PacketFilter, filter_capture
+from traces_api.packet import decode
+from traces_api.pcap import PcapError, PcapWriter, read_records
+from traces_api.rewrite import plan_chunks
+
+from tests.test_index import build_index
+from tests.test_flowtable import build_capture
+
+
+def filtered_records(location, packet_filter, index=None):
+    data = b"".join(filter_capture(location, packet_filter, index))
+    return [(record.timestamp, record.data) for record in read_records(io.BytesIO(data))]
+
+
+def test_filter_time_range_uses_index(tmp_path):
+    data = build_capture(packets=1000)
+    location, index = build_index(data, tmp_path)
+    records = list(read_records(io.BytesIO(data)))
+
+    start, end = records[0].timestamp + 10 ** 8, records[0].timestamp + 3 * 10 ** 8
+    packet_filter = PacketFilter(start=start, end=end)
+    expected = [(r.timestamp, r.data) for r in records if start <= r.timestamp <= end]
+
+    assert 0 < len(expected) < len(records)
+    assert index.time_ordered
+    assert filtered_records(location, packet_filter) == expected
+    assert filtered_records(location, packet_filter, index) == expected
+
+
+def test_filter_ip_port(tmp_path):
+    data = build_capture(packets=1000)
+    location, index = build_index(data, tmp_path)
+
+    packet_filter = PacketFilter(ip="10.0.0.3", port=53)
+    result = filtered_records(location, packet_filter, index)
+
+    assert result
+    for _, packet in result:
+        headers = decode(1, packet)
+        assert bytes((10, 0, 0, 3)) in (headers.ip_src, headers.ip_dst)
+        assert 53 in (headers.src_port, headers.dst_port)
+
+
+def test_filter_no_match(tmp_path):
+    data = build_capture(packets=100)
+    location, index = build_index(data, tmp_path)
+
+    assert filtered_records(location, PacketFilter(start=0, end=1), index) == []
+
+
+def test_filter_time_ordered_file_stops_after_end(tmp_path):
+    records = sorted(read_records(io.BytesIO(build_capture(packets=1000))), key=lambda r: r.timestamp)
+    output = io.BytesIO()
+    writer = PcapWriter(output, nanosecond=True)
+    for record in records:
+        writer.write(record.timestamp, record.data)
+
+    end = records[99].timestamp
+    location = tmp_path / "capture.pcap"
+    # the rest of file after time range is never read
+    location.write_bytes(output.getvalue() + b"TRUNCATED")
+
+    data = b"".join(filter_capture(str(location), PacketFilter(end=end), time_ordered=True))
+    assert [r.data for r in read_records(io.BytesIO(data))] == [r.data for r in records if r.timestamp <= end]
+
+    with pytest.raises(PcapError):
+        b"".join(filter_capture(str(location), PacketFilter(end=end)))
+
+
+def pcapng_block(block_type, body):
+    body += bytes(-len(body) % 4)
+    return struct.pack("<II", block_type, len(body) + 12) + body + struct.pack("<I", len(body) + 12)
+
+
+def test_filter_pcapng_with_interface_after_packets(tmp_path):
+    records = list(read_records(io.BytesIO(build_capture(packets=200))))
+    blocks = [
+        pcapng_block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1)),
+        pcapng_block(1, struct.pack("<HHI", 1, 0, 65535)),
+    ]
+    for i, record in enumerate(records):
+        if i == 100:
+            # the second interface is defined after packets of the first one
+            blocks.append(pcapng_block(1, struct.pack("<HHI", 1, 0, 65535)))
+        timestamp = record.timestamp // 1000
+        blocks.append(pcapng_block(6, struct.pack(
+            "<IIIII", 0 if i < 100 else 1, timestamp >> 32, timestamp & 0xFFFFFFFF, len(record.data), len(record.data)
+        ) + record.data))
+    location, index = build_index(b"".join(blocks), tmp_path)
+    assert index.time_ordered and not index.headers_complete
+
+    start = records[150].timestamp // 1000 * 1000
+    result = filtered_records(location, PacketFilter(start=start), index)
+    assert [packet for _, packet in result] == [r.data for r in records[150:]]
+    # file can't be split for parallel rewriting
+    assert plan_chunks(location, 1024, index) is None
@@ -0,0 +1,155 @@
+import io
+import random
+import struct
+
+from traces_api.checksum import ones_complement_sum, internet_checksum, update_checksum, pseudo_header
+from traces_api.checksum import recompute_checksums
+from traces_api.packet import decode, parse_ip, PROTO_TCP
+from traces_api.pcap import read_records
+from traces_api.rewrite import RewriteMapping, PacketRewriter
+
+from tests.test_flowtable import build_capture
+
+
+def reference_checksum(data):
+    """
+    Straightforward RFC 1071 implementation
+    """
+    if len(data) % 2:
+        data += b"\x00"
+    total = 0
+    for i in range(0, len(data), 2):
+        total += (data[i] << 8) + data[i + 1]
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def random_bytes(rnd, length):
+    return bytes(rnd.getrandbits(8) for _ in range(length))
+
+
+def test_full_checksum_matches_reference():
+    rnd = random.Random(1)
+    for _ in range(500):
+        data = random_bytes(rnd, rnd.randrange(0, 200))
+        assert internet_checksum(data) == reference_checksum(data)
+
+    for data in (b"", b"\x00\x00", b"\xff\xff", b"\xff\xff\xff\xff", b"\x01"):
+        assert internet_checksum(data) == reference_checksum(data)
+        assert ones_complement_sum(data) == ~reference_checksum(data) & 0xFFFF
+
+
+def test_checksum_of_parts():
+    rnd = random.Random(2)
+    for _ in range(200):
+        parts = [random_bytes(rnd, 2 * rnd.randrange(0, 20)) for _ in range(3)] + [random_bytes(rnd, rnd.randrange(20))]
+        assert internet_checksum(*parts) == reference_checksum(b"".join(parts))
+
+
+def test_incremental_update_matches_full_recompute():
+    rnd = random.Random(3)
+    for _ in range(1000):
+        data = bytearray(random_bytes(rnd, 2 * rnd.randrange(2, 60)))
+        checksum = reference_checksum(bytes(data))
+
+        start = 2 * rnd.randrange(len(data) // 2)
+        end = start + 2 * rnd.randrange(1, (len(data) - start) // 2 + 1)
+        old = bytes(data[start:end])
+        data[start:end] = random_bytes(rnd, end - start)
+
+        updated = update_checksum(checksum, old, data[start:end])
+        # 0x0000 and 0xFFFF are both representations of zero in one's complement
+        assert updated % 0xFFFF == reference_checksum(bytes(data)) % 0xFFFF
+
+
+def test_recompute_checksums_ipv4():
+    for record in read_records(io.BytesIO(build_capture(packets=300))):
+        data = bytearray(record.data)
+        headers = decode(record.linktype, data)
+        # corrupt checksums
+        data[headers.l3_offset + 10] ^= 0xFF
+        data[headers.l4_offset + 6] ^= 0x5A
+
+        assert recompute_checksums(record.linktype, data)
+
+        l3, l4 = headers.l3_offset, headers.l4_offset
+        assert internet_checksum(data[l3:l4]) == 0
+        assert internet_checksum(pseudo_header(headers.ip_src, headers.ip_dst, headers.protocol, len(data) - l4), data[l4:]) == 0
+
+
+def test_incremental_rewrite_matches_recompute_checksums():
+    rnd = random.Random(5)
+    ip_map = {bytes((10, 0, 0, i)): random_bytes(rnd, 4) for i in range(30)}
+    offsets = {ip: rnd.randrange(2 ** 32) for ip in ip_map}
+    ip_macs = {ip: bytes((8, 0, 39, 1, 0, i)) for i, ip in enumerate(ip_map.values())}
+    rewriter = PacketRewriter(RewriteMapping(ip_map=ip_map, ip_macs=ip_macs, tcp_timestamp_offsets=offsets))
+
+    for record in read_records(io.BytesIO(build_capture(seed=5, packets=300))):
+        data = bytearray(record.data)
+        recompute_checksums(record.linktype, data)
+
+        rewriter.rewrite(record.linktype, data)
+        expected = bytearray(data)
+        recompute_checksums(record.linktype, expected)
+
+        headers = decode(record.linktype, data)
+        for offset in (headers.l3_offset + 10, headers.l4_offset + (16 if headers.protocol == PROTO_TCP else 6)):
+            # 0x0000 and 0xFFFF are both representations of zero in one's complement
+            assert struct.unpack_from("!H", data, offset)[0] % 0xFFFF == struct.unpack_from("!H", expected, offset)[0] % 0xFFFF
+            data[offset:offset + 2] = expected[offset:offset + 2]
+        assert data == expected
+
+
+def test_recompute_checksums_ipv6():
+    rnd = random.Random(4)
+    for _ in range(100):
+        payload = random_bytes(rnd, rnd.randrange(0, 100))
+        src, dst = random_bytes(rnd, 16), random_bytes(rnd, 16)
+        if rnd.random() < 0.5:
+            protocol = 6
+            segment = struct.pack("!HHIIBBHHH", 80, 1024, 1, 1, 5 << 4, 0x10, 1024, 0, 0) + payload
+        else:
+            protocol = 17
+            segment = struct.pack("!HHHH", 53, 1024, 8 + len(payload), 0) + payload
+        ip = struct.pack("!IHBB", 6 << 28, len(segment), protocol, 64) + src + dst
+        data = bytearray(b"\x00" * 12 + b"\x86\xdd" + ip + segment)
+
+        assert recompute_checksums(1, data)
+        assert internet_checksum(pseudo_header(src, dst, protocol, len(segment)), data[54:]) == 0
+
+
+def test_truncated_packet_is_not_recomputed():
+    record = next(read_records(io.BytesIO(build_capture(packets=1))))
+    data = bytearray(record.data[:-1])
+    assert not recompute_checksums(record.linktype, data)
+
+
+def ipv4_fragment(src, dst, fragment, payload):
+    ip = bytearray(struct.pack("!BBHHHBBH", 0x45, 0, 20 + len(payload), 1, fragment, 64, PROTO_TCP, 0) + src + dst)
+    struct.pack_into("!H", ip, 10, internet_checksum(ip))
+    return bytearray(b"\x00" * 12 + b"\x08\x00" + ip + payload)
+
+
+def test_fragments():
+    src, dst = parse_ip("10.0.0.1"), parse_ip("10.0.0.2")
+    segment = bytearray(struct.pack("!HHIIBBHHH", 80, 1024, 1, 1, 5 << 4, 0x10, 1024, 0, 0) + bytes(range(40)))
+    struct.pack_into("!H", segment, 16, internet_checksum(pseudo_header(src, dst, PROTO_TCP, len(segment)), segment))
+    # the first fragment with more fragments flag, the second one at offset of 24 bytes
+    fragments = [ipv4_fragment(src, dst, 0x2000, segment[:24]), ipv4_fragment(src, dst, 3, segment[24:])]
+
+    # checksum of segment can't be computed from its fragments
+    for fragment in fragments:
+        original = bytes(fragment)
+        assert not recompute_checksums(1, fragment)
+        assert fragment == original
+
+    new_src = parse_ip("240.0.0.2")
+    rewriter = PacketRewriter(RewriteMapping(ip_map={src: new_src}))
+    for fragment in fragments:
+        rewriter.rewrite(1, fragment)
+        assert internet_checksum(fragment[14:34]) == 0
+    # payload of fragment without transport header is not changed
+    assert fragments[1][34:] == segment[24:]
+
+    reassembled = fragments[0][34:] + fragments[1][34:]
+    assert internet_checksum(pseudo_header(new_src, dst, PROTO_TCP, len(reassembled)), reassembled) == 0
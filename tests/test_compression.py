@@ -32,3 +32,41 @@ def test_compression():
     decompressed_file = create_empty_file()
     gzip.decompress_file(compressed_file, decompressed_file)
     assert read_file(decompressed_file) == b"TEST INPUT"
+
+
+class Collector:
+
+    def __init__(self):
+        self.data = b""
+
+    def feed(self, chunk):
+        self.data += chunk
+
+
+def test_compression_observers():
+    collector = Collector()
+
+    with tempfile.NamedTemporaryFile(mode="wb") as f:
+        f.write(b"TEST INPUT")
+        f.flush()
+
+        compressed_file = create_empty_file()
+        with open(f.name, "rb") as stream:
+            Compression.compress(stream, compressed_file, observers=[collector])
+
+    assert collector.data == b"TEST INPUT"
+
+
+def test_compressed_writer_members():
+    collector = Collector()
+    compressed_file = create_empty_file()
+
+    with Compression.open_writer(compressed_file, observers=[collector], member_size=4) as writer:
+        writer.write(b"0123456")
+        writer.write(b"789")
+
+    assert collector.data == b"0123456789"
+    assert [offset for offset, _ in writer.checkpoints] == [0, 4, 8]
+    decompressed_file = create_empty_file()
+    Compression.decompress_file(compressed_file, decompressed_file)
+    assert read_file(decompressed_file) == b"0123456789"
@@ -0,0 +1,108 @@
+import io
+import subprocess
+import pytest
+from unittest import mock
+
+from traces_api.containers import DockerRunner, ContainerPool, FifoStream
+
+
+def completed(returncode=0, stdout=b""):
+    return subprocess.CompletedProcess([], returncode, stdout, b"")
+
+
+@pytest.fixture()
+def create_pool(subprocess_run):
+    pools = []
+
+    def create(*args, **kwargs):
+        pool = ContainerPool(*args, **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield create
+
+    for pool in pools:
+        pool.close()
+
+
+@pytest.fixture()
+def subprocess_run():
+    with mock.patch("traces_api.containers.subprocess.run") as run:
+        run.return_value = completed(stdout=b"container_id\n")
+        yield run
+
+
+def test_docker_runner(subprocess_run):
+    DockerRunner().run(["python3", "script.py", "/data/file.pcap"], [("/tmp/file.pcap", "/data/file.pcap")])
+
+    command = subprocess_run.call_args[0][0]
+    assert command[:3] == ["docker", "run", "--rm"]
+    assert command[-4:] == ["trace-tools", "python3", "script.py", "/data/file.pcap"]
+    assert "/tmp/file.pcap:/data/file.pcap" in command
+
+
+def test_pool_translates_paths(subprocess_run, create_pool, tmp_path):
+    shared = str(tmp_path)
+    pool = create_pool(1, [shared])
+
+    pool.run(
+        ["tool", "-i", "/data/target.pcap", "-o", "/data/out.yml", "custom.file=/data/target.pcap"],
+        [(shared + "/input.pcap", "/data/target.pcap"), (shared + "/out", "/data/")]
+    )
+
+    start_command = subprocess_run.call_args_list[0][0][0]
+    assert start_command[:3] == ["docker", "run", "-d"]
+
+    exec_command = subprocess_run.call_args_list[-1][0][0]
+    assert exec_command[:2] == ["docker", "exec"]
+    assert exec_command[-6:] == [
+        "tool", "-i", shared + "/input.pcap", "-o", shared + "/out/out.yml", "custom.file=" + shared + "/input.pcap"
+    ]
+
+
+def test_pool_reuses_container(subprocess_run, create_pool, tmp_path):
+    pool = create_pool(2, [str(tmp_path)])
+
+    for _ in range(3):
+        pool.run(["tool"], [(str(tmp_path), "/data")])
+
+    commands = [c[0][0][:2] for c in subprocess_run.call_args_list]
+    assert commands.count(["docker", "run"]) == 1
+    assert commands.count(["docker", "exec"]) == 3
+
+
+def test_pool_recycles_container(subprocess_run, create_pool, tmp_path):
+    pool = create_pool(1, [str(tmp_path)], max_jobs=2)
+
+    for _ in range(3):
+        pool.run(["tool"], [(str(tmp_path), "/data")])
+
+    commands = [c[0][0][:2] for c in subprocess_run.call_args_list]
+    assert commands.count(["docker", "run"]) == 2
+    assert commands.count(["docker", "rm"]) == 1
+
+
+def test_pool_falls_back_outside_shared_dirs(subprocess_run, create_pool, tmp_path):
+    pool = create_pool(1, [str(tmp_path / "shared")])
+
+    pool.run(["tool"], [("/somewhere/else.pcap", "/data/file.pcap")])
+
+    assert subprocess_run.call_count == 1
+    assert subprocess_run.call_args[0][0][:3] == ["docker", "run", "--rm"]
+
+
+def test_fifo_stream():
+    output = io.BytesIO()
+
+    with FifoStream(output) as fifo:
+        # Tool process writes the file sequentially
+        subprocess.run(["sh", "-c", "printf 'first ' > {0}; printf 'second' >> {0}".format(fifo.path)], check=True)
+
+    assert output.getvalue() == b"first second"
+
+
+def test_fifo_stream_not_opened_by_tool():
+    output = io.BytesIO()
+    with FifoStream(output):
+        pass
+    assert output.getvalue() == b""
@@ -0,0 +1,43 @@
+import sqlalchemy
+
+from traces_api.database.tools import create_database
+
+
+def test_missing_columns_are_added():
+    engine = sqlalchemy.create_engine("sqlite://")
+    with engine.begin() as connection:
+        # unit table created by older version
+        connection.execute(sqlalchemy.text(
+            "CREATE TABLE unit (id_unit INTEGER PRIMARY KEY, creation_time DATETIME NOT NULL, "
+            "last_update_time DATETIME NOT NULL, annotation VARCHAR(255), ip_mac_mapping VARCHAR(255), "
+            "uploaded_file_location VARCHAR(255) NOT NULL, stage VARCHAR NOT NULL)"
+        ))
+        connection.execute(sqlalchemy.text(
+            "INSERT INTO unit VALUES (1, '2019-01-01 00:00:00', '2019-01-01 00:00:00', NULL, NULL, 'unit.pcap', 'upload')"
+        ))
+
+    create_database(engine)
+    # database is upgraded only once
+    create_database(engine)
+
+    columns = {c["name"] for c in sqlalchemy.inspect(engine).get_columns("unit")}
+    assert {"analysis", "analysis_error"} <= columns
+    with engine.connect() as connection:
+        assert connection.execute(sqlalchemy.text("SELECT stage, analysis FROM unit")).fetchall() == [("upload", None)]
+
+
+def test_missing_indexed_column_is_added():
+    engine = sqlalchemy.create_engine("sqlite://")
+    with engine.begin() as connection:
+        # mix_file_generation table created by older version
+        connection.execute(sqlalchemy.text(
+            "CREATE TABLE mix_file_generation (id_mix_generation INTEGER PRIMARY KEY, id_mix INTEGER, "
+            "creation_time DATETIME NOT NULL, file_location VARCHAR(255), expired BOOLEAN NOT NULL, "
+            "progress INTEGER NOT NULL)"
+        ))
+
+    create_database(engine)
+
+    inspector = sqlalchemy.inspect(engine)
+    assert "fingerprint" in {c["name"] for c in inspector.get_columns("mix_file_generation")}
+    assert ["fingerprint"] in [index["column_names"] for index in inspector.get_indexes("mix_file_generation")]
@@ -0,0 +1,132 @@
+import io
+import random
+import struct
+
+from traces_api.flowtable import SpillTable
+from traces_api.analysis import CaptureAnalysis, AnalysisLimits
+from traces_api.pcap import PcapWriter
+
+
+HYDRA_FILE = "tests/fixtures/hydra-1_tasks.pcap"
+
+
+def build_packet(rnd, hosts):
+    """
+    Create random Ethernet/IPv4 packet with TCP (optionally with timestamp option) or UDP payload
+    """
+    src, dst = rnd.sample(hosts, 2)
+    if rnd.random() < 0.7:
+        flags = rnd.choice((0x02, 0x12, 0x10, 0x18))
+        options = b""
+        if rnd.random() < 0.5:
+            options = b"\x01\x01\x08\x0a" + struct.pack("!II", rnd.randrange(2 ** 32), rnd.randrange(2 ** 32))
+        transport = struct.pack(
+            "!HHIIBBHHH", rnd.choice((22, 80, 443)), rnd.randrange(1024, 1100), 1, 1,
+            (20 + len(options)) // 4 << 4, flags, 1024, 0, 0
+        ) + options
+        protocol = 6
+    else:
+        transport = struct.pack("!HHHH", 53, rnd.randrange(1024, 1100), 8, 0)
+        protocol = 17
+    if rnd.random() < 0.5:
+        transport, src, dst = transport[2:4] + transport[0:2] + transport[4:], dst, src
+
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(transport), 0, 0, 64, protocol, 0, src[1], dst[1])
+    return dst[0] + src[0] + b"\x08\x00" + ip + transport
+
+
+def build_capture(seed=1, packets=2000, hosts=30):
+    """
+    Create pcap file with random traffic among given number of hosts
+
+    :return: bytes of pcap file
+    """
+    rnd = random.Random(seed)
+    hosts = [(bytes((8, 0, 39, 0, 0, i)), bytes((10, 0, i // 256, i % 256))) for i in range(hosts)]
+
+    stream = io.BytesIO()
+    writer = PcapWriter(stream)
+    timestamp = 1500000000 * 10 ** 9
+    for _ in range(packets):
+        timestamp += rnd.randrange(-1000, 10 ** 6)
+        writer.write(timestamp, build_packet(rnd, hosts))
+    return stream.getvalue()
+
+
+def analyze(data, chunk_size=4096, **kwargs):
+    analysis = CaptureAnalysis("capture.pcap", **kwargs)
+    for i in range(0, len(data), chunk_size):
+        analysis.feed(data[i:i + chunk_size])
+    return analysis
+
+
+def test_spill_table_merge():
+    table = SpillTable("<4sQQ", combine=lambda old, new: (old[0], old[1] + new[1], old[2]))
+    table.spill([(b"bbbb", 1, 1), (b"aaaa", 2, 1)])
+    table.spill([(b"cccc", 1, 2), (b"bbbb", 5, 2)])
+    table.spill([(b"aaaa", 1, 3)])
+
+    assert list(table.merge()) == [(b"aaaa", 3, 1), (b"bbbb", 6, 1), (b"cccc", 1, 2)]
+    table.close()
+    assert table.runs == 0
+
+
+def test_spilled_analysis_is_exact():
+    data = build_capture()
+    expected = analyze(data).result()
+
+    analysis = analyze(data, spill_max_entries=20)
+    runs = analysis._spill_tables["conversations"].runs
+    result = analysis.result()
+
+    assert runs > 1
+    assert result == expected
+
+
+def test_spilled_analysis_hydra():
+    with open(HYDRA_FILE, "rb") as f:
+        data = f.read()
+
+    assert analyze(data, spill_max_entries=3).result() == analyze(data).result()
+
+
+def test_spilled_analysis_with_approximate_threshold():
+    data = build_capture()
+    expected = analyze(data).result()
+
+    # file is below approximate threshold, tables are spilled
+    analysis = analyze(data, limits=AnalysisLimits(), approximate_threshold=len(data) + 1, spill_max_entries=20)
+    assert analysis._spill_tables["conversations"].runs > 1
+    assert analysis.result() == expected
+
+    # tables were spilled before the threshold was reached, analysis stays exact
+    analysis = analyze(data, limits=AnalysisLimits(), approximate_threshold=len(data) // 2, spill_max_entries=20)
+    assert analysis.result() == expected
+
+
+def test_spilled_analysis_memory_is_bounded():
+    # gateway mac is associated with every ip it carries
+    gateway, host = bytes((8, 0, 39, 0, 0, 1)), bytes((8, 0, 39, 0, 0, 2))
+    stream = io.BytesIO()
+    writer = PcapWriter(stream)
+    for i in range(3000):
+        transport = struct.pack("!HHHH", 1024 + i % 100, 53, 8, 0)
+        ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 28, 0, 0, 64, 17, 0, bytes((10, 1, i // 256, i % 256)), bytes((10, 0, 0, 1)))
+        writer.write((1500000000 + i) * 10 ** 9, host + gateway + b"\x08\x00" + ip + transport)
+    data = stream.getvalue()
+
+    analysis = CaptureAnalysis("capture.pcap", spill_max_entries=100)
+    in_memory = []
+    for i in range(0, len(data), 1024):
+        analysis.feed(data[i:i + 1024])
+        in_memory.append(max(
+            len(analysis._conversations), len(analysis._ip_occurrences), len(analysis._flows),
+            len(analysis._pairs_src), len(analysis._pairs_dst),
+            sum(len(ips) for ips in analysis._mac_associations.values()),
+        ))
+
+    assert max(in_memory) <= 100
+    result = analysis.result()
+    assert result == analyze(data).result()
+    associations = {a["mac"]: a["ips"] for a in result["mac.associations"]}
+    assert len(associations["08:00:27:00:00:01"]) == 3000
@@ -0,0 +1,85 @@
+import io
+import gzip
+
+from traces_api.compression import Compression
+from traces_api.index import PacketIndex, PacketIndexBuilder, INDEX_SUFFIX
+from traces_api.pcap import read_records
+from traces_api.storage import FileStorage
+
+from tests.test_flowtable import build_capture
+
+
+HYDRA_FILE = "tests/fixtures/hydra-1_tasks.pcap"
+
+
+def build_index(data, tmp_path, member_size=4096):
+    location = str(tmp_path / "capture.pcap.gz")
+    builder = PacketIndexBuilder()
+    checkpoints = Compression.compress(io.BytesIO(data), location, [builder], member_size=member_size)
+    return location, builder.build(checkpoints)
+
+
+def test_index_round_trip(tmp_path):
+    data = build_capture(packets=500)
+    location, index = build_index(data, tmp_path)
+
+    index.save(location + INDEX_SUFFIX)
+    loaded = PacketIndex.load(location + INDEX_SUFFIX)
+
+    records = list(read_records(io.BytesIO(data)))
+    assert len(loaded) == len(records) == 500
+    assert list(loaded.offsets) == [record.offset for record in records]
+    assert list(loaded.timestamps) == [record.timestamp for record in records]
+    assert list(loaded.hashes) == list(index.hashes)
+    assert loaded.checkpoints == index.checkpoints
+    assert len(loaded.checkpoints) > 1
+    assert loaded.data_offset == 24
+    assert loaded.headers_complete
+
+
+def test_multi_member_file_is_valid_gzip(tmp_path):
+    data = build_capture(packets=500)
+    location, _ = build_index(data, tmp_path)
+
+    with gzip.open(location, "rb") as f:
+        assert f.read() == data
+
+
+def test_read_chunks_from_offset(tmp_path):
+    data = build_capture(packets=500)
+    location, index = build_index(data, tmp_path)
+
+    for offset, end in ((0, None), (5000, None), (index.offsets[300], index.offsets[400]), (4096, 8192)):
+        assert b"".join(index.read_chunks(location, offset, end)) == data[offset:end]
+
+
+def test_find_time_range(tmp_path):
+    with open(HYDRA_FILE, "rb") as f:
+        data = f.read()
+    _, index = build_index(data, tmp_path)
+
+    start, end = index.timestamps[10], index.timestamps[20]
+    positions = index.find_time_range(start, end)
+    expected = [i for i, timestamp in enumerate(index.timestamps) if start <= timestamp <= end]
+    assert positions == expected
+    assert index.find_time_range() == list(range(len(index)))
+
+
+def test_invalid_capture_has_no_index(tmp_path):
+    _, index = build_index(b"INVALID", tmp_path)
+    assert index is None
+
+
+def test_storage_index(tmp_path):
+    with open(HYDRA_FILE, "rb") as f:
+        data = f.read()
+    storage = FileStorage(str(tmp_path), Compression(), subdirectories=False)
+
+    file_name = storage.save_file(io.BytesIO(data), "pcap")
+    file = storage.get_file(file_name)
+    index = file.index()
+    assert index is not None
+    assert len(index) == len(list(read_records(io.BytesIO(data))))
+
+    storage.remove_file(file_name)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,181 @@
+import sys
+import threading
+from unittest import mock
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy
+import sqlalchemy.orm
+from sqlalchemy.pool import StaticPool
+
+from traces_api.database.model.job import ModelJob
+from traces_api.jobs import JobQueue, JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING
+from traces_api.worker import Worker, run_worker
+from traces_api.database.tools import recreate_database
+
+
+@pytest.fixture()
+def sqlite_session():
+    engine = sqlalchemy.create_engine("sqlite://", connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    recreate_database(engine)
+    session = sqlalchemy.orm.scoped_session(sqlalchemy.orm.sessionmaker(bind=engine))
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def test_claim_and_complete(sqlalchemy_session):
+    queue = JobQueue(sqlalchemy_session)
+    id_job = queue.enqueue("test", dict(value=1))
+
+    job = queue.claim("worker-1")
+    assert (job.id_job, job.type, job.payload, job.attempts) == (id_job, "test", dict(value=1), 1)
+    # job is claimed only once
+    assert queue.claim("worker-2") is None
+
+    assert queue.complete(job)
+    assert queue.get_job(id_job).status == JOB_DONE
+
+
+def test_failed_job_is_retried(sqlalchemy_session):
+    queue = JobQueue(sqlalchemy_session, max_attempts=2, retry_delay=0)
+    id_job = queue.enqueue("test", {})
+
+    assert queue.fail(queue.claim("worker-1"), "error")
+    assert queue.get_job(id_job).status == JOB_QUEUED
+
+    job = queue.claim("worker-1")
+    assert job.attempts == 2
+    assert queue.fail(job, "error") is False
+    job = queue.get_job(id_job)
+    assert (job.status, job.error) == (JOB_FAILED, "error")
+
+
+def test_stale_job_is_recovered(sqlalchemy_session):
+    queue = JobQueue(sqlalchemy_session, retry_delay=0, stale_timeout=60)
+    id_job = queue.enqueue("test", {})
+    queue.claim("worker-1")
+
+    assert queue.recover_stale() == []
+    sqlalchemy_session.query(ModelJob).filter(ModelJob.id_job == id_job)\
+        .update(dict(heartbeat_time=datetime.now() - timedelta(seconds=120)))
+    sqlalchemy_session.commit()
+
+    assert queue.recover_stale() == [id_job]
+    assert queue.get_job(id_job).status == JOB_QUEUED
+    assert queue.claim("worker-2").attempts == 2
+
+
+def test_recovered_attempt_does_not_change_job(sqlalchemy_session):
+    queue = JobQueue(sqlalchemy_session, retry_delay=0, stale_timeout=60)
+    id_job = queue.enqueue("test", {})
+    stale = queue.claim("worker-1")
+    sqlalchemy_session.query(ModelJob).filter(ModelJob.id_job == id_job)\
+        .update(dict(heartbeat_time=datetime.now() - timedelta(seconds=120)))
+    sqlalchemy_session.commit()
+    assert queue.recover_stale() == [id_job]
+
+    # attempt of crashed worker finishes after the job was recovered
+    assert queue.fail(stale, "error") is None
+    assert queue.get_job(id_job).status == JOB_QUEUED
+
+    job = queue.claim("worker-1")
+    assert not queue.complete(stale)
+    assert queue.fail(stale, "error") is None
+    assert queue.get_job(id_job).status == JOB_RUNNING
+
+    assert queue.complete(job)
+    assert queue.get_job(id_job).status == JOB_DONE
+
+
+def test_worker_runs_jobs(sqlalchemy_session):
+    queue = JobQueue(sqlalchemy_session, max_attempts=1)
+    processed = []
+
+    def handler(payload):
+        if payload["value"] < 0:
+            raise ValueError("negative value")
+        processed.append(payload["value"])
+
+    ids = [queue.enqueue("test", dict(value=value)) for value in (1, -1, 2)]
+    failed = []
+    worker = Worker(
+        queue, {"test": handler}, "worker-1", {"test": lambda payload, error: failed.append((payload, error))},
+        heartbeat_interval=0.01
+    )
+    while worker.run_once():
+        pass
+
+    assert processed == [1, 2]
+    assert failed == [(dict(value=-1), "negative value")]
+    assert [queue.get_job(id_job).status for id_job in ids] == [JOB_DONE, JOB_FAILED, JOB_DONE]
+    assert queue.get_job(ids[1]).error == "negative value"
+
+
+
+def test_worker_handles_permanently_failed_stale_job(sqlalchemy_session):
+    queue = JobQueue(sqlalchemy_session, max_attempts=1, stale_timeout=60)
+    id_job = queue.enqueue("test", dict(value=1))
+    queue.claim("worker-1")
+    sqlalchemy_session.query(ModelJob).filter(ModelJob.id_job == id_job)\
+        .update(dict(heartbeat_time=datetime.now() - timedelta(seconds=120)))
+    sqlalchemy_session.commit()
+
+    failed = []
+    worker = Worker(queue, {}, "worker-2", {"test": lambda payload, error: failed.append((payload, error))})
+    assert not worker.run_once()
+
+    assert failed == [(dict(value=1), "Worker stopped responding")]
+    assert queue.get_job(id_job).status == JOB_FAILED
+def test_worker_sends_heartbeats(sqlalchemy_session):
+    queue = JobQueue(sqlalchemy_session)
+    id_job = queue.enqueue("test", {})
+    heartbeats = []
+
+    def handler(payload):
+        started = queue.get_job(id_job).heartbeat_time
+        threading.Event().wait(0.2)
+        sqlalchemy_session.expire_all()
+        heartbeats.append((started, queue.get_job(id_job).heartbeat_time))
+
+    Worker(queue, {"test": handler}, "worker-1", heartbeat_interval=0.05).run_once()
+
+    (started, last), = heartbeats
+    assert last > started
+    assert queue.get_job(id_job).status == JOB_DONE
+
+
+def test_claim_on_sqlite(sqlite_session):
+    # SQLite does not support SKIP LOCKED, jobs are claimed by conditional update
+    queue = JobQueue(sqlite_session)
+    ids = [queue.enqueue("test", dict(value=value)) for value in (1, 2)]
+
+    jobs = [queue.claim("worker-1"), queue.claim("worker-2")]
+    assert [(job.id_job, job.payload, job.worker) for job in jobs] == [
+        (ids[0], dict(value=1), "worker-1"), (ids[1], dict(value=2), "worker-2")
+    ]
+    assert queue.claim("worker-3") is None
+
+    assert queue.complete(jobs[0])
+    assert queue.fail(jobs[1], "error")
+    assert [queue.get_job(id_job).status for id_job in ids] == [JOB_DONE, JOB_QUEUED]
+
+
+def test_worker_process_closes_tool_runner():
+    from traces_api.modules.mix.service import MixService
+    from traces_api.containers import DockerRunner
+
+    runner = mock.Mock()
+    app = mock.Mock()
+    app.prepare_database.return_value = (None, None)
+    app.FlaskApp.return_value.create_services.return_value = {
+        MixService: mock.Mock(), JobQueue: mock.Mock(), DockerRunner: runner
+    }
+
+    with mock.patch.dict(sys.modules, app=app), mock.patch("traces_api.worker.signal.signal"), \
+            mock.patch.object(Worker, "run", side_effect=RuntimeError("database is not available")):
+        with pytest.raises(RuntimeError):
+            run_worker("config_tests.ini")
+
+    runner.close.assert_called_once_with()
@@ -0,0 +1,168 @@
+import io
+import gzip
+import pytest
+
+from traces_api.merge import MixRewriteMapping, merge_captures, read_packets
+from traces_api.packet import decode, parse_ip, parse_mac
+from traces_api.pcap import PcapWriter, read_records
+from traces_api.trace_tools import MergeTraceMixer, TraceMixer, TraceMixerError, TraceMixing
+
+from tests.test_flowtable import build_capture
+from tests.test_rewrite import with_valid_checksums
+
+
+CONFIGURATION = {
+    "ip.map": [
+        dict(ip=dict(old="10.0.0.1", new="192.168.0.1")),
+        dict(ip=dict(old="10.0.0.2", new="192.168.0.2")),
+    ],
+    "mac.map": [dict(mac=dict(old="08:00:27:00:00:01", new="00:11:22:33:44:55"))],
+    "port.ip.map": [dict(ip="10.0.0.1", port_mappings=[dict(original=80, replacement=8080)])],
+}
+
+
+def sorted_capture(tmp_path, name, seed, packets, compress=False):
+    """
+    Create capture file with packets ordered by timestamp
+    """
+    records = sorted(read_records(io.BytesIO(build_capture(seed=seed, packets=packets, hosts=4))), key=lambda r: r.timestamp)
+    stream = io.BytesIO()
+    writer = PcapWriter(stream, nanosecond=True)
+    for record in records:
+        writer.write(record.timestamp, with_valid_checksums(record.data, udp_checksum=True))
+
+    path = tmp_path / name
+    path.write_bytes(gzip.compress(stream.getvalue()) if compress else stream.getvalue())
+    return str(path)
+
+
+def test_merge_skips_packets_of_other_link_types(caplog):
+    ethernet = [(i, 1, b"\x00" * 60, 60) for i in range(3)]
+    raw = [(i, 101, b"\x45" + b"\x00" * 39, 40) for i in range(2)]
+
+    output = io.BytesIO()
+    assert merge_captures([ethernet, raw], output) == 3
+    assert len(list(read_records(io.BytesIO(output.getvalue())))) == 3
+    assert "Skipped 2 packets" in caplog.text
+
+
+def test_failed_merge_removes_temporary_file(tmp_path):
+    invalid = tmp_path / "invalid.pcap"
+    invalid.write_bytes(b"INVALID")
+    mixer = MergeTraceMixer(str(tmp_path / "mix.pcap"))
+    mixer.resume(sorted_capture(tmp_path, "base.pcap", seed=1, packets=10))
+
+    with pytest.raises(TraceMixerError):
+        mixer.mix(str(invalid), MergeTraceMixer.prepare_configuration(None, None, None), 1500000000)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["base.pcap", "invalid.pcap", "mix.pcap"]
+
+
+def test_mapping_rewrites_addresses_and_ports():
+    mapping = MixRewriteMapping.from_configuration(CONFIGURATION)
+
+    rewritten = 0
+    for i, record in enumerate(read_records(io.BytesIO(build_capture(packets=500, hosts=4)))):
+        original = decode(record.linktype, with_valid_checksums(record.data, udp_checksum=i % 2 == 0))
+        data = bytearray(with_valid_checksums(record.data, udp_checksum=i % 2 == 0))
+        mapping.rewrite(record.linktype, data)
+        headers = decode(record.linktype, data)
+
+        assert bytes(data) == with_valid_checksums(data)
+        assert headers.ip_src == mapping.ip_map.get(original.ip_src, original.ip_src)
+        assert headers.eth_dst == mapping.mac_map.get(original.eth_dst, original.eth_dst)
+        if original.ip_src == parse_ip("10.0.0.1") and original.src_port == 80:
+            assert headers.src_port == 8080
+            rewritten += 1
+        elif original.ip_dst == parse_ip("10.0.0.1") and original.dst_port == 80:
+            assert headers.dst_port == 8080
+            rewritten += 1
+        else:
+            assert (headers.src_port, headers.dst_port) == (original.src_port, original.dst_port)
+    assert rewritten > 0
+    assert mapping.mac_map == {parse_mac("08:00:27:00:00:01"): parse_mac("00:11:22:33:44:55")}
+
+
+def test_merge_captures_orders_packets(tmp_path):
+    base = sorted_capture(tmp_path, "base.pcap", seed=1, packets=300)
+    unit_1 = sorted_capture(tmp_path, "unit_1.pcap.gz", seed=2, packets=200, compress=True)
+    unit_2 = sorted_capture(tmp_path, "unit_2.pcap", seed=3, packets=100)
+
+    output = io.BytesIO()
+    packets = merge_captures([
+        read_packets(base),
+        read_packets(unit_1, MixRewriteMapping(), at_timestamp=1500000000.5),
+        read_packets(unit_2, MixRewriteMapping.from_configuration(CONFIGURATION), at_timestamp=1500000100),
+    ], output)
+
+    records = list(read_records(io.BytesIO(output.getvalue())))
+    timestamps = [record.timestamp for record in records]
+    assert packets == len(records) == 600
+    assert timestamps == sorted(timestamps)
+    assert 1500000000500000000 in timestamps
+    assert min(t for t, _, _, _ in read_packets(unit_2, at_timestamp=1500000100)) == 1500000100000000000
+
+
+def test_merge_mixer_single_pass_equals_chained(tmp_path):
+    units = [
+        (sorted_capture(tmp_path, "unit_1.pcap.gz", seed=2, packets=200, compress=True), 1500000010),
+        (sorted_capture(tmp_path, "unit_2.pcap.gz", seed=3, packets=200, compress=True), 1500000020),
+    ]
+    mixing = TraceMixing(timestamp_generation="shift")
+
+    single = mixing.create_new_mixer(str(tmp_path / "single.pcap"))
+    assert isinstance(single, MergeTraceMixer) and single.SINGLE_PASS
+    single.mix_all([
+        (location, single.prepare_configuration(None, None, CONFIGURATION["port.ip.map"]), at_timestamp)
+        for location, at_timestamp in units
+    ])
+
+    chained = mixing.create_new_mixer(str(tmp_path / "chained.pcap"))
+    for location, at_timestamp in units:
+        chained.mix(location, chained.prepare_configuration(None, None, CONFIGURATION["port.ip.map"]), at_timestamp)
+
+    with open(single.get_mixed_file_location(), "rb") as f:
+        mixed = f.read()
+    with open(chained.get_mixed_file_location(), "rb") as f:
+        assert f.read() == mixed
+    assert len(list(read_records(io.BytesIO(mixed)))) > 400
+
+
+def test_prepared_units_give_the_same_mix(tmp_path):
+    units = [
+        (sorted_capture(tmp_path, "unit_1.pcap.gz", seed=2, packets=200, compress=True), 1500000010),
+        (sorted_capture(tmp_path, "unit_2.pcap.gz", seed=3, packets=200, compress=True), 1500000020),
+    ]
+    mixing = TraceMixing(timestamp_generation="shift")
+
+    mixer = mixing.create_new_mixer(str(tmp_path / "mix.pcap"))
+    mixer.mix_all([(location, mixer.prepare_configuration(None, None, None), at_timestamp) for location, at_timestamp in units])
+
+    prepared_mixer = mixing.create_new_mixer(str(tmp_path / "prepared_mix.pcap"))
+    prepared = [
+        prepared_mixer.prepare(
+            location, prepared_mixer.prepare_configuration(None, None, None), at_timestamp, str(tmp_path / ("prepared_%s.pcap" % i))
+        ) for i, (location, at_timestamp) in enumerate(units)
+    ]
+    # prepared units are already shifted
+    assert [at_timestamp for _, _, at_timestamp in prepared] == [None, None]
+    prepared_mixer.mix_all(prepared)
+
+    with open(mixer.get_mixed_file_location(), "rb") as f, open(prepared_mixer.get_mixed_file_location(), "rb") as f_prepared:
+        assert f.read() == f_prepared.read()
+
+
+def test_prepare_for_id2t_rewrites_addresses(tmp_path):
+    unit = sorted_capture(tmp_path, "unit.pcap.gz", seed=2, packets=200, compress=True)
+    config = TraceMixer.prepare_configuration(None, None, CONFIGURATION["port.ip.map"])
+    config["ip.map"] = CONFIGURATION["ip.map"]
+
+    location, prepared_config, at_timestamp = TraceMixer.prepare(unit, config, 1500000010, str(tmp_path / "prepared.pcap"))
+
+    mapping = MixRewriteMapping.from_configuration(config)
+    expected = io.BytesIO()
+    merge_captures([read_packets(unit, mapping)], expected, nanosecond=False)
+    with open(location, "rb") as f:
+        assert f.read() == expected.getvalue()
+    assert prepared_config["ip.map"] == prepared_config["port.ip.map"] == []
+    assert prepared_config["timestamp"] == config["timestamp"]
+    assert at_timestamp == 1500000010
@@ -0,0 +1,90 @@
+import io
+import pytest
+
+from traces_api.pcap import PcapParser, PcapWriter, PcapError, read_records
+from traces_api.packet import decode, format_ip, format_mac, find_tcp_timestamp
+
+
+@pytest.fixture()
+def hydra_1_binary():
+    with open("tests/fixtures/hydra-1_tasks.pcap", "rb") as f:
+        return f.read()
+
+
+def test_read_pcapng(hydra_1_binary):
+    parser = PcapParser()
+    records = list(read_records(io.BytesIO(hydra_1_binary), parser))
+
+    assert parser.format == "pcapng"
+    assert len(records) == 2486
+    assert [r.number for r in records[:3]] == [0, 1, 2]
+
+    headers = decode(records[0].linktype, records[0].data)
+    assert format_mac(headers.eth_src) == "08:00:27:90:8f:c4"
+    assert format_ip(headers.ip_src) == "240.0.1.2"
+    assert format_ip(headers.ip_dst) == "240.125.0.2"
+    assert headers.dst_port == 22
+    assert find_tcp_timestamp(records[0].data, headers) is not None
+
+
+def test_read_empty_pcap():
+    with open("tests/fixtures/empty.pcap", "rb") as f:
+        parser = PcapParser()
+        assert list(read_records(f, parser)) == []
+    assert parser.format == "pcap"
+
+
+def test_feed_in_chunks(hydra_1_binary):
+    expected = list(read_records(io.BytesIO(hydra_1_binary)))
+
+    parser = PcapParser()
+    records = []
+    for i in range(0, len(hydra_1_binary), 1000):
+        records += parser.feed(hydra_1_binary[i:i + 1000])
+    parser.close()
+
+    assert records == expected
+
+
+def test_truncated_file(hydra_1_binary):
+    with pytest.raises(PcapError):
+        list(read_records(io.BytesIO(hydra_1_binary[:-10])))
+
+
+def test_unknown_format():
+    with pytest.raises(PcapError):
+        list(read_records(io.BytesIO(b"NOT A PCAP FILE AT ALL, REALLY")))
+
+
+def test_write_and_read(hydra_1_binary):
+    records = list(read_records(io.BytesIO(hydra_1_binary)))
+
+    output = io.BytesIO()
+    writer = PcapWriter(output)
+    for r in records:
+        writer.write(r.timestamp, r.data, r.orig_len)
+
+    parser = PcapParser()
+    written = list(read_records(io.BytesIO(output.getvalue()), parser))
+
+    assert parser.format == "pcap"
+    assert [(r.timestamp, r.data, r.orig_len) for r in written] == [(r.timestamp, r.data, r.orig_len) for r in records]
+    assert written[1].offset == 24 + 16 + len(records[0].data)
+
+
+def test_record_offsets_in_chunks(hydra_1_binary):
+    output = io.BytesIO()
+    writer = PcapWriter(output)
+    for r in read_records(io.BytesIO(hydra_1_binary)):
+        writer.write(r.timestamp, r.data, r.orig_len)
+    binary = output.getvalue()
+
+    parser = PcapParser()
+    records = []
+    for i in range(0, len(binary), 1000):
+        records += parser.feed(binary[i:i + 1000])
+    parser.close()
+
+    # offset points to record header in file
+    for r in records:
+        assert binary[r.offset + 16:r.offset + 16 + len(r.data)] == r.data
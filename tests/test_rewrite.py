@@ -0,0 +1,204 @@
+import io
+import gzip
+import struct
+import pytest
+
+from traces_api.analysis import CaptureAnalysis
+from traces_api.packet import decode, find_tcp_timestamp, parse_ip, PROTO_UDP
+from traces_api.pcap import read_records
+from traces_api.rewrite import RewriteMapping, PacketRewriter, rewrite_capture, rewrite_capture_parallel, plan_chunks
+from traces_api.compression import Compression
+from traces_api.checksum import recompute_checksums
+from traces_api.storage import FileStorage
+from traces_api.trace_tools import NativeTraceNormalizer, TraceNormalizerError
+
+from tests.test_flowtable import build_capture
+
+
+HYDRA_FILE = "tests/fixtures/hydra-1_tasks.pcap"
+
+
+def with_valid_checksums(data, udp_checksum=False):
+    data = bytearray(data)
+    headers = decode(1, data)
+    if udp_checksum and headers.protocol == PROTO_UDP:
+        # generated packets don't use UDP checksum
+        data[headers.l4_offset + 7] = 1
+    recompute_checksums(1, data)
+    return bytes(data)
+
+
+CONFIGURATION = {
+    "ip.groups": {
+        "source": ["10.0.0.1", "10.0.0.2"],
+        "intermediate": ["10.0.0.3"],
+        "destination": ["10.0.0.4", "10.0.0.5"],
+    },
+    "mac.associations": [dict(mac="08:00:27:00:00:05", ips=["10.0.0.9", "10.0.0.4"])],
+    "tcp.timestamp.min": [dict(ip="10.0.0.1", min=100000), dict(ip="10.0.0.3", min=4000000000)],
+}
+
+
+def test_mapping():
+    mapping = RewriteMapping.from_configuration(CONFIGURATION)
+
+    assert mapping.ip_map[parse_ip("10.0.0.2")] == parse_ip("240.0.0.3")
+    assert mapping.ip_map[parse_ip("10.0.0.4")] == parse_ip("240.170.0.2")
+    assert mapping.mac_map[bytes((8, 0, 39, 0, 0, 5))] == bytes((8, 0, 39, 170, 0, 0))
+    assert mapping.labels() == {"ip": {
+        "ip.source": ["240.0.0.2", "240.0.0.3"],
+        "ip.intermediate": ["240.85.0.2"],
+        "ip.destination": ["240.170.0.2", "240.170.0.3"],
+    }}
+
+
+def test_ipv6_addresses_are_rejected(tmp_path):
+    configuration = {"ip.groups": {"destination": ["10.0.0.4", "2001:db8::1"]}}
+    with pytest.raises(ValueError):
+        RewriteMapping.from_configuration(configuration)
+
+    capture = tmp_path / "capture.pcap"
+    capture.write_bytes(build_capture(packets=10))
+    with pytest.raises(TraceNormalizerError):
+        NativeTraceNormalizer().normalize(str(capture), str(tmp_path / "output.pcap"), configuration)
+
+
+def test_rewritten_checksums_are_valid():
+    mapping = RewriteMapping.from_configuration(CONFIGURATION)
+    rewriter = PacketRewriter(mapping)
+
+    packets = 0
+    for i, record in enumerate(read_records(io.BytesIO(build_capture(packets=500, hosts=6)))):
+        original = with_valid_checksums(record.data, udp_checksum=i % 2 == 0)
+        data = bytearray(original)
+        rewriter.rewrite(record.linktype, data)
+
+        headers = decode(record.linktype, data)
+        assert bytes(data) == with_valid_checksums(data)
+        assert headers.ip_src in mapping.ip_map.values() or headers.ip_src == decode(1, original).ip_src
+        if headers.protocol == PROTO_UDP:
+            # zero UDP checksum (not used) is kept
+            checksum_offset = headers.l4_offset + 6
+            assert (data[checksum_offset:checksum_offset + 2] == b"\x00\x00") == (original[checksum_offset:checksum_offset + 2] == b"\x00\x00")
+        packets += 1
+    assert packets == 500
+
+
+def test_tcp_timestamps():
+    mapping = RewriteMapping.from_configuration(CONFIGURATION)
+    rewriter = PacketRewriter(mapping)
+    offsets = mapping.tcp_timestamp_offsets
+
+    for record in read_records(io.BytesIO(build_capture(packets=500, hosts=6))):
+        original = decode(record.linktype, record.data)
+        offset = find_tcp_timestamp(record.data, original)
+        if offset is None:
+            continue
+        data = bytearray(record.data)
+        rewriter.rewrite(record.linktype, data)
+
+        tsval, tsecr = struct.unpack_from("!II", record.data, offset)
+        new_tsval, new_tsecr = struct.unpack_from("!II", data, offset)
+        assert new_tsval == (tsval - offsets.get(original.ip_src, 0)) & 0xFFFFFFFF
+        if original.tcp_flags & 0x10:
+            assert new_tsecr == (tsecr - offsets.get(original.ip_dst, 0)) & 0xFFFFFFFF
+        else:
+            assert new_tsecr == tsecr
+
+
+def test_rewrite_capture_resets_timestamps():
+    output = io.BytesIO()
+    packets = rewrite_capture(io.BytesIO(build_capture(packets=100)), output, RewriteMapping())
+
+    records = list(read_records(io.BytesIO(output.getvalue())))
+    assert packets == len(records) == 100
+    assert records[0].timestamp == 0
+
+
+def test_native_normalizer(tmp_path):
+    configuration = {
+        "ip.groups": {
+            "source": ["240.0.1.2"],
+            "intermediate": ["240.125.0.2"],
+            "destination": ["240.125.1.2"],
+        },
+        "mac.associations": {},
+        "tcp.timestamp.min": [],
+    }
+    output = str(tmp_path / "output.pcap")
+
+    labels = NativeTraceNormalizer().normalize(HYDRA_FILE, output, configuration)
+    result = CaptureAnalysis.analyze_file(output)
+
+    assert labels["ip"]["ip.source"] == ["240.0.0.2"]
+    assert {(pair["MAC"], pair["IP"]) for pair in result["pairs_mac_ip"]} == {
+        ("08:00:27:00:00:00", "240.0.0.2"),
+        ("08:00:27:55:00:00", "240.85.0.2"),
+    }
+
+
+def test_native_normalizer_to_storage(tmp_path):
+    storage = FileStorage(str(tmp_path), Compression(), subdirectories=False)
+    configuration = dict(CONFIGURATION, **{"tcp.timestamp.min": []})
+    data = build_capture(packets=200, hosts=6)
+    capture = tmp_path / "capture.pcap"
+    capture.write_bytes(data)
+
+    with storage.create_file("pcap") as f:
+        NativeTraceNormalizer().normalize_stream(str(capture), f, configuration)
+
+    stored = storage.get_file(f.file_name)
+    expected = io.BytesIO()
+    rewrite_capture(io.BytesIO(data), expected, RewriteMapping.from_configuration(configuration))
+    with gzip.open(stored.location, "rb") as stored_capture:
+        assert stored_capture.read() == expected.getvalue()
+    assert len(stored.index()) == 200
+
+
+def test_failed_normalization_removes_file(tmp_path):
+    storage = FileStorage(str(tmp_path / "storage"), Compression(), subdirectories=False)
+    (tmp_path / "storage").mkdir()
+    capture = tmp_path / "capture.pcap"
+    capture.write_bytes(b"INVALID")
+
+    with pytest.raises(TraceNormalizerError):
+        with storage.create_file("pcap") as f:
+            NativeTraceNormalizer().normalize_stream(str(capture), f, CONFIGURATION)
+    assert list((tmp_path / "storage").iterdir()) == []
+
+
+def rewrite_serial(location, mapping):
+    expected = io.BytesIO()
+    with open(location, "rb") as f:
+        rewrite_capture(f, expected, mapping)
+    return expected.getvalue()
+
+
+@pytest.mark.parametrize("chunk_size", [1000, 20000])
+def test_rewrite_capture_parallel_is_identical(tmp_path, chunk_size):
+    capture = tmp_path / "capture.pcap"
+    capture.write_bytes(build_capture(packets=2000, hosts=6))
+    mapping = RewriteMapping.from_configuration(CONFIGURATION)
+
+    output = io.BytesIO()
+    packets = rewrite_capture_parallel(str(capture), output, mapping, chunk_size, workers=3)
+
+    assert packets == 2000
+    assert output.getvalue() == rewrite_serial(str(capture), mapping)
+
+
+def test_rewrite_capture_parallel_from_storage(tmp_path):
+    storage = FileStorage(str(tmp_path), Compression(), subdirectories=False)
+    with open(HYDRA_FILE, "rb") as f:
+        stored = storage.get_file(storage.save_file(f, "pcap"))
+    configuration = {
+        "ip.groups": {"source": ["240.0.1.2"], "intermediate": ["240.125.0.2"], "destination": ["240.125.1.2"]},
+    }
+
+    output = io.BytesIO()
+    NativeTraceNormalizer(chunk_size=10000, workers=2).normalize_stream(stored.location, output, configuration)
+
+    assert len(plan_chunks(stored.location, 10000, stored.index()).chunks) > 2
+    # compressed pcapng file can't be split without index
+    assert plan_chunks(stored.location, 10000) is None
+    assert output.getvalue() == rewrite_serial(HYDRA_FILE, RewriteMapping.from_configuration(configuration))
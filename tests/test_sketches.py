@@ -0,0 +1,46 @@
+import random
+
+from traces_api.sketches import HyperLogLog, HeavyHitters
+
+
+def test_hyperloglog_small():
+    hll = HyperLogLog()
+    for i in range(100):
+        hll.add("10.0.0.%d" % (i % 50))
+
+    assert hll.count() == 50
+
+
+def test_hyperloglog_large():
+    hll = HyperLogLog()
+    for i in range(100000):
+        hll.add(i.to_bytes(4, "big"))
+
+    assert abs(hll.count() - 100000) < 100000 * 0.05
+
+
+def test_hyperloglog_merge():
+    hll_1 = HyperLogLog()
+    hll_2 = HyperLogLog()
+    for i in range(1000):
+        hll_1.add(str(i))
+        hll_2.add(str(i + 500))
+    hll_1.merge(hll_2)
+
+    assert abs(hll_1.count() - 1500) < 1500 * 0.05
+
+
+def test_heavy_hitters():
+    rnd = random.Random(42)
+    table = HeavyHitters(10, weight=lambda value: value[0])
+
+    # 5 heavy keys hidden in many light ones
+    for i in range(10000):
+        key = "heavy-%d" % (i % 5) if i % 2 == 0 else "light-%d" % rnd.randrange(1000)
+        table.setdefault(key, [0])[0] += 1
+        table.prune_if_full()
+    table.prune()
+
+    assert len(table) <= 10
+    assert table.truncated
+    assert {"heavy-%d" % i for i in range(5)} <= set(table)
@@ -0,0 +1,70 @@
+import time
+import threading
+import subprocess
+import pytest
+
+from traces_api.tasks import TaskGraph, TaskError
+from traces_api.trace_tools import TraceAnalyzer, TraceAnalyzerError
+
+
+class FailingRunner:
+
+    def __init__(self, failing_script):
+        self._failing_script = failing_script
+
+    def run(self, command, volumes):
+        if self._failing_script in command[1]:
+            return subprocess.CompletedProcess(command, 1, b"", b"")
+        return subprocess.CompletedProcess(command, 0, b"[]\n[]\n{}\n", b"")
+
+
+def test_dependencies():
+    graph = TaskGraph()
+    graph.add("a", lambda: 1)
+    graph.add("b", lambda: 2)
+    graph.add("sum", lambda a, b: a + b, depends=("a", "b"))
+
+    assert graph.run() == dict(a=1, b=2, sum=3)
+
+
+def test_independent_tasks_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    graph = TaskGraph()
+    graph.add("a", barrier.wait)
+    graph.add("b", barrier.wait)
+    graph.run()
+
+
+def test_error_stops_dependent_tasks():
+    executed = []
+
+    def fail():
+        time.sleep(0.01)
+        raise ValueError("failed")
+
+    graph = TaskGraph()
+    graph.add("a", fail)
+    graph.add("b", lambda a: executed.append(a), depends=("a",))
+
+    with pytest.raises(TaskError) as e:
+        graph.run()
+
+    assert e.value.task == "a"
+    assert isinstance(e.value.error, ValueError)
+    assert executed == []
+
+
+def test_unknown_dependency():
+    graph = TaskGraph()
+    with pytest.raises(ValueError):
+        graph.add("a", lambda b: b, depends=("b",))
+
+
+def test_analyzer_error_contains_stage():
+    analyzer = TraceAnalyzer(FailingRunner("crawler"))
+
+    with pytest.raises(TraceAnalyzerError) as e:
+        analyzer.analyze("/tmp/file.pcap")
+
+    assert str(e.value).startswith("crawler:")
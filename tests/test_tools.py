@@ -1,5 +1,5 @@
 
-from traces_api.tools import escape
+from traces_api.tools import escape, content_disposition
 
 
 def test_escape():
@@ -10,3 +10,10 @@ def test_escape():
     assert escape([{">": 3}]) == [{"&gt;": 3}]
 
     assert escape(["abc", "<script>aaa"]) == ["abc", "&lt;script&gt;aaa"]
+
+
+def test_content_disposition():
+    assert content_disposition("mix 1.pcap") == 'attachment; filename="mix 1.pcap"'
+    assert content_disposition("mix;1.pcap") == 'attachment; filename="mix;1.pcap"'
+    assert content_disposition("mix č.pcap") == \
+        "attachment; filename=\"mix .pcap\"; filename*=UTF-8''mix%20%C4%8D.pcap"
@@ -1,9 +1,16 @@
+import io
+import yaml
 import pytest
 import os.path
 import tempfile
+import subprocess
+from unittest import mock
 
 from traces_api.trace_tools import TraceNormalizer, TraceNormalizerError
 from traces_api.trace_tools import TraceAnalyzer, TraceAnalyzerError
+from traces_api.trace_tools import TraceMixer
+from traces_api.compression import Compression
+from traces_api.containers import ContainerPool
 
 
 @pytest.fixture()
@@ -87,3 +94,97 @@ def test_normalizer(analyzer, normalizer, hydra_1_file):
         response = analyzer.analyze(f.name)
 
         assert compare_list_dict(response["pairs_mac_ip"], expected)
+
+
+class FakeMixRunner:
+    """
+    Appends attack file to target like ID2T would inject it
+    """
+
+    def __init__(self):
+        self.targets = []
+        self.attacks = []
+
+    def run(self, command, volumes):
+        mounts = {container: host for host, container in volumes}
+        self.targets.append(mounts["/data/target.pcap"])
+        self.attacks.append(command.count("Mix"))
+        with open(os.path.join(mounts["/output"], "output.pcap"), "wb") as f_out:
+            for name in ["/data/target.pcap"] + ["/data/mix_file_%s.pcap" % i for i in range(command.count("Mix"))]:
+                with open(mounts[name], "rb") as f_in:
+                    f_out.write(f_in.read())
+
+        class Result:
+            returncode, stdout, stderr = 0, b"", b""
+        return Result()
+
+    def container_path(self, path, volumes):
+        return path
+
+
+def test_mixer_passes_previous_mix_by_path(tmp_path):
+    unit = str(tmp_path / "unit.pcap.gz")
+    Compression.compress(io.BytesIO(b"UNIT"), unit)
+    output = str(tmp_path / "mix.pcap")
+    runner = FakeMixRunner()
+    mixer = TraceMixer(output, runner)
+
+    for _ in range(3):
+        mixer.mix(unit, mixer.prepare_configuration(None, None, None), 0)
+
+    with open(TraceMixer.BASE_PCAP_FILE, "rb") as f:
+        base = f.read()
+    with open(output, "rb") as f:
+        assert f.read() == base + b"UNIT" * 3
+    # previous mix is mounted directly, not copied
+    assert runner.targets == [TraceMixer.BASE_PCAP_FILE, output, output]
+    # working directories are removed
+    assert sorted(os.listdir(str(tmp_path))) == ["mix.pcap", "unit.pcap.gz"]
+
+
+def test_mixer_mix_all_single_run(tmp_path):
+    units = []
+    for name in ("A", "B", "C"):
+        unit = str(tmp_path / ("unit%s.pcap.gz" % name))
+        Compression.compress(io.BytesIO(name.encode()), unit)
+        units.append((unit, TraceMixer.prepare_configuration(None, None, None), 0))
+    output = str(tmp_path / "mix.pcap")
+    runner = FakeMixRunner()
+
+    TraceMixer(output, runner).mix_all(units)
+
+    with open(TraceMixer.BASE_PCAP_FILE, "rb") as f:
+        base = f.read()
+    with open(output, "rb") as f:
+        assert f.read() == base + b"ABC"
+    assert runner.attacks == [3]
+
+
+def test_mixer_passes_host_paths_to_pooled_id2t(tmp_path):
+    unit = str(tmp_path / "unit.pcap")
+    with open(unit, "wb") as f:
+        f.write(b"UNIT")
+    output = str(tmp_path / "mix.pcap")
+    attack_files = []
+
+    def run(command, **kwargs):
+        if command[:2] != ["docker", "exec"]:
+            return subprocess.CompletedProcess(command, 0, b"container_id\n", b"")
+        # pooled container sees only shared directories, config has to refer to host paths
+        config_file, = [a.split("=", 1)[1] for a in command if a.startswith("custom.payload.file=")]
+        with open(config_file) as f:
+            attack_files.append(yaml.safe_load(f)["atk.file"])
+        with open(command[command.index("-o") + 1], "wb") as f:
+            f.write(b"MIX")
+        return subprocess.CompletedProcess(command, 0, b"", b"")
+
+    with mock.patch("traces_api.containers.subprocess.run", side_effect=run):
+        pool = ContainerPool(1, [str(tmp_path), os.path.dirname(TraceMixer.BASE_PCAP_FILE)])
+        try:
+            TraceMixer(output, pool).mix(unit, TraceMixer.prepare_configuration(None, None, None), 0)
+        finally:
+            pool.close()
+
+    assert attack_files == [os.path.realpath(unit)]
+    with open(output, "rb") as f:
+        assert f.read() == b"MIX"
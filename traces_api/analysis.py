@@ -0,0 +1,757 @@
+import os.path
+import zlib
+import hashlib
+import itertools
+from operator import itemgetter
+from collections import namedtuple
+
+from traces_api.pcap import PcapParser, GZIP_MAGIC, READ_CHUNK_SIZE
+from traces_api.packet import decode, find_tcp_timestamp, format_ip, format_mac, parse_ip
+from traces_api.packet import PROTO_TCP, PROTO_UDP, PROTO_ICMP, PROTO_ICMPV6, TCP_FLAG_SYN, TCP_FLAG_ACK
+from traces_api.sketches import HyperLogLog, HeavyHitters
+from traces_api.flowtable import SpillTable
+
+
+ENCAPSULATION_NAMES = {
+    0: "NULL/Loopback",
+    1: "Ethernet",
+    101: "Raw IP",
+    113: "Linux cooked-mode capture v1",
+    228: "Raw IPv4",
+    229: "Raw IPv6",
+}
+
+# Protocol names are kept compatible with Trace-Normalizer crawler (scapy layer classes)
+IP_VERSION_NAMES = {
+    4: "<class 'scapy.layers.inet.IP'>",
+    6: "<class 'scapy.layers.inet6.IPv6'>",
+}
+PROTOCOL_NAMES = {
+    PROTO_TCP: "<class 'scapy.layers.inet.TCP'>",
+    PROTO_UDP: "<class 'scapy.layers.inet.UDP'>",
+    PROTO_ICMP: "<class 'scapy.layers.inet.ICMP'>",
+    PROTO_ICMPV6: "<class 'scapy.layers.inet6._ICMPv6'>",
+}
+
+
+AnalysisLimits = namedtuple("AnalysisLimits", ["max_conversations", "max_ips", "max_flows"])
+AnalysisLimits.__new__.__defaults__ = (10000, 10000, 100000)
+AnalysisLimits.__doc__ = """
+Memory ceilings of approximate analysis
+
+max_conversations - number of the largest tcp conversations kept
+max_ips - number of the most frequent ips kept, also limits mac-ip pairs and mac associations
+max_flows - number of flows used to classify ips into groups
+"""
+
+# Records of tables spilled to disk (see SpillTable), ips are stored as length byte followed by address
+# conversation sides, frames and bytes from side 1 and 2, start, order, side A is side 1
+_CONVERSATION_RECORD = "<38sQQQQqQB"
+# ip, count, first observed, order, protocols, tcp timestamp min, order of tcp timestamp, role in flows
+_IP_RECORD = "<17sQQQIQQB"
+# protocol and flow sides, initiator is side 1, initiated by SYN
+_FLOW_RECORD = "<39sBB"
+# mac and ip, order of the first occurrence of pair (mac-ip pairs) or of mac (mac associations)
+_MAC_IP_RECORD = "<24sQ"
+
+_NO_VALUE = 2 ** 64 - 1
+_ROLE_INITIATOR = 1
+_ROLE_RESPONDER = 2
+_PROTOCOL_BITS = {
+    name: 1 << i for i, name in enumerate(itertools.chain(IP_VERSION_NAMES.values(), PROTOCOL_NAMES.values()))
+}
+
+
+def _ip_key(ip):
+    raw = parse_ip(ip)
+    return (bytes((len(raw),)) + raw).ljust(17, b"\0")
+
+
+def _ip_from_key(key):
+    return format_ip(key[1:1 + key[0]])
+
+
+def _mac_ip_key(mac, ip):
+    # empty mac or ip (packet without Ethernet or IPv4 header) is stored with zero length
+    mac_key = bytes.fromhex("06" + mac.replace(":", "")) if mac else bytes(7)
+    return mac_key + (_ip_key(ip) if ip else bytes(17))
+
+
+def _mac_ip_from_key(key):
+    mac = format_mac(key[1:7]) if key[0] else ""
+    ip = _ip_from_key(key[7:24]) if key[7] else ""
+    return mac, ip
+
+
+def _combine_first(old, new):
+    return old if old[1] <= new[1] else new
+
+
+def _combine_conversations(old, new):
+    return (old[0], old[1] + new[1], old[2] + new[2], old[3] + new[3], old[4] + new[4], old[5], old[6], old[7])
+
+
+def _combine_ips(old, new):
+    return (
+        old[0], old[1] + new[1], min(old[2], new[2]), min(old[3], new[3]), old[4] | new[4],
+        min(old[5], new[5]), min(old[6], new[6]), old[7] | new[7],
+    )
+
+
+def _combine_flows(old, new):
+    # Initiator identified by SYN of newer packets wins, otherwise the first packet identifies it
+    if new[2]:
+        return new
+    return old
+
+
+class CaptureAnalysis:
+    """
+    In-process single pass analysis of capture file
+
+    Computes the same information as trace-analyzer and Trace-Normalizer crawler:
+    - tcp conversations
+    - mac-ip pairs
+    - capture file properties
+    - ip groups, tcp timestamp minimums, ip occurrences, mac associations and protocols used by ips
+
+    Raw file content is fed in chunks, so analysis can run while the file is being received or written.
+
+    When spill_max_entries is set, tables which exceed it (including mac-ip pairs and mac associations, counted
+    as number of associated mac-ip pairs) are spilled to temporary files and merged at the end,
+    so exact analysis of any capture runs with bounded memory.
+
+    When limits are set and the file is larger than approximate_threshold, analysis switches to approximate mode.
+    Analysis which already spilled tables stays exact, its memory is bounded by spilling.
+    Tables are then bounded (the largest conversations and the most frequent ips are kept),
+    numbers of distinct ips, macs and conversations are estimated using HyperLogLog.
+    Result contains "approximate" - list of fields which are not exact, and "estimates".
+
+    Example usage:
+        analysis = CaptureAnalysis("file.pcap")
+        for chunk in stream:
+            analysis.feed(chunk)
+        result = analysis.result()
+    """
+
+    def __init__(self, file_name=None, limits=None, approximate_threshold=0, spill_max_entries=None, tmp_dir=None):
+        """
+        :param file_name: name of analyzed file, reported in capture info
+        :param limits: AnalysisLimits used in approximate mode, None to always analyze exactly
+        :param approximate_threshold: number of bytes of file after which approximate mode is used
+        :param spill_max_entries: maximal number of entries of table kept in memory in exact mode, None for no limit
+        :param tmp_dir: directory for spilled tables, system default is used when not set
+        """
+        self.file_name = file_name
+        self._spill_max_entries = spill_max_entries
+        self._tmp_dir = tmp_dir
+        self._spill_tables = None
+        self._conversation_order = 0
+        self._ip_order = 0
+        self._timestamp_order = 0
+        self._pairs_src_order = 0
+        self._pairs_dst_order = 0
+        self._mac_order = 0
+        self._limits = limits
+        self._approximate_threshold = approximate_threshold
+        self._approximate = False
+        self._approximated_fields = set()
+        self._distinct_ips = None
+        self._distinct_macs = None
+        self._distinct_conversations = None
+
+        self._parser = PcapParser()
+        self._compressed = None
+        self._decompressor = None
+        self._file_size = 0
+        self._hashes = [("SHA256", hashlib.sha256()), ("SHA1", hashlib.sha1())]
+        try:
+            self._hashes.insert(1, ("RIPEMD160", hashlib.new("ripemd160")))
+        except ValueError:
+            # ripemd160 is not provided by all OpenSSL builds
+            pass
+
+        self._packets = 0
+        self._data_size = 0
+        self._first_timestamp = None
+        self._previous_timestamp = None
+        self._start_time = None
+        self._stop_time = None
+        self._strict_time_order = True
+
+        self._conversations = {}
+        self._flows = {}
+        # flows initiated by SYN, needed only to combine flows of spilled runs
+        self._syn_flows = set()
+        self._track_syn_flows = spill_max_entries is not None
+        # dicts keep order of the first occurrence of pairs, values are not used
+        self._pairs_src = {}
+        self._pairs_dst = {}
+
+        self._ip_occurrences = {}
+        self._ip_protocols = {}
+        self._tcp_timestamp_min = {}
+        self._mac_associations = {}
+        # number of ips in all sets of mac associations
+        self._mac_association_count = 0
+
+    def feed(self, data):
+        """
+        Feed next chunk of raw file content
+
+        :param data: bytes
+        """
+        self._file_size += len(data)
+        for _, h in self._hashes:
+            h.update(data)
+
+        if self._compressed is None:
+            self._compressed = data[:2] == GZIP_MAGIC
+            if self._compressed:
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        if self._compressed:
+            data = self._decompress(data)
+
+        for record in self._parser.feed(data):
+            self.add_record(record)
+
+        if self._approximate:
+            self._enforce_limits()
+        elif self._limits is not None and self._spill_tables is None and self._file_size > self._approximate_threshold:
+            self.enable_approximation()
+        elif self._spill_max_entries is not None:
+            entries = max(
+                len(self._conversations), len(self._ip_occurrences), len(self._flows),
+                len(self._pairs_src), len(self._pairs_dst), self._mac_association_count,
+            )
+            if entries > self._spill_max_entries:
+                self._spill()
+
+    def _decompress(self, data):
+        output = self._decompressor.decompress(data)
+        # gzip file can contain multiple members
+        while self._decompressor.eof and self._decompressor.unused_data:
+            unused = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            output += self._decompressor.decompress(unused)
+        return output
+
+    def enable_approximation(self):
+        """
+        Switch to approximate mode, current tables are reduced to limits
+        """
+        if self._approximate or self._limits is None:
+            return
+        self._approximate = True
+        # tables are not spilled in approximate mode
+        self._track_syn_flows = False
+        self._syn_flows = set()
+
+        self._distinct_ips = HyperLogLog()
+        self._distinct_macs = HyperLogLog()
+        self._distinct_conversations = HyperLogLog()
+        for ip in self._ip_occurrences:
+            self._distinct_ips.add(ip)
+        for mac, _ in itertools.chain(self._pairs_src, self._pairs_dst):
+            if mac:
+                self._distinct_macs.add(mac)
+        for side_1, side_2 in self._conversations:
+            self._distinct_conversations.add(self._conversation_id(side_1, side_2))
+
+        self._conversations = HeavyHitters(
+            self._limits.max_conversations, lambda c: c[1] + c[3], self._conversations
+        )
+        self._ip_occurrences = HeavyHitters(self._limits.max_ips, lambda o: o[0], self._ip_occurrences)
+        self._mac_associations = HeavyHitters(self._limits.max_ips, len, self._mac_associations)
+        self._enforce_limits()
+
+    def _add_to_estimates(self, headers, ip_src, ip_dst):
+        if headers.eth_src is not None:
+            self._distinct_macs.add(format_mac(headers.eth_src))
+            self._distinct_macs.add(format_mac(headers.eth_dst))
+        if ip_src is not None:
+            self._distinct_ips.add(ip_src)
+            self._distinct_ips.add(ip_dst)
+            if headers.protocol == PROTO_TCP and headers.src_port is not None:
+                self._distinct_conversations.add(self._conversation_id(
+                    (ip_src, headers.src_port), (ip_dst, headers.dst_port)
+                ))
+
+    @staticmethod
+    def _conversation_id(src, dst):
+        side_1, side_2 = (src, dst) if src <= dst else (dst, src)
+        return "%s %s %s %s" % (side_1 + side_2)
+
+    def _enforce_limits(self, final=False):
+        """
+        Reduce tables which exceeded limits of approximate mode
+
+        Tables can grow up to twice their limit between reductions, final reduction reduces them to limits.
+
+        :param final: True if analysis is finished
+        """
+        limits = self._limits
+        factor = 1 if final else 2
+
+        def prune(table):
+            return table.prune() if final else table.prune_if_full()
+
+        if prune(self._conversations):
+            self._approximated_fields.add("tcp_conversations")
+
+        removed_ips = prune(self._ip_occurrences)
+        if removed_ips:
+            for ip in removed_ips:
+                self._ip_protocols.pop(ip, None)
+                self._tcp_timestamp_min.pop(ip, None)
+            self._approximated_fields.update(("ip.occurrences", "ip.searched_protocols", "tcp.timestamp.min", "ip.groups"))
+
+        if prune(self._mac_associations):
+            self._approximated_fields.add("mac.associations")
+        for mac, ips in self._mac_associations.items():
+            if len(ips) > factor * limits.max_ips:
+                self._mac_associations[mac] = set(itertools.islice(ips, limits.max_ips))
+                self._approximated_fields.add("mac.associations")
+
+        for name in ("_pairs_src", "_pairs_dst"):
+            pairs = getattr(self, name)
+            if len(pairs) > factor * limits.max_ips:
+                setattr(self, name, dict(itertools.islice(pairs.items(), limits.max_ips)))
+                self._approximated_fields.add("pairs_mac_ip")
+
+        if len(self._flows) > factor * limits.max_flows:
+            # the oldest flows are kept
+            self._flows = dict(itertools.islice(self._flows.items(), limits.max_flows))
+            self._approximated_fields.add("ip.groups")
+
+    def add_record(self, record):
+        """
+        Add one packet to analysis
+
+        :param record: PcapRecord
+        """
+        number = self._packets
+        timestamp = record.timestamp
+        self._packets += 1
+        self._data_size += record.orig_len
+
+        if self._first_timestamp is None:
+            self._first_timestamp = timestamp
+            self._start_time = timestamp
+            self._stop_time = timestamp
+        else:
+            if timestamp < self._previous_timestamp:
+                self._strict_time_order = False
+            self._start_time = min(self._start_time, timestamp)
+            self._stop_time = max(self._stop_time, timestamp)
+        self._previous_timestamp = timestamp
+
+        data = record.data
+        headers = decode(record.linktype, data)
+
+        ip_src = format_ip(headers.ip_src) if headers.ip_src is not None else None
+        ip_dst = format_ip(headers.ip_dst) if headers.ip_dst is not None else None
+
+        if self._approximate:
+            self._add_to_estimates(headers, ip_src, ip_dst)
+
+        # mac-ip pairs (ip.src and ip.dst are defined for IPv4 only)
+        if headers.eth_src is not None or headers.ip_version == 4:
+            mac_src = format_mac(headers.eth_src) if headers.eth_src is not None else ""
+            mac_dst = format_mac(headers.eth_dst) if headers.eth_dst is not None else ""
+            if headers.ip_version == 4:
+                self._pairs_src[(mac_src, ip_src)] = None
+                self._pairs_dst[(mac_dst, ip_dst)] = None
+            else:
+                self._pairs_src[(mac_src, "")] = None
+                self._pairs_dst[(mac_dst, "")] = None
+
+        if ip_src is None:
+            return
+
+        protocols = [IP_VERSION_NAMES[headers.ip_version]]
+        if headers.protocol in PROTOCOL_NAMES and headers.l4_offset is not None:
+            protocols.append(PROTOCOL_NAMES[headers.protocol])
+
+        for ip in (ip_src, ip_dst) if ip_src != ip_dst else (ip_src,):
+            occurrence = self._ip_occurrences.get(ip)
+            if occurrence is None:
+                self._ip_occurrences[ip] = [1, number]
+                self._ip_protocols[ip] = set(protocols)
+            else:
+                occurrence[0] += 1
+                self._ip_protocols[ip].update(protocols)
+
+        if headers.eth_src is not None:
+            for mac, ip in ((mac_src, ip_src), (mac_dst, ip_dst)):
+                ips = self._mac_associations.setdefault(mac, set())
+                if ip not in ips:
+                    ips.add(ip)
+                    self._mac_association_count += 1
+
+        self._add_flow(headers, ip_src, ip_dst)
+
+        if headers.protocol == PROTO_TCP and headers.src_port is not None:
+            self._add_tcp_conversation(headers, ip_src, ip_dst, timestamp, record.orig_len)
+
+            tsval_offset = find_tcp_timestamp(data, headers)
+            if tsval_offset is not None:
+                tsval = int.from_bytes(data[tsval_offset:tsval_offset + 4], "big")
+                current = self._tcp_timestamp_min.get(ip_src)
+                if current is None or tsval < current:
+                    self._tcp_timestamp_min[ip_src] = tsval
+
+    def _add_flow(self, headers, ip_src, ip_dst):
+        """
+        Remember which side initiated communication, used to classify ips into groups
+        """
+        src = (ip_src, headers.src_port or 0)
+        dst = (ip_dst, headers.dst_port or 0)
+        key = (headers.protocol, src, dst) if src <= dst else (headers.protocol, dst, src)
+
+        if headers.protocol == PROTO_TCP and headers.tcp_flags is not None:
+            # SYN without ACK identifies the initiator reliably
+            if headers.tcp_flags & (TCP_FLAG_SYN | TCP_FLAG_ACK) == TCP_FLAG_SYN:
+                self._flows[key] = ip_src
+                if self._track_syn_flows:
+                    self._syn_flows.add(key)
+                return
+
+        if key not in self._flows:
+            self._flows[key] = ip_src
+
+    def _add_tcp_conversation(self, headers, ip_src, ip_dst, timestamp, length):
+        src = (ip_src, headers.src_port)
+        dst = (ip_dst, headers.dst_port)
+        key = (src, dst) if src <= dst else (dst, src)
+
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            # [side A, frames A-B, bytes A-B, frames B-A, bytes B-A, start]
+            conversation = [src, 0, 0, 0, 0, timestamp]
+            self._conversations[key] = conversation
+
+        if conversation[0] == src:
+            conversation[1] += 1
+            conversation[2] += length
+        else:
+            conversation[3] += 1
+            conversation[4] += length
+
+    def _spill(self):
+        """
+        Move conversations, ip statistics, flows, mac-ip pairs and mac associations from memory to spilled tables
+        """
+        if self._spill_tables is None:
+            self._spill_tables = dict(
+                conversations=SpillTable(_CONVERSATION_RECORD, _combine_conversations, self._tmp_dir),
+                ips=SpillTable(_IP_RECORD, _combine_ips, self._tmp_dir),
+                flows=SpillTable(_FLOW_RECORD, _combine_flows, self._tmp_dir),
+                pairs_src=SpillTable(_MAC_IP_RECORD, _combine_first, self._tmp_dir),
+                pairs_dst=SpillTable(_MAC_IP_RECORD, _combine_first, self._tmp_dir),
+                mac_associations=SpillTable(_MAC_IP_RECORD, _combine_first, self._tmp_dir),
+            )
+
+        # Orders keep dict insertion order over all runs, so results are the same as without spilling
+        conversations = []
+        for order, ((side_1, side_2), conversation) in enumerate(self._conversations.items(), self._conversation_order):
+            side_a, frames_ab, bytes_ab, frames_ba, bytes_ba, start = conversation
+            key = _ip_key(side_1[0]) + side_1[1].to_bytes(2, "big") + _ip_key(side_2[0]) + side_2[1].to_bytes(2, "big")
+            if side_a == side_1:
+                conversations.append((key, frames_ab, bytes_ab, frames_ba, bytes_ba, start, order, 1))
+            else:
+                conversations.append((key, frames_ba, bytes_ba, frames_ab, bytes_ab, start, order, 0))
+        self._conversation_order += len(self._conversations)
+        self._spill_tables["conversations"].spill(conversations)
+
+        ips = {}
+        for order, (ip, (count, first)) in enumerate(self._ip_occurrences.items(), self._ip_order):
+            protocols = 0
+            for protocol in self._ip_protocols[ip]:
+                protocols |= _PROTOCOL_BITS[protocol]
+            ips[ip] = [_ip_key(ip), count, first, order, protocols, _NO_VALUE, _NO_VALUE, 0]
+        for order, (ip, tsval) in enumerate(self._tcp_timestamp_min.items(), self._timestamp_order):
+            ips[ip][5:7] = tsval, order
+        self._ip_order += len(self._ip_occurrences)
+        self._timestamp_order += len(self._tcp_timestamp_min)
+        self._spill_tables["ips"].spill(ips.values())
+
+        flows = []
+        for flow, initiator in self._flows.items():
+            protocol, side_1, side_2 = flow
+            key = bytes((255 if protocol is None else protocol,)) + \
+                _ip_key(side_1[0]) + side_1[1].to_bytes(2, "big") + _ip_key(side_2[0]) + side_2[1].to_bytes(2, "big")
+            flows.append((key, 1 if initiator == side_1[0] else 0, 1 if flow in self._syn_flows else 0))
+        self._spill_tables["flows"].spill(flows)
+
+        self._spill_tables["pairs_src"].spill(
+            (_mac_ip_key(mac, ip), order) for order, (mac, ip) in enumerate(self._pairs_src, self._pairs_src_order)
+        )
+        self._spill_tables["pairs_dst"].spill(
+            (_mac_ip_key(mac, ip), order) for order, (mac, ip) in enumerate(self._pairs_dst, self._pairs_dst_order)
+        )
+        self._pairs_src_order += len(self._pairs_src)
+        self._pairs_dst_order += len(self._pairs_dst)
+
+        self._spill_tables["mac_associations"].spill(
+            (_mac_ip_key(mac, ip), order)
+            for order, (mac, ips) in enumerate(self._mac_associations.items(), self._mac_order) for ip in ips
+        )
+        self._mac_order += len(self._mac_associations)
+
+        self._conversations = {}
+        self._ip_occurrences = {}
+        self._ip_protocols = {}
+        self._tcp_timestamp_min = {}
+        self._flows = {}
+        self._syn_flows = set()
+        self._pairs_src = {}
+        self._pairs_dst = {}
+        self._mac_associations = {}
+        self._mac_association_count = 0
+
+    def _result_spilled(self):
+        """
+        Merge spilled tables
+
+        :return: dict with tcp conversations, mac-ip pairs, mac associations and results of per ip aggregation
+        """
+        self._spill()
+        tables = self._spill_tables
+
+        # Roles of ips in flows are aggregated in ips table too
+        roles = {}
+        for key, initiator_is_side_1, _ in tables["flows"].merge():
+            side_1, side_2 = key[1:18], key[20:37]
+            initiator, responder = (side_1, side_2) if initiator_is_side_1 else (side_2, side_1)
+            roles[initiator] = roles.get(initiator, 0) | _ROLE_INITIATOR
+            roles[responder] = roles.get(responder, 0) | _ROLE_RESPONDER
+            if len(roles) > self._spill_max_entries:
+                tables["ips"].spill((ip, 0, _NO_VALUE, _NO_VALUE, 0, _NO_VALUE, _NO_VALUE, role) for ip, role in roles.items())
+                roles = {}
+        tables["ips"].spill((ip, 0, _NO_VALUE, _NO_VALUE, 0, _NO_VALUE, _NO_VALUE, role) for ip, role in roles.items())
+
+        ips = [record for record in tables["ips"].merge() if record[3] != _NO_VALUE]
+        ips.sort(key=itemgetter(3))
+        timestamps = [record for record in ips if record[6] != _NO_VALUE]
+        timestamps.sort(key=itemgetter(6))
+
+        groups = dict(source=[], intermediate=[], destination=[])
+        for record in ips:
+            role = record[7]
+            if role == _ROLE_INITIATOR | _ROLE_RESPONDER:
+                groups["intermediate"].append(_ip_from_key(record[0]))
+            elif role == _ROLE_INITIATOR:
+                groups["source"].append(_ip_from_key(record[0]))
+            else:
+                groups["destination"].append(_ip_from_key(record[0]))
+
+        conversations = []
+        for key, frames_1, bytes_1, frames_2, bytes_2, start, order, a_is_side_1 in tables["conversations"].merge():
+            side_1 = (_ip_from_key(key[0:17]), int.from_bytes(key[17:19], "big"))
+            side_2 = (_ip_from_key(key[19:36]), int.from_bytes(key[36:38], "big"))
+            if not a_is_side_1:
+                side_1, side_2 = side_2, side_1
+                frames_1, bytes_1, frames_2, bytes_2 = frames_2, bytes_2, frames_1, bytes_1
+            conversations.append((order, self._conversation_dict(side_1, side_2, frames_1, bytes_1, frames_2, bytes_2, start)))
+        conversations.sort(key=itemgetter(0))
+        conversations = [conversation for _, conversation in conversations]
+        conversations.sort(key=lambda c: c["Frames"], reverse=True)
+
+        pairs = []
+        for name in ("pairs_src", "pairs_dst"):
+            records = sorted(tables[name].merge(), key=itemgetter(1))
+            pairs += [dict(zip(("MAC", "IP"), _mac_ip_from_key(key))) for key, _ in records]
+
+        # records of one mac are adjacent, ips are sorted again as text
+        associations = []
+        for mac_key, records in itertools.groupby(tables["mac_associations"].merge(), key=lambda r: r[0][:7]):
+            records = list(records)
+            associated_ips = sorted(_ip_from_key(key[7:]) for key, _ in records)
+            mac = _mac_ip_from_key(mac_key + bytes(17))[0]
+            associations.append((min(order for _, order in records), mac, associated_ips))
+        associations.sort(key=itemgetter(0))
+
+        for table in tables.values():
+            table.close()
+
+        return {
+            "pairs_mac_ip": pairs,
+            "mac.associations": [dict(mac=mac, ips=ips) for _, mac, ips in associations],
+            "tcp_conversations": conversations,
+            "ip.groups": groups,
+            "tcp.timestamp.min": [dict(ip=_ip_from_key(r[0]), min=r[5]) for r in timestamps],
+            "ip.occurrences": [dict(ip=_ip_from_key(r[0]), count=r[1], first_observed=r[2]) for r in ips],
+            "ip.searched_protocols": [
+                dict(ip=_ip_from_key(r[0]), protocols=sorted(name for name, bit in _PROTOCOL_BITS.items() if r[4] & bit))
+                for r in ips
+            ],
+        }
+
+    def result(self):
+        """
+        Finish analysis and return analyzed information
+
+        :return: dict in the same format as TraceAnalyzer.analyze returns
+        """
+        if self._compressed:
+            self._parser.feed(self._decompressor.flush())
+        self._parser.close()
+
+        if self._approximate:
+            # Size of result is bounded by limits
+            self._enforce_limits(final=True)
+
+        result = {
+            "capture_info": self._result_capture_info(),
+        }
+
+        if self._spill_tables is not None:
+            result.update(self._result_spilled())
+        else:
+            result.update({
+                "pairs_mac_ip": self._result_pairs_mac_ip(),
+                "mac.associations": [
+                    dict(mac=mac, ips=sorted(ips)) for mac, ips in self._mac_associations.items()
+                ],
+                "tcp_conversations": self._result_tcp_conversations(),
+                "ip.groups": self._result_ip_groups(),
+                "tcp.timestamp.min": [dict(ip=ip, min=ts) for ip, ts in self._tcp_timestamp_min.items()],
+                "ip.occurrences": [
+                    dict(ip=ip, count=count, first_observed=first)
+                    for ip, (count, first) in self._ip_occurrences.items()
+                ],
+                "ip.searched_protocols": [
+                    dict(ip=ip, protocols=sorted(protocols)) for ip, protocols in self._ip_protocols.items()
+                ],
+            })
+
+        if self._approximate:
+            result["approximate"] = sorted(self._approximated_fields)
+            result["estimates"] = dict(
+                distinct_ips=self._distinct_ips.count(),
+                distinct_macs=self._distinct_macs.count(),
+                tcp_conversations=self._distinct_conversations.count(),
+            )
+        return result
+
+    def _result_tcp_conversations(self):
+        conversations = []
+        for (side_1, side_2), (side_a, frames_ab, bytes_ab, frames_ba, bytes_ba, start) in self._conversations.items():
+            side_b = side_2 if side_a == side_1 else side_1
+            conversations.append(self._conversation_dict(side_a, side_b, frames_ab, bytes_ab, frames_ba, bytes_ba, start))
+
+        # tshark orders conversations by number of frames
+        conversations.sort(key=lambda c: c["Frames"], reverse=True)
+        return conversations
+
+    def _conversation_dict(self, side_a, side_b, frames_ab, bytes_ab, frames_ba, bytes_ba, start):
+        return {
+            "IP A": side_a[0],
+            "Port A": side_a[1],
+            "IP B": side_b[0],
+            "Port B": side_b[1],
+            "Frames B-A": frames_ba,
+            "Bytes B-A": bytes_ba,
+            "Frames A-B": frames_ab,
+            "Bytes A-B": bytes_ab,
+            "Frames": frames_ab + frames_ba,
+            "Bytes": bytes_ab + bytes_ba,
+            "Relative start": round((start - self._first_timestamp) / 1e9, 9),
+        }
+
+    def _result_pairs_mac_ip(self):
+        return [dict(MAC=mac, IP=ip) for mac, ip in self._pairs_src] + \
+               [dict(MAC=mac, IP=ip) for mac, ip in self._pairs_dst]
+
+    def _result_capture_info(self):
+        info = {}
+        if self.file_name:
+            info["File name"] = self.file_name
+
+        file_type = "Wireshark/tcpdump/... - pcap" if self._parser.format == "pcap" else "Wireshark/... - pcapng"
+        if self._compressed:
+            file_type += " (gzip compressed)"
+        info["File type"] = file_type
+
+        linktypes = set(self._parser.linktypes)
+        if len(linktypes) > 1:
+            info["File encapsulation"] = "Per packet"
+        else:
+            linktype = self._parser.linktype
+            info["File encapsulation"] = ENCAPSULATION_NAMES.get(linktype, "Unknown (%s)" % linktype)
+
+        info["File timestamp precision"] = "nanoseconds (9)" if self._parser.nanosecond else "microseconds (6)"
+        if self._parser.snaplen:
+            info["Packet size limit"] = "file hdr: %s bytes" % self._parser.snaplen
+        info["Number of packets"] = str(self._packets)
+        info["File size"] = "%s bytes" % self._file_size
+        info["Data size"] = "%s bytes" % self._data_size
+
+        if self._packets:
+            precision = 9 if self._parser.nanosecond else 6
+            duration = (self._stop_time - self._start_time) / 1e9
+            info["Capture duration"] = "%.*f seconds" % (precision, duration)
+            info["First packet time"] = _format_timestamp(self._start_time, precision)
+            info["Last packet time"] = _format_timestamp(self._stop_time, precision)
+            if duration > 0:
+                info["Data byte rate"] = "%.2f bytes/s" % (self._data_size / duration)
+                info["Data bit rate"] = "%.2f bits/s" % (self._data_size * 8 / duration)
+            info["Average packet size"] = "%.2f bytes" % (self._data_size / self._packets)
+            if duration > 0:
+                info["Average packet rate"] = "%.2f packets/s" % (self._packets / duration)
+
+        for name, h in self._hashes:
+            info[name] = h.hexdigest()
+
+        info["Strict time order"] = str(self._strict_time_order)
+        if self._parser.user_application:
+            info["Capture application"] = self._parser.user_application
+        info["Number of interfaces in file"] = str(len(self._parser.linktypes))
+        return info
+
+    def _result_ip_groups(self):
+        initiators = set()
+        responders = set()
+        for (_, side_1, side_2), initiator in self._flows.items():
+            responder = side_2[0] if side_1[0] == initiator else side_1[0]
+            initiators.add(initiator)
+            responders.add(responder)
+
+        groups = dict(source=[], intermediate=[], destination=[])
+        for ip in self._ip_occurrences:
+            if ip in initiators and ip in responders:
+                groups["intermediate"].append(ip)
+            elif ip in initiators:
+                groups["source"].append(ip)
+            else:
+                groups["destination"].append(ip)
+        return groups
+
+    @staticmethod
+    def analyze_file(file_location, limits=None, approximate_threshold=0, spill_max_entries=None):
+        """
+        Analyze capture file stored on disk (optionally gzip compressed)
+
+        :param file_location: path to capture file
+        :param limits: AnalysisLimits used in approximate mode, None to always analyze exactly
+        :param approximate_threshold: number of bytes of file after which approximate mode is used
+        :param spill_max_entries: maximal number of entries of table kept in memory in exact mode, None for no limit
+        :return: dict with analyzed information
+        """
+        analysis = CaptureAnalysis(os.path.basename(file_location), limits, approximate_threshold, spill_max_entries)
+        with open(file_location, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                analysis.feed(chunk)
+        return analysis.result()
+
+
+def _format_timestamp(timestamp, precision):
+    seconds, fraction = divmod(timestamp, 1000000000)
+    if precision == 6:
+        return "%d.%06d" % (seconds, fraction // 1000)
+    return "%d.%09d" % (seconds, fraction)
@@ -0,0 +1,278 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import time
+import json
+import uuid
+import fcntl
+import shutil
+import hashlib
+import threading
+
+
+class FileCache:
+    """
+    Content addressed cache of files stored on local disk
+
+    Every entry is a directory with files, identified by key (hex digest).
+    Entries are evicted in LRU order when total size of cache exceeds limit
+    and when they were not used for longer than max_age seconds.
+
+    Total size is kept as running total, the cache folder is scanned only when the limit is exceeded,
+    when entries can expire or after every rescan_interval stored entries (entries stored by other processes).
+    Hits, misses and evictions are counted in STATS_FILE in the cache folder, so the counters are shared
+    by all processes using the cache (API and workers).
+
+    Example usage:
+        cache = FileCache("/var/cache/traces", max_size=1024 ** 3)
+        key = FileCache.key("analysis", file_hash, version)
+        entry = cache.get(key)
+        if entry is None:
+            entry = cache.put(key, {"result.json": b"..."})
+    """
+
+    STATS_FILE = "stats.json"
+
+    def __init__(self, folder, max_size, max_age=None, rescan_interval=100):
+        """
+        :param folder: cache folder, it is created when it does not exist
+        :param max_size: maximal size of all entries in bytes
+        :param max_age: entries not used for this number of seconds are removed, None to keep them
+        :param rescan_interval: folder is scanned after this number of stored entries even when limit is not reached
+        """
+        self._folder = folder
+        self._max_size = max_size
+        self._max_age = max_age
+        self._rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+
+        os.makedirs(self._folder, exist_ok=True)
+
+        entries = self._entries()
+        self._size = sum(size for _, size, _ in entries)
+        self._entry_count = len(entries)
+        self._puts_since_scan = 0
+        self._last_scan = time.time()
+
+    @property
+    def folder(self):
+        """
+        Cache folder, temporary files moved into cache by put should be created in it
+        """
+        return self._folder
+
+    def __getstate__(self):
+        # Cache can be passed to worker processes, lock is not shared between processes
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """
+        Create cache key from given parts
+
+        :param parts: strings or json serializable values
+        :return: hex digest
+        """
+        h = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, str):
+                part = json.dumps(part, sort_keys=True)
+            h.update(part.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self._folder, key[:2], key)
+
+    def get(self, key):
+        """
+        Find cache entry
+
+        :param key: cache key
+        :return: path to entry directory or None when entry does not exist
+        """
+        path = self._entry_path(key)
+        try:
+            # Modification time of entry directory is used as time of last access
+            os.utime(path)
+        except FileNotFoundError:
+            self._add_counters(misses=1)
+            return None
+
+        self._add_counters(hits=1)
+        return path
+
+    def put(self, key, files):
+        """
+        Store new cache entry
+
+        :param key: cache key
+        :param files: dict file name -> bytes content or path of file to be moved into cache
+        :return: path to entry directory
+        """
+        path = self._entry_path(key)
+        tmp_path = os.path.join(self._folder, ".tmp_%s" % uuid.uuid4())
+
+        os.makedirs(tmp_path)
+        try:
+            size = 0
+            for name, content in files.items():
+                target = os.path.join(tmp_path, name)
+                if isinstance(content, bytes):
+                    with open(target, "wb") as f:
+                        f.write(content)
+                else:
+                    shutil.move(content, target)
+                size += os.path.getsize(target)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.rename(tmp_path, path)
+                stored = True
+            except OSError:
+                # Entry was already stored by someone else
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                stored = False
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        with self._lock:
+            if stored:
+                self._size += size
+                self._entry_count += 1
+            self._puts_since_scan += 1
+            scan = (
+                self._size > self._max_size
+                or self._puts_since_scan >= self._rescan_interval
+                or (self._max_age is not None and time.time() - self._last_scan > self._max_age)
+            )
+        if scan:
+            self.evict()
+        return path
+
+    def get_json(self, key, name="data.json"):
+        """
+        Load json stored in cache entry
+
+        :param key: cache key
+        :param name: file name in entry
+        :return: loaded data or None when entry does not exist
+        """
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, name), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Invalid cache entry %s", key)
+            return None
+
+    def put_json(self, key, data, name="data.json"):
+        """
+        Store json serializable data in cache
+
+        :param key: cache key
+        :param data: json serializable data
+        :param name: file name in entry
+        """
+        self.put(key, {name: json.dumps(data).encode()})
+
+    def _entries(self):
+        """
+        :return: list of (last access, size, path) of all entries
+        """
+        entries = []
+        for prefix in os.scandir(self._folder):
+            if not prefix.is_dir() or prefix.name.startswith("."):
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except FileNotFoundError:
+                    # Entry removed concurrently
+                    continue
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries to fit size limit and expired entries
+
+        Cache folder is scanned, so running total size is corrected by entries of other processes.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total_size = sum(size for _, size, _ in entries)
+            now = time.time()
+
+            evicted = 0
+            for last_access, size, path in entries:
+                expired = self._max_age is not None and now - last_access > self._max_age
+                if not expired and total_size <= self._max_size:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total_size -= size
+                evicted += 1
+
+            self._size = total_size
+            self._entry_count = len(entries) - evicted
+            self._puts_since_scan = 0
+            self._last_scan = now
+
+        if evicted:
+            self._add_counters(evictions=evicted)
+            logger.info("Cache %s: evicted %s entries, %s", self._folder, evicted, self.stats())
+
+    def _add_counters(self, **increments):
+        """
+        Add to counters in stats file, file is locked, so counters of concurrent processes are not lost
+
+        :param increments: counter name -> value added to it
+        :return: dict with all counters
+        """
+        with open(os.path.join(self._folder, self.STATS_FILE), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            counters = self._read_counters(f)
+            for name, value in increments.items():
+                counters[name] += value
+            f.seek(0)
+            f.truncate()
+            json.dump(counters, f)
+        return counters
+
+    @staticmethod
+    def _read_counters(f=None):
+        counters = dict(hits=0, misses=0, evictions=0)
+        if f is None:
+            return counters
+        try:
+            counters.update(json.load(f))
+        except ValueError:
+            # new or damaged file, counting starts again
+            pass
+        return counters
+
+    def stats(self):
+        """
+        Cache statistics, counters are shared by all processes,
+        size and number of entries are running totals updated by scans of cache folder
+
+        :return: dict with number of hits, misses, evictions, entries and total size in bytes
+        """
+        try:
+            with open(os.path.join(self._folder, self.STATS_FILE), "r") as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                counters = self._read_counters(f)
+        except FileNotFoundError:
+            counters = self._read_counters()
+        return dict(counters, entries=self._entry_count, size=self._size)
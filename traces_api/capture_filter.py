@@ -0,0 +1,142 @@
+import io
+import ipaddress
+import itertools
+
+from traces_api.pcap import PcapParser, PcapWriter, open_capture, READ_CHUNK_SIZE
+from traces_api.packet import decode
+
+
+OUTPUT_CHUNK_SIZE = 64 * 1024
+
+
+class PacketFilter:
+    """
+    Select packets by time range, IP address and port
+
+    All criteria are optional, packet is selected when it matches all of the set criteria.
+
+    Example usage:
+        packet_filter = PacketFilter(start=1500000000 * 10 ** 9, ip="10.0.0.1", port=80)
+        for chunk in filter_capture(file.location, packet_filter, file.index()):
+            ...
+    """
+
+    def __init__(self, start=None, end=None, ip=None, port=None):
+        """
+        :param start: timestamp in nanoseconds, packets captured before are skipped
+        :param end: timestamp in nanoseconds, packets captured after are skipped
+        :param ip: IP address (string) which has to be source or destination of packet
+        :param port: TCP/UDP port which has to be source or destination port of packet
+        :raise ValueError: invalid IP address
+        """
+        self.start = start
+        self.end = end
+        self.ip = ipaddress.ip_address(ip).packed if ip else None
+        self.port = port
+
+    def is_empty(self):
+        """
+        :return: True if filter selects all packets
+        """
+        return self.start is None and self.end is None and self.ip is None and self.port is None
+
+    def match(self, record):
+        """
+        :param record: PcapRecord
+        :return: True if packet is selected
+        """
+        if self.start is not None and record.timestamp < self.start:
+            return False
+        if self.end is not None and record.timestamp > self.end:
+            return False
+        if self.ip is None and self.port is None:
+            return True
+
+        headers = decode(record.linktype, record.data)
+        if self.ip is not None and self.ip not in (headers.ip_src, headers.ip_dst):
+            return False
+        if self.port is not None and self.port not in (headers.src_port, headers.dst_port):
+            return False
+        return True
+
+
+def _read_file(file_location):
+    with open_capture(file_location) as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _read_time_range(file_location, index, start, end):
+    """
+    Read file headers and part of file with packets in time range using packet index
+    """
+    positions = index.find_time_range(start, end)
+    headers = index.read_chunks(file_location, 0, index.data_offset)
+    if not positions:
+        return headers
+
+    first, last = positions[0], positions[-1] + 1
+    stop = index.offsets[last] if last < len(index) else None
+    return itertools.chain(headers, index.read_chunks(file_location, index.offsets[first], stop))
+
+
+def filter_capture(file_location, packet_filter, index=None, time_ordered=False):
+    """
+    Stream packets of capture file selected by filter as pcap file
+
+    When packet index of time-ordered file is available only part of file within time range is read
+    (unless pcapng interfaces are defined after the first packet), otherwise the file is scanned, scan of time-ordered file stops at the first packet after end of time range.
+    Output uses nanosecond timestamps and link type of the first interface,
+    packets of pcapng interfaces with different link type are skipped.
+
+    :param file_location: capture file (optionally gzip compressed)
+    :param packet_filter: PacketFilter
+    :param index: PacketIndex of file
+    :param time_ordered: True if packets of file are known to be ordered by timestamp (file without index)
+    :raise PcapError: invalid capture file
+    :return: generator of pcap file chunks
+    """
+    stop_after = None
+    time_range = packet_filter.start is not None or packet_filter.end is not None
+    # pcapng interfaces defined after the first packet would be skipped by reading only part of file
+    if index is not None and index.time_ordered and index.headers_complete and time_range:
+        chunks = _read_time_range(file_location, index, packet_filter.start, packet_filter.end)
+    else:
+        chunks = _read_file(file_location)
+        if time_ordered and packet_filter.end is not None:
+            stop_after = packet_filter.end
+
+    parser = PcapParser()
+    output = io.BytesIO()
+    writer = None
+
+    finished = False
+    for chunk in chunks:
+        records = parser.feed(chunk)
+        if writer is None and parser.linktypes:
+            writer = PcapWriter(output, parser.linktype, parser.snaplen or 262144, nanosecond=True)
+
+        for record in records:
+            if stop_after is not None and record.timestamp > stop_after:
+                # All following packets are out of time range
+                finished = True
+                break
+            if record.linktype == parser.linktype and packet_filter.match(record):
+                writer.write(record.timestamp, record.data, record.orig_len)
+
+        if finished:
+            break
+
+        if output.tell() >= OUTPUT_CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    if not finished:
+        parser.close()
+    if writer is None:
+        PcapWriter(output, parser.linktype, nanosecond=True)
+    yield output.getvalue()
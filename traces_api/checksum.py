@@ -0,0 +1,132 @@
+import struct
+
+from traces_api.packet import decode, PROTO_TCP, PROTO_UDP
+
+
+def ones_complement_sum(data):
+    """
+    One's complement sum of 16-bit big-endian words of data
+
+    Whole buffer is summed at once - 2 ** 16 is 1 modulo 0xFFFF, so the sum of words is congruent
+    with the buffer read as one big integer. Odd length data is padded by zero byte.
+
+    :param data: bytes-like object
+    :return: sum in range 0 - 0xFFFF, 0 only for data containing zeros only
+    """
+    if len(data) % 2:
+        data = bytes(data) + b"\x00"
+    value = int.from_bytes(data, "big")
+    total = value % 0xFFFF
+    if total == 0 and value:
+        return 0xFFFF
+    return total
+
+
+def internet_checksum(*parts):
+    """
+    Compute internet checksum (RFC 1071) of data consisting of several parts
+
+    Parts are summed separately, so pseudo header and segment don't have to be concatenated.
+    All parts except the last one have to be of even length.
+
+    :param parts: bytes-like objects
+    :return: checksum
+    """
+    total = 0
+    for part in parts:
+        total += ones_complement_sum(part)
+    while total > 0xFFFF:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def update_checksum(checksum, old, new):
+    """
+    Update internet checksum after part of checksummed data changed (RFC 1624, eqn. 3)
+
+    :param checksum: current checksum
+    :param old: original bytes of changed part, aligned to 16-bit words
+    :param new: new bytes of changed part
+    :return: updated checksum
+    """
+    total = (~checksum & 0xFFFF) + (~ones_complement_sum(old) & 0xFFFF) + ones_complement_sum(new)
+    while total > 0xFFFF:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def update_checksum_at(data, checksum_offset, old, new):
+    """
+    Update checksum field stored in data after part of checksummed data changed
+
+    :param data: writable bytes-like object (bytearray, memoryview)
+    :param checksum_offset: offset of 16-bit checksum field
+    :param old: original bytes of changed part, aligned to 16-bit words
+    :param new: new bytes of changed part
+    """
+    checksum, = struct.unpack_from("!H", data, checksum_offset)
+    struct.pack_into("!H", data, checksum_offset, update_checksum(checksum, old, new))
+
+
+def pseudo_header(src, dst, protocol, length):
+    """
+    Pseudo header of TCP/UDP checksum
+
+    :param src: raw source IP address (4 bytes for IPv4, 16 bytes for IPv6)
+    :param dst: raw destination IP address
+    :param protocol: transport protocol number
+    :param length: length of transport header and payload
+    :return: bytes
+    """
+    if len(src) == 4:
+        return src + dst + struct.pack("!BBH", 0, protocol, length)
+    return src + dst + struct.pack("!IxxxB", length, protocol)
+
+
+def recompute_checksums(linktype, data):
+    """
+    Recompute IPv4 header checksum and TCP/UDP checksum of packet in place
+
+    Transport checksum is recomputed only when the whole IP payload is captured and the packet
+    is not a fragment, checksum of truncated packets and fragments can't be computed.
+    Zero UDP checksum over IPv4 is kept.
+
+    :param linktype: link type of packet
+    :param data: bytearray with packet data, it is modified
+    :return: True if transport checksum was recomputed
+    """
+    headers = decode(linktype, data)
+    if headers.l3_offset is None:
+        return False
+
+    view = memoryview(data)
+    l3 = headers.l3_offset
+    if headers.ip_version == 4:
+        header_end = l3 + (data[l3] & 0x0F) * 4
+        if header_end > len(data):
+            return False
+        view[l3 + 10:l3 + 12] = b"\x00\x00"
+        struct.pack_into("!H", view, l3 + 10, internet_checksum(view[l3:header_end]))
+        # More fragments flag or fragment offset
+        if struct.unpack_from("!H", data, l3 + 6)[0] & 0x3FFF:
+            return False
+        ip_end = l3 + struct.unpack_from("!H", data, l3 + 2)[0]
+    else:
+        ip_end = l3 + 40 + struct.unpack_from("!H", data, l3 + 4)[0]
+
+    if headers.l4_offset is None or ip_end > len(data) or headers.protocol not in (PROTO_TCP, PROTO_UDP):
+        return False
+
+    checksum_offset = headers.l4_offset + (16 if headers.protocol == PROTO_TCP else 6)
+    if headers.protocol == PROTO_UDP and headers.ip_version == 4 and data[checksum_offset:checksum_offset + 2] == b"\x00\x00":
+        return False
+
+    view[checksum_offset:checksum_offset + 2] = b"\x00\x00"
+    segment = view[headers.l4_offset:ip_end]
+    checksum = internet_checksum(
+        pseudo_header(headers.ip_src, headers.ip_dst, headers.protocol, len(segment)), segment
+    )
+    if checksum == 0 and headers.protocol == PROTO_UDP:
+        checksum = 0xFFFF
+    struct.pack_into("!H", view, checksum_offset, checksum)
+    return True
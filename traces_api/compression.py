@@ -1,4 +1,8 @@
 import gzip
+import shutil
+
+
+CHUNK_SIZE = 1024 * 1024
 
 
 class Compression:
@@ -15,16 +19,38 @@ class Compression:
             Compression.compress(f_in, output_location)
 
     @staticmethod
-    def compress(file_stream, output_location):
+    def compress(file_stream, output_location, observers=(), member_size=None):
         """
         Compress file stream and save output to file
         :param file_stream: stream to be compressed
         :param output_location: compressed file
-        :return:
+        :param observers: objects with feed(chunk) method, they receive every uncompressed chunk
+                          as soon as it is read from stream (e.g. CaptureAnalysis)
+        :param member_size: when set, new gzip member is started after every member_size uncompressed bytes,
+                            so decompression can start at beginning of any member (see traces_api.index)
+        :return: list of (offset in uncompressed stream, offset in compressed file) where gzip members start
+        """
+        with Compression.open_writer(output_location, observers, member_size) as writer:
+            while True:
+                chunk = file_stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        return writer.checkpoints
+
+    @staticmethod
+    def open_writer(output_location, observers=(), member_size=None):
+        """
+        Open file for writing, written data are compressed
+
+        Use it when data are produced by a writer (e.g. normalizer) instead of read from stream.
+
+        :param output_location: compressed file
+        :param observers: objects with feed(chunk) method, they receive every written chunk
+        :param member_size: see compress
+        :return: CompressedWriter
         """
-        f_out = gzip.open(output_location, "wb")
-        f_out.writelines(file_stream)
-        f_out.close()
+        return CompressedWriter(output_location, observers, member_size)
 
     @staticmethod
     def decompress_file(file_location, output_location):
@@ -34,8 +60,79 @@ class Compression:
         :param output_location: decompressed file
         :return:
         """
-        with gzip.open(file_location, "rb") as f_in:
-            f_out = open(output_location, "wb")
-            f_out.writelines(f_in)
-            f_out.close()
+        with gzip.open(file_location, "rb") as f_in, open(output_location, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+
+
+
+class CompressedWriter:
+    """
+    Binary stream writing gzip compressed file, optionally split into members of fixed uncompressed size
+
+    Example usage:
+        with Compression.open_writer(output_location, member_size=1024 * 1024) as writer:
+            writer.write(data)
+        writer.checkpoints
+    """
+
+    def __init__(self, output_location, observers=(), member_size=None):
+        """
+        :param output_location: compressed file
+        :param observers: objects with feed(chunk) method, they receive every written chunk
+        :param member_size: when set, new gzip member is started after every member_size uncompressed bytes
+        """
+        self.name = output_location
+        self._raw = open(output_location, "wb")
+        self._observers = observers
+        self._member_size = member_size
+        self._member = None
+        self._remaining = None
+        self.uncompressed_size = 0
+        self.checkpoints = []
+
+    def _start_member(self):
+        self.checkpoints.append((self.uncompressed_size, self._raw.tell()))
+        self._member = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._remaining = self._member_size
+
+    def write(self, data):
+        """
+        Compress and write data
+
+        :param data: bytes-like object
+        :return: number of written bytes
+        """
+        view = memoryview(data)
+        while len(view):
+            if self._member is None or self._remaining == 0:
+                if self._member is not None:
+                    self._member.close()
+                self._start_member()
+            part = view if self._remaining is None else view[:self._remaining]
+            self._member.write(part)
+            self.uncompressed_size += len(part)
+            if self._remaining is not None:
+                self._remaining -= len(part)
+            for observer in self._observers:
+                observer.feed(bytes(part))
+            view = view[len(part):]
+        return len(data)
+
+    def close(self):
+        """
+        Finish compressed file
+        """
+        if self._raw.closed:
+            return
+        try:
+            if self._member is None:
+                self._start_member()
+            self._member.close()
+        finally:
+            self._raw.close()
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,396 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import re
+import time
+import fcntl
+import queue
+import atexit
+import shutil
+import tempfile
+import threading
+import subprocess
+
+
+TOOLS_IMAGE = "trace-tools"
+
+
+class DockerRunner:
+    """
+    Run trace-tools commands, every command is executed in a new container
+
+    Example usage:
+        runner = DockerRunner()
+        result = runner.run(["python3", "script.py", "-f", "/data/file.pcap"], [(host_file, "/data/file.pcap")])
+    """
+
+    def __init__(self, image=TOOLS_IMAGE):
+        """
+        :param image: docker image with tools
+        """
+        self._image = image
+        self._image_id = None
+
+    @staticmethod
+    def _user():
+        return "{}:{}".format(os.getuid(), os.getgid())
+
+    def run(self, command, volumes):
+        """
+        Run command in trace-tools container
+
+        :param command: list of command arguments, paths has to refer to container paths
+        :param volumes: list of tuples (host path, container path) to be mounted to container
+        :return: subprocess.CompletedProcess with captured stdout and stderr
+        """
+        docker_command = ["docker", "run", "--rm", "--user", self._user()]
+        for host_path, container_path in volumes:
+            docker_command += ["-v", "{}:{}".format(host_path, container_path)]
+        docker_command += [self._image] + list(command)
+
+        return subprocess.run(docker_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def container_path(self, path, volumes):
+        """
+        Path seen by command run with volumes, it is used for paths written into files passed to command
+        (e.g. configuration files), paths in command arguments are handled by run
+
+        :param path: container path inside of volumes
+        :param volumes: list of tuples (host path, container path) the command is run with
+        :return: path of the file in container the command is executed in
+        """
+        return path
+
+    def close(self):
+        """
+        Release resources of runner, every container of DockerRunner is removed when its command finishes
+        """
+        pass
+
+    def image_id(self):
+        """
+        Identifier of tools image, it changes whenever the image is rebuilt
+
+        :return: image id or image name when image can not be inspected
+        """
+        if self._image_id is None:
+            p = subprocess.run(
+                ["docker", "image", "inspect", "--format", "{{.Id}}", self._image],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            if p.returncode != 0:
+                logger.warning("Unable to inspect image %s: %s", self._image, p.stderr.decode())
+                return self._image
+            self._image_id = p.stdout.decode().strip()
+        return self._image_id
+
+
+class FifoStream:
+    """
+    Named pipe passing everything a tool writes to it into a stream
+
+    Pipe is mounted to container instead of output file, so tool output is processed (e.g. compressed into storage)
+    while it is written and no full-size temporary file is needed. Tool has to write the file sequentially.
+
+    Example usage:
+        with FifoStream(output_stream) as fifo:
+            runner.run(["tool", "-o", "/data/output.pcap"], [(fifo.path, "/data/output.pcap")])
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, stream, name="output.pcap"):
+        """
+        :param stream: binary stream the pipe content is written to
+        :param name: file name of pipe
+        """
+        self._stream = stream
+        self._name = name
+        self._dir = None
+        self._read_fd = None
+        self._write_fd = None
+        self._thread = None
+        self._error = None
+        self.path = None
+
+    def __enter__(self):
+        self._dir = tempfile.mkdtemp(prefix="trace_api_fifo_")
+        self.path = os.path.join(self._dir, self._name)
+        os.mkfifo(self.path)
+
+        # Own write end keeps the pipe open until the tool finished,
+        # reader does not see end of file before the tool opens the pipe
+        self._read_fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        self._write_fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        flags = fcntl.fcntl(self._read_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self._read_fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+
+        self._thread = threading.Thread(target=self._copy, daemon=True)
+        self._thread.start()
+        return self
+
+    def _copy(self):
+        while True:
+            data = os.read(self._read_fd, self.CHUNK_SIZE)
+            if not data:
+                break
+            if self._error is not None:
+                # Keep draining the pipe, so the tool is not blocked
+                continue
+            try:
+                self._stream.write(data)
+            except Exception as e:
+                self._error = e
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        os.close(self._write_fd)
+        self._thread.join()
+        os.close(self._read_fd)
+        shutil.rmtree(self._dir, ignore_errors=True)
+        if exc_type is None and self._error is not None:
+            raise self._error
+
+
+class _PooledContainer:
+    """
+    One long-living container in ContainerPool
+    """
+
+    def __init__(self, container_id):
+        self.container_id = container_id
+        self.started = time.monotonic()
+        self.last_check = self.started
+        self.jobs = 0
+
+
+class ContainerPoolError(Exception):
+    """
+    Unable to start container in container pool
+    """
+    pass
+
+
+class ContainerPool(DockerRunner):
+    """
+    Pool of pre-started long-living trace-tools containers
+
+    Commands are executed using docker exec, so container startup is not paid for every command.
+    Shared directories are mounted to containers at the same path as on host, volumes of executed commands
+    are translated to host paths inside these directories (paths in files passed to commands are translated
+    by container_path). Commands with volumes outside of shared directories are executed in a new container
+    as in DockerRunner.
+
+    Containers are checked periodically and replaced when they are not healthy,
+    processed too many jobs or are running for too long.
+    """
+
+    # docker exec returns these codes when command could not be executed in container
+    DOCKER_ERROR_CODES = (125, 126, 127)
+
+    def __init__(self, size, shared_dirs, image=TOOLS_IMAGE, max_jobs=100, max_age=3600, health_check_interval=60):
+        """
+        :param size: maximal number of running containers
+        :param shared_dirs: host directories mounted to containers
+        :param image: docker image with tools
+        :param max_jobs: number of jobs after which container is recycled
+        :param max_age: number of seconds after which container is recycled
+        :param health_check_interval: number of seconds after which idle container is checked before use
+        """
+        super().__init__(image)
+        self._size = size
+        self._shared_dirs = [os.path.realpath(d) for d in shared_dirs]
+        self._max_jobs = max_jobs
+        self._max_age = max_age
+        self._health_check_interval = health_check_interval
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._closed = False
+        self._pid = os.getpid()
+
+        atexit.register(self.close)
+
+    def run(self, command, volumes):
+        if os.getpid() != self._pid:
+            # Pool can not be shared with forked processes
+            return super().run(command, volumes)
+
+        translations = self._translations(volumes)
+        if translations is None:
+            logger.debug("Volumes are not in shared directories, running command in new container")
+            return super().run(command, volumes)
+
+        command = [self._translate(argument, translations) for argument in command]
+
+        container = self._acquire()
+        try:
+            result = subprocess.run(
+                ["docker", "exec", "--user", self._user(), container.container_id] + command,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except BaseException:
+            self._discard(container)
+            raise
+
+        container.jobs += 1
+        if result.returncode in self.DOCKER_ERROR_CODES and not self._is_healthy(container):
+            self._discard(container)
+        else:
+            self._release(container)
+        return result
+
+    def container_path(self, path, volumes):
+        if os.getpid() != self._pid:
+            return path
+
+        translations = self._translations(volumes)
+        if translations is None:
+            # command is executed in new container with mounted volumes
+            return path
+        return self._translate(path, translations)
+
+    def start(self):
+        """
+        Pre-start all containers of the pool
+        """
+        containers = []
+        while True:
+            with self._lock:
+                start_new = self._running < self._size
+                if start_new:
+                    self._running += 1
+            if not start_new:
+                break
+            try:
+                containers.append(self._start())
+            except BaseException:
+                with self._lock:
+                    self._running -= 1
+                raise
+        for container in containers:
+            self._idle.put(container)
+
+    def close(self):
+        """
+        Stop all idle containers
+        """
+        if os.getpid() != self._pid:
+            return
+        self._closed = True
+        while True:
+            try:
+                container = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(container)
+
+    def _translations(self, volumes):
+        """
+        Map container paths to host paths
+
+        :return: list of (container path, host path) sorted from the most specific, None if any volume
+                 is not inside of shared directories
+        """
+        translations = []
+        for host_path, container_path in volumes:
+            real_path = os.path.realpath(host_path)
+            if not any(real_path == d or real_path.startswith(d + os.sep) for d in self._shared_dirs):
+                return None
+            translations.append((container_path.rstrip("/"), real_path))
+        translations.sort(key=lambda t: len(t[0]), reverse=True)
+        return translations
+
+    @staticmethod
+    def _translate(argument, translations):
+        for container_path, host_path in translations:
+            # path can be whole argument or value of option (e.g. key=/data/file)
+            pattern = r"(^|=){}(?=/|$)".format(re.escape(container_path))
+            if re.search(pattern, argument):
+                return re.sub(pattern, lambda m: m.group(1) + host_path, argument)
+        return argument
+
+    def _acquire(self):
+        while True:
+            try:
+                container = self._idle.get_nowait()
+            except queue.Empty:
+                container = self._start_or_wait()
+                if container is None:
+                    continue
+
+            if self._needs_recycling(container):
+                self._discard(container)
+                continue
+
+            now = time.monotonic()
+            if now - container.last_check > self._health_check_interval:
+                if not self._is_healthy(container):
+                    self._discard(container)
+                    continue
+                container.last_check = now
+            return container
+
+    def _start_or_wait(self):
+        """
+        Start new container if pool is not full, otherwise wait for idle one
+
+        :return: container or None if no container was released in time
+        """
+        with self._lock:
+            start_new = self._running < self._size
+            if start_new:
+                self._running += 1
+
+        if start_new:
+            try:
+                return self._start()
+            except BaseException:
+                with self._lock:
+                    self._running -= 1
+                raise
+
+        try:
+            # Timeout allows to start new container when busy container is discarded
+            return self._idle.get(timeout=1)
+        except queue.Empty:
+            return None
+
+    def _release(self, container):
+        if self._closed or self._needs_recycling(container):
+            self._discard(container)
+        else:
+            self._idle.put(container)
+
+    def _needs_recycling(self, container):
+        return container.jobs >= self._max_jobs or time.monotonic() - container.started > self._max_age
+
+    def _start(self):
+        command = ["docker", "run", "-d", "--rm", "--user", self._user()]
+        for shared_dir in self._shared_dirs:
+            command += ["-v", "{0}:{0}".format(shared_dir)]
+        command += [self._image, "sleep", "infinity"]
+
+        p = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if p.returncode != 0:
+            logger.error("Unable to start pooled container: %s", p.stderr.decode())
+            raise ContainerPoolError("error_code: %s" % p.returncode)
+
+        container = _PooledContainer(p.stdout.decode().strip())
+        logger.debug("Started pooled container %s", container.container_id)
+        return container
+
+    def _is_healthy(self, container):
+        p = subprocess.run(
+            ["docker", "exec", container.container_id, "true"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        return p.returncode == 0
+
+    def _discard(self, container):
+        logger.debug("Removing pooled container %s", container.container_id)
+        subprocess.run(
+            ["docker", "rm", "-f", container.container_id], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        with self._lock:
+            self._running -= 1
@@ -0,0 +1,33 @@
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, Text
+
+from traces_api.database import Base
+
+
+class ModelJob(Base):
+
+    __tablename__ = "job"
+
+    # SQLite auto-increments only INTEGER primary keys
+    id_job = Column(BigInteger().with_variant(Integer(), "sqlite"), primary_key=True, autoincrement=True)
+    type = Column(String(64), nullable=False)
+    payload = Column(Text(), nullable=False)
+    # queued, running, done or failed (see traces_api.jobs)
+    status = Column(String(16), nullable=False, index=True)
+    attempts = Column(Integer(), nullable=False)
+    max_attempts = Column(Integer(), nullable=False)
+    creation_time = Column(DateTime, nullable=False)
+    # queued job is not claimed before this time (retry delay)
+    run_after = Column(DateTime, nullable=False)
+    heartbeat_time = Column(DateTime, nullable=True)
+    worker = Column(String(255), nullable=True)
+    error = Column(String(4096), nullable=True)
+
+    def dict(self):
+        return dict(
+            id_job=self.id_job,
+            type=self.type,
+            status=self.status,
+            attempts=self.attempts,
+            creation_time=self.creation_time.timestamp(),
+            error=self.error,
+        )
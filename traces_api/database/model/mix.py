@@ -74,3 +74,7 @@ class ModelMixFileGeneration(Base):
     file_location = Column(String(255), nullable=True)
     expired = Column(Boolean(), nullable=False)
     progress = Column(Integer(), nullable=False)
+    # sha256 of mix specification, generations with the same fingerprint share file (see MixService)
+    fingerprint = Column(String(64), nullable=True, index=True)
+    # error of permanently failed generation, progress of failed generation is not changed
+    error = Column(String(4096), nullable=True)
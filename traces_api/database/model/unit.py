@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, String, DateTime
+from sqlalchemy import Column, BigInteger, String, DateTime, Text
 from traces_api.database import Base
 
 
@@ -13,6 +13,8 @@ class ModelUnit(Base):
     ip_mac_mapping = Column(String(255))
     uploaded_file_location = Column(String(255), nullable=False)
     stage = Column(String(), nullable=False)
+    analysis = Column(Text())
+    analysis_error = Column(String(255))
 
     def dict(self):
         return dict(
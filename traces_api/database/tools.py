@@ -1,8 +1,14 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import sqlalchemy
+
 from . import Base
 
 from .model.unit import ModelUnit
 from .model.annotated_unit import ModelAnnotatedUnit, ModelAnnotatedUnitLabel
 from .model.mix import ModelMix, ModelMixFileGeneration, ModelMixLabel, ModelMixOrigin
+from .model.job import ModelJob
 
 
 """
@@ -16,6 +22,18 @@ TABLES = [
     ModelMixLabel.__table__,
     ModelMixOrigin.__table__,
     ModelMixFileGeneration.__table__,
+    ModelJob.__table__,
+]
+
+
+"""
+Columns added to tables after they were created, databases created by older versions are upgraded by upgrade_database
+"""
+ADDED_COLUMNS = [
+    ModelUnit.__table__.c.analysis,
+    ModelUnit.__table__.c.analysis_error,
+    ModelMixFileGeneration.__table__.c.fingerprint,
+    ModelMixFileGeneration.__table__.c.error,
 ]
 
 
@@ -26,6 +44,35 @@ def create_database(engine):
     :return:
     """
     Base.metadata.create_all(engine, tables=TABLES)
+    upgrade_database(engine)
+
+
+def upgrade_database(engine):
+    """
+    Add columns missing in existing tables (see ADDED_COLUMNS)
+
+    Added columns are nullable, so existing rows stay valid.
+    :param engine: sqlalchemy engine
+    """
+    inspector = sqlalchemy.inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    existing_columns = {}
+
+    for column in ADDED_COLUMNS:
+        table = column.table
+        if table.name not in existing_columns:
+            existing_columns[table.name] = {c["name"] for c in inspector.get_columns(table.name)}
+        if column.name in existing_columns[table.name]:
+            continue
+
+        logger.warning("Adding column %s.%s to database", table.name, column.name)
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text("ALTER TABLE {} ADD COLUMN {} {}".format(
+                preparer.format_table(table), preparer.format_column(column), column.type.compile(dialect=engine.dialect)
+            )))
+        for index in table.indexes:
+            if column in index.columns.values():
+                index.create(engine)
 
 
 def recreate_database(engine):
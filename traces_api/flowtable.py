@@ -0,0 +1,105 @@
+import heapq
+import struct
+import tempfile
+from operator import itemgetter
+
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+class SpillTable:
+    """
+    Aggregation table stored on disk as sorted runs of fixed-size records
+
+    Records are tuples (key, value1, value2, ...) packed using struct format, key is the first field
+    (bytes of fixed size). Every spilled run is sorted by key, runs are merged when the table is read
+    and records with equal keys are combined, records of older runs are combined first.
+    Only one record of every run is held in memory while merging.
+
+    Example usage:
+        table = SpillTable("<8sQ", combine=lambda old, new: (old[0], old[1] + new[1]))
+        table.spill([(b"key_0001", 1), (b"key_0002", 1)])
+        table.spill([(b"key_0001", 5)])
+        list(table.merge())  # [(b"key_0001", 6), (b"key_0002", 1)]
+        table.close()
+    """
+
+    def __init__(self, record_format, combine, tmp_dir=None):
+        """
+        :param record_format: struct format of record, the first field is key
+        :param combine: function combining older and newer record with the same key into one record
+        :param tmp_dir: directory for temporary files, system default is used when not set
+        """
+        self._struct = struct.Struct(record_format)
+        self._combine = combine
+        self._tmp_dir = tmp_dir
+        self._runs = []
+
+    @property
+    def runs(self):
+        """
+        Number of spilled runs
+        """
+        return len(self._runs)
+
+    def spill(self, records):
+        """
+        Write new run
+
+        :param records: iterable of record tuples, keys have to be unique within run
+        """
+        f = tempfile.TemporaryFile(dir=self._tmp_dir)
+        try:
+            pack = self._struct.pack
+            buffer = bytearray()
+            for record in sorted(records, key=itemgetter(0)):
+                buffer += pack(*record)
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    f.write(buffer)
+                    buffer.clear()
+            f.write(buffer)
+        except BaseException:
+            f.close()
+            raise
+        self._runs.append(f)
+
+    def _read_run(self, f):
+        record_size = self._struct.size
+        chunk_size = record_size * max(1, READ_BUFFER_SIZE // record_size)
+
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield from self._struct.iter_unpack(chunk)
+
+    def merge(self):
+        """
+        Read all records sorted by key, records with equal keys are combined
+
+        :return: generator of record tuples
+        """
+        # heapq.merge is stable, so records of older runs come first
+        records = heapq.merge(*(self._read_run(f) for f in self._runs), key=itemgetter(0))
+        combine = self._combine
+
+        current = None
+        for record in records:
+            if current is not None and record[0] == current[0]:
+                current = combine(current, record)
+            else:
+                if current is not None:
+                    yield current
+                current = record
+        if current is not None:
+            yield current
+
+    def close(self):
+        """
+        Remove all runs
+        """
+        for f in self._runs:
+            f.close()
+        self._runs = []
@@ -0,0 +1,320 @@
+import os
+import sys
+import zlib
+import array
+import bisect
+import struct
+
+from traces_api.pcap import PcapParser, PcapError, GZIP_MAGIC, READ_CHUNK_SIZE
+from traces_api.packet import decode
+
+
+INDEX_SUFFIX = ".idx"
+
+INDEX_MAGIC = b"TPIX"
+INDEX_VERSION = 1
+INDEX_FLAG_TIME_ORDERED = 1
+# all pcapng section headers and interfaces are defined before the first packet
+INDEX_FLAG_HEADERS_COMPLETE = 2
+
+# magic, version, flags, linktype, number of packets, number of checkpoints, offset of the first packet
+_INDEX_HEADER = struct.Struct("<4sHHIQQQ")
+
+
+def flow_hash(headers):
+    """
+    Hash of packet 5-tuple, both directions of flow have the same hash
+
+    :param headers: PacketHeaders
+    :return: 32-bit hash, 0 for packets without IP header
+    """
+    if headers.ip_src is None:
+        return 0
+    src = headers.ip_src + (headers.src_port or 0).to_bytes(2, "big")
+    dst = headers.ip_dst + (headers.dst_port or 0).to_bytes(2, "big")
+    if dst < src:
+        src, dst = dst, src
+    return zlib.crc32(bytes(((headers.protocol or 0),)) + src + dst) or 1
+
+
+def _to_little_endian(values):
+    if sys.byteorder != "little":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class PacketIndex:
+    """
+    Index of packets in capture file
+
+    For every packet it holds number, timestamp (ns), offset of packet record in decompressed file and flow hash.
+    Checkpoints are offsets where decompression can start - pairs (offset in decompressed file, offset in file),
+    they allow to read part of compressed file without decompressing everything before it.
+
+    Index is stored next to capture file (file.pcap.gz.idx) as header followed by little-endian arrays.
+
+    Example usage:
+        index = PacketIndex.load(file_location + INDEX_SUFFIX)
+        first, last = index.find_time_range(start, end)
+        for chunk in index.read_chunks(file_location, index.offsets[first]):
+            ...
+    """
+
+    def __init__(self, linktype, data_offset, numbers, timestamps, offsets, hashes, checkpoints, time_ordered,
+                 headers_complete=False):
+        """
+        :param linktype: link type of the first interface
+        :param data_offset: offset of the first packet (length of file headers)
+        :param numbers: array of packet numbers
+        :param timestamps: array of packet timestamps in nanoseconds
+        :param offsets: array of offsets of packet records in decompressed file
+        :param hashes: array of flow hashes (see flow_hash)
+        :param checkpoints: list of (offset in decompressed file, offset in file) sorted by offset
+        :param time_ordered: True if packets are ordered by timestamp
+        :param headers_complete: True if file headers (before data_offset) define all interfaces of file,
+            otherwise packets can't be read without reading the whole file before them
+        """
+        self.linktype = linktype
+        self.data_offset = data_offset
+        self.numbers = numbers
+        self.timestamps = timestamps
+        self.offsets = offsets
+        self.hashes = hashes
+        self.checkpoints = checkpoints or [(0, 0)]
+        self.time_ordered = time_ordered
+        self.headers_complete = headers_complete
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def save(self, index_location):
+        """
+        Write index to file
+
+        :param index_location: path of index file
+        """
+        tmp_location = index_location + ".tmp"
+        with open(tmp_location, "wb") as f:
+            flags = (INDEX_FLAG_TIME_ORDERED if self.time_ordered else 0) | \
+                (INDEX_FLAG_HEADERS_COMPLETE if self.headers_complete else 0)
+            f.write(_INDEX_HEADER.pack(
+                INDEX_MAGIC, INDEX_VERSION, flags,
+                self.linktype, len(self.numbers), len(self.checkpoints), self.data_offset
+            ))
+            for values in (self.numbers, self.timestamps, self.offsets, self.hashes):
+                f.write(_to_little_endian(values))
+            f.write(_to_little_endian(array.array("Q", (offset for checkpoint in self.checkpoints for offset in checkpoint))))
+        os.replace(tmp_location, index_location)
+
+    @staticmethod
+    def load(index_location):
+        """
+        Read index from file
+
+        :param index_location: path of index file
+        :raise ValueError: file is not valid index
+        :return: PacketIndex
+        """
+        with open(index_location, "rb") as f:
+            header = f.read(_INDEX_HEADER.size)
+            if len(header) != _INDEX_HEADER.size:
+                raise ValueError("Index is truncated")
+            magic, version, flags, linktype, packets, checkpoints, data_offset = _INDEX_HEADER.unpack(header)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise ValueError("Unsupported index format")
+
+            columns = []
+            for typecode, count in (("Q", packets), ("q", packets), ("Q", packets), ("I", packets), ("Q", 2 * checkpoints)):
+                size = array.array(typecode).itemsize * count
+                data = f.read(size)
+                if len(data) != size:
+                    raise ValueError("Index is truncated")
+                columns.append(_from_little_endian(typecode, data))
+
+        numbers, timestamps, offsets, hashes, checkpoint_offsets = columns
+        checkpoints = list(zip(checkpoint_offsets[0::2], checkpoint_offsets[1::2]))
+        return PacketIndex(
+            linktype, data_offset, numbers, timestamps, offsets, hashes, checkpoints, bool(flags & INDEX_FLAG_TIME_ORDERED),
+            # indexes written by older versions don't know it
+            bool(flags & INDEX_FLAG_HEADERS_COMPLETE)
+        )
+
+    def find_time_range(self, start=None, end=None):
+        """
+        Find positions of packets with timestamp in [start, end]
+
+        Binary search is used when packets are ordered by time.
+
+        :param start: timestamp in nanoseconds, None for no lower bound
+        :param end: timestamp in nanoseconds, None for no upper bound
+        :return: list of positions in index
+        """
+        timestamps = self.timestamps
+        if self.time_ordered:
+            first = 0 if start is None else bisect.bisect_left(timestamps, start)
+            last = len(timestamps) if end is None else bisect.bisect_right(timestamps, end)
+            return list(range(first, last))
+
+        return [
+            i for i, timestamp in enumerate(timestamps)
+            if (start is None or timestamp >= start) and (end is None or timestamp <= end)
+        ]
+
+    def find_flow(self, hash_value, positions=None):
+        """
+        Find positions of packets with given flow hash
+
+        :param hash_value: flow hash (see flow_hash)
+        :param positions: positions to search in, all packets if not set
+        :return: list of positions in index
+        """
+        hashes = self.hashes
+        if positions is None:
+            positions = range(len(hashes))
+        return [i for i in positions if hashes[i] == hash_value]
+
+    def checkpoint(self, offset):
+        """
+        Find the nearest checkpoint before offset
+
+        :param offset: offset in decompressed file
+        :return: tuple (offset in decompressed file, offset in file)
+        """
+        position = bisect.bisect_right(self.checkpoints, (offset, float("inf"))) - 1
+        return self.checkpoints[max(position, 0)]
+
+    def read_chunks(self, file_location, offset=0, end=None):
+        """
+        Read decompressed content of capture file from given offset
+
+        :param file_location: path to capture file described by this index (optionally gzip compressed)
+        :param offset: offset in decompressed file to start at
+        :param end: offset in decompressed file to stop at, end of file if not set
+        :return: generator of bytes
+        """
+        return read_range(file_location, offset, end, self.checkpoint(offset))
+
+
+def read_range(file_location, offset=0, end=None, checkpoint=(0, 0)):
+    """
+    Read decompressed content of capture file from given offset
+
+    :param file_location: path to capture file (optionally gzip compressed)
+    :param offset: offset in decompressed file to start at
+    :param end: offset in decompressed file to stop at, end of file if not set
+    :param checkpoint: (offset in decompressed file, offset in file) where decompression can start before offset,
+        see PacketIndex.checkpoint
+    :return: generator of bytes
+    """
+    uncompressed_offset, compressed_offset = checkpoint
+
+    with open(file_location, "rb") as f:
+        compressed = f.read(2) == GZIP_MAGIC
+        if not compressed:
+            uncompressed_offset = compressed_offset = offset
+        f.seek(compressed_offset)
+
+        position = uncompressed_offset
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if compressed else None
+        while end is None or position < end:
+            data = f.read(READ_CHUNK_SIZE)
+            if not data:
+                break
+            if compressed:
+                output = decompressor.decompress(data)
+                # gzip file can consist of multiple members
+                while decompressor.eof and decompressor.unused_data:
+                    unused = decompressor.unused_data
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    output += decompressor.decompress(unused)
+                data = output
+
+            chunk_start = position
+            position += len(data)
+            if position <= offset:
+                continue
+            data = data[max(offset - chunk_start, 0):]
+            if end is not None and position > end:
+                data = data[:len(data) - (position - end)]
+            if data:
+                yield data
+
+
+
+
+class PacketIndexBuilder:
+    """
+    Build PacketIndex from decompressed capture file fed in chunks
+
+    Builder can be used as observer of Compression.compress, so index is built while file is stored.
+    Invalid capture files have no index.
+
+    Example usage:
+        builder = PacketIndexBuilder()
+        checkpoints = Compression.compress(stream, location, observers=[builder], member_size=CHECKPOINT_SIZE)
+        index = builder.build(checkpoints)
+    """
+
+    def __init__(self):
+        self._parser = PcapParser()
+        self._numbers = array.array("Q")
+        self._timestamps = array.array("q")
+        self._offsets = array.array("Q")
+        self._hashes = array.array("I")
+        self._time_ordered = True
+        self._size = 0
+        self._error = None
+
+    def feed(self, data):
+        """
+        Feed next chunk of decompressed capture file
+
+        :param data: bytes
+        """
+        self._size += len(data)
+        if self._error is not None:
+            return
+        try:
+            records = self._parser.feed(data)
+        except PcapError as e:
+            self._error = e
+            return
+
+        timestamps = self._timestamps
+        for record in records:
+            if timestamps and record.timestamp < timestamps[-1]:
+                self._time_ordered = False
+            self._numbers.append(record.number)
+            timestamps.append(record.timestamp)
+            self._offsets.append(record.offset)
+            self._hashes.append(flow_hash(decode(record.linktype, record.data)))
+
+    def build(self, checkpoints=None):
+        """
+        Finish index
+
+        :param checkpoints: list of (offset in decompressed file, offset in file) where gzip members start
+        :return: PacketIndex or None if file is not valid capture
+        """
+        if self._error is None:
+            try:
+                self._parser.close()
+            except PcapError as e:
+                self._error = e
+        if self._error is not None or self._parser.format is None:
+            return None
+
+        data_offset = self._offsets[0] if self._offsets else self._size
+        return PacketIndex(
+            self._parser.linktype, data_offset, self._numbers, self._timestamps, self._offsets, self._hashes,
+            checkpoints, self._time_ordered, self._parser.headers_end <= data_offset
+        )
@@ -0,0 +1,236 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import and_
+
+from traces_api.database.model.job import ModelJob
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Dialects supporting SELECT ... FOR UPDATE SKIP LOCKED
+SKIP_LOCKED_DIALECTS = ("postgresql", "mysql")
+
+
+Job = namedtuple("Job", ["id_job", "type", "payload", "attempts", "worker"])
+Job.__doc__ = """
+Job claimed by worker
+
+id_job - id of job in database
+type - job type, worker runs handler of this type
+payload - json data passed to handler
+attempts - number of attempts including the current one
+worker - identification of worker which claimed the job, with attempts it identifies the running attempt
+"""
+
+
+class JobQueue:
+    """
+    Durable queue of background jobs stored in database
+
+    Jobs are claimed by workers (see traces_api.worker) using SELECT ... FOR UPDATE SKIP LOCKED,
+    on databases without row locks (SQLite) job is claimed by conditional update of its status.
+    Running job has to send heartbeats, job without heartbeat for stale_timeout seconds is considered
+    crashed and it is retried as a failed one.
+
+    Example usage:
+        queue = JobQueue(session_maker)
+        queue.enqueue("mix_generation", dict(id_mix_generation=1))
+
+        job = queue.claim("worker-1")
+        queue.heartbeat(job.id_job)
+        queue.complete(job)
+    """
+
+    def __init__(self, session_maker, max_attempts=3, retry_delay=30, stale_timeout=120):
+        """
+        :param session_maker: SqlAlchemy session maker
+        :param max_attempts: maximal number of attempts of job, failed job is retried until it is reached
+        :param retry_delay: seconds before failed job is retried, multiplied by number of attempts
+        :param stale_timeout: running job without heartbeat for this number of seconds is considered crashed
+        """
+        self._session_maker = session_maker
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._stale_timeout = stale_timeout
+
+    @property
+    def _session(self):
+        return self._session_maker()
+
+    def enqueue(self, job_type, payload):
+        """
+        Add new job to queue
+
+        :param job_type: job type, see Worker handlers
+        :param payload: json serializable data passed to job handler
+        :return: id_job
+        """
+        now = datetime.now()
+        job = ModelJob(
+            type=job_type,
+            payload=json.dumps(payload),
+            status=JOB_QUEUED,
+            attempts=0,
+            max_attempts=self._max_attempts,
+            creation_time=now,
+            run_after=now,
+        )
+        self._session.add(job)
+        self._session.commit()
+        return job.id_job
+
+    def claim(self, worker):
+        """
+        Claim the oldest queued job
+
+        :param worker: identification of worker claiming the job
+        :return: Job or None when there is no job to run
+        """
+        session = self._session
+        now = datetime.now()
+        q = session.query(ModelJob).filter(ModelJob.status == JOB_QUEUED, ModelJob.run_after <= now)
+        q = q.order_by(ModelJob.id_job)
+
+        if session.get_bind().dialect.name in SKIP_LOCKED_DIALECTS:
+            job = q.with_for_update(skip_locked=True).first()
+            if job is None:
+                session.commit()
+                return None
+            job.status = JOB_RUNNING
+            job.worker = worker
+            job.attempts += 1
+            job.heartbeat_time = now
+            claimed = Job(job.id_job, job.type, json.loads(job.payload), job.attempts, worker)
+            session.commit()
+            return claimed
+
+        # Without row locks another worker can claim the same job, only the first conditional update succeeds
+        candidates = [job.id_job for job in q.limit(10)]
+        for id_job in candidates:
+            updated = session.query(ModelJob)\
+                .filter(ModelJob.id_job == id_job, ModelJob.status == JOB_QUEUED)\
+                .update(dict(
+                    status=JOB_RUNNING, worker=worker, attempts=ModelJob.attempts + 1, heartbeat_time=now
+                ), synchronize_session=False)
+            session.commit()
+            if updated:
+                job = session.query(ModelJob).filter(ModelJob.id_job == id_job).one()
+                claimed = Job(job.id_job, job.type, json.loads(job.payload), job.attempts, worker)
+                session.commit()
+                return claimed
+        session.commit()
+        return None
+
+    def heartbeat(self, id_job):
+        """
+        Report that job is still running
+
+        :param id_job:
+        """
+        self._session.query(ModelJob)\
+            .filter(ModelJob.id_job == id_job, ModelJob.status == JOB_RUNNING)\
+            .update(dict(heartbeat_time=datetime.now()), synchronize_session=False)
+        self._session.commit()
+
+    @staticmethod
+    def _running_attempt(job):
+        """
+        Filter matching job only while the claimed attempt is running
+
+        Attempt of job recovered as crashed (see recover_stale) may still finish, it must not change the job
+        which is queued again or claimed by another worker.
+        """
+        return and_(
+            ModelJob.id_job == job.id_job,
+            ModelJob.status == JOB_RUNNING,
+            ModelJob.worker == job.worker,
+            ModelJob.attempts == job.attempts,
+        )
+
+    def complete(self, job):
+        """
+        Mark job as successfully finished
+
+        :param job: Job returned by claim
+        :return: True if job was finished, False if the attempt is not running anymore
+        """
+        updated = self._session.query(ModelJob)\
+            .filter(self._running_attempt(job))\
+            .update(dict(status=JOB_DONE, error=None), synchronize_session=False)
+        self._session.commit()
+        if not updated:
+            logger.warning("Job %s finished after its attempt %s was recovered", job.id_job, job.attempts)
+        return bool(updated)
+
+    def fail(self, job, error):
+        """
+        Mark attempt of job as failed, job is queued again until maximal number of attempts is reached
+
+        :param job: Job returned by claim
+        :param error: error message
+        :return: True if job will be retried, False if it failed permanently,
+            None if the attempt is not running anymore (job is not changed)
+        """
+        session = self._session
+        max_attempts = session.query(ModelJob.max_attempts).filter(ModelJob.id_job == job.id_job).scalar()
+        if max_attempts is None:
+            session.commit()
+            return None
+
+        retry = job.attempts < max_attempts
+        values = dict(error=(error or "")[:4096], status=JOB_QUEUED if retry else JOB_FAILED)
+        if retry:
+            values["run_after"] = datetime.now() + timedelta(seconds=self._retry_delay * job.attempts)
+        updated = session.query(ModelJob)\
+            .filter(self._running_attempt(job))\
+            .update(values, synchronize_session=False)
+        session.commit()
+        if not updated:
+            logger.warning("Job %s failed after its attempt %s was recovered", job.id_job, job.attempts)
+            return None
+        return retry
+
+    def recover_stale(self):
+        """
+        Fail running jobs of crashed workers (jobs without heartbeat for stale_timeout seconds)
+
+        :return: list of ids of recovered jobs
+        """
+        session = self._session
+        threshold = datetime.now() - timedelta(seconds=self._stale_timeout)
+        stale = [
+            Job(job.id_job, job.type, json.loads(job.payload), job.attempts, job.worker)
+            for job in session.query(ModelJob).filter(
+                ModelJob.status == JOB_RUNNING, ModelJob.heartbeat_time < threshold
+            )
+        ]
+        session.commit()
+
+        recovered = []
+        for job in stale:
+            # Job could send heartbeat meanwhile
+            updated = session.query(ModelJob)\
+                .filter(self._running_attempt(job), ModelJob.heartbeat_time < threshold)\
+                .update(dict(heartbeat_time=datetime.now()), synchronize_session=False)
+            session.commit()
+            if updated:
+                logger.warning("Job %s stopped sending heartbeats", job.id_job)
+                if self.fail(job, "Worker stopped responding") is not None:
+                    recovered.append(job.id_job)
+        return recovered
+
+    def get_job(self, id_job):
+        """
+        Find job by id
+
+        :param id_job:
+        :return: ModelJob or None
+        """
+        return self._session.query(ModelJob).filter(ModelJob.id_job == id_job).first()
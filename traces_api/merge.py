@@ -0,0 +1,219 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import heapq
+import itertools
+import struct
+
+from traces_api.checksum import update_checksum_at
+from traces_api.pcap import PcapParser, PcapWriter, READ_CHUNK_SIZE, open_capture
+from traces_api.packet import decode, parse_ip, parse_mac, LINKTYPE_ETHERNET
+from traces_api.rewrite import ARP_ADDRESSES, is_arp, update_transport_checksum
+
+
+# timestamp generation of mix configuration which only shifts unit to at_timestamp, it doesn't require ID2T
+TIMESTAMP_GENERATION_SHIFT = "shift"
+
+
+class MixRewriteMapping:
+    """
+    Address and port changes of one annotated unit added to mix
+
+    Parsed from mixer configuration (see TraceMixer.prepare_configuration):
+    ip.map and mac.map replace addresses, port.ip.map replaces ports of given original IP.
+
+    Example usage:
+        mapping = MixRewriteMapping.from_configuration(config)
+        mapping.rewrite(linktype, data)
+    """
+
+    def __init__(self, ip_map=None, mac_map=None, port_map=None):
+        """
+        :param ip_map: dict original raw IP -> new raw IP of the same version
+        :param mac_map: dict original raw MAC -> new raw MAC
+        :param port_map: dict original raw IP -> dict original port -> new port
+        """
+        self.ip_map = ip_map or {}
+        self.mac_map = mac_map or {}
+        self.port_map = port_map or {}
+
+    @property
+    def empty(self):
+        """
+        True if mapping doesn't change any packet
+        """
+        return not (self.ip_map or self.mac_map or any(self.port_map.values()))
+
+    @staticmethod
+    def from_configuration(config):
+        """
+        Create mapping from mixer configuration
+
+        :param config: configuration dict created by TraceMixer.prepare_configuration
+        :raise ValueError: invalid address in configuration or IP mapped to IP of other version
+        :return: MixRewriteMapping
+        """
+        ip_map = {}
+        for item in config.get("ip.map") or []:
+            old, new = parse_ip(item["ip"]["old"]), parse_ip(item["ip"]["new"])
+            if len(old) != len(new):
+                raise ValueError("IP %s can't be replaced by IP %s" % (item["ip"]["old"], item["ip"]["new"]))
+            ip_map[old] = new
+
+        mac_map = {
+            parse_mac(item["mac"]["old"]): parse_mac(item["mac"]["new"]) for item in config.get("mac.map") or []
+        }
+
+        port_map = {}
+        for item in config.get("port.ip.map") or []:
+            ports = port_map.setdefault(parse_ip(item["ip"]), {})
+            for pair in item.get("port_mappings") or []:
+                ports[int(pair["original"])] = int(pair["replacement"])
+
+        return MixRewriteMapping(ip_map, mac_map, port_map)
+
+    def rewrite(self, linktype, data):
+        """
+        Rewrite one packet in place, checksums are updated incrementally
+
+        :param linktype: link type of packet
+        :param data: bytearray with packet data, it is modified
+        """
+        headers = decode(linktype, data)
+        view = memoryview(data)
+
+        if headers.eth_offset is not None:
+            if is_arp(headers, data):
+                self._rewrite_arp(view)
+            new_dst = self.mac_map.get(headers.eth_dst)
+            if new_dst is not None:
+                view[0:6] = new_dst
+            new_src = self.mac_map.get(headers.eth_src)
+            if new_src is not None:
+                view[6:12] = new_src
+
+        if headers.l3_offset is None:
+            return
+
+        if self.port_map and headers.src_port is not None:
+            self._rewrite_ports(view, headers)
+
+        new_src = self.ip_map.get(headers.ip_src)
+        new_dst = self.ip_map.get(headers.ip_dst)
+        if new_src is None and new_dst is None:
+            return
+
+        l3 = headers.l3_offset
+        start, size = (l3 + 12, 4) if headers.ip_version == 4 else (l3 + 8, 16)
+        old_addresses = bytes(view[start:start + 2 * size])
+        if new_src is not None:
+            view[start:start + size] = new_src
+        if new_dst is not None:
+            view[start + size:start + 2 * size] = new_dst
+        new_addresses = view[start:start + 2 * size]
+
+        if headers.ip_version == 4:
+            update_checksum_at(view, l3 + 10, old_addresses, new_addresses)
+        # Addresses are part of TCP/UDP (and ICMPv6) pseudo header
+        update_transport_checksum(view, headers, old_addresses, new_addresses)
+
+    def _rewrite_arp(self, view):
+        for mac_offset, ip_offset in ARP_ADDRESSES:
+            new_mac = self.mac_map.get(bytes(view[mac_offset:mac_offset + 6]))
+            if new_mac is not None:
+                view[mac_offset:mac_offset + 6] = new_mac
+            new_ip = self.ip_map.get(bytes(view[ip_offset:ip_offset + 4]))
+            if new_ip is not None:
+                view[ip_offset:ip_offset + 4] = new_ip
+
+    def _rewrite_ports(self, view, headers):
+        src_port = self.port_map.get(headers.ip_src, {}).get(headers.src_port, headers.src_port)
+        dst_port = self.port_map.get(headers.ip_dst, {}).get(headers.dst_port, headers.dst_port)
+        if src_port == headers.src_port and dst_port == headers.dst_port:
+            return
+
+        l4 = headers.l4_offset
+        old = bytes(view[l4:l4 + 4])
+        struct.pack_into("!HH", view, l4, src_port, dst_port)
+        update_transport_checksum(view, headers, old, view[l4:l4 + 4])
+
+
+def read_packets(file_location, mapping=None, at_timestamp=None):
+    """
+    Read packets of capture file, rewrite them and shift them in time
+
+    :param file_location: capture file (optionally gzip compressed)
+    :param mapping: MixRewriteMapping, packets are not changed if not set
+    :param at_timestamp: unixtime (seconds) the first packet is moved to, packets are not shifted if not set
+    :raise PcapError: invalid capture file
+    :return: generator of tuples (timestamp in nanoseconds, linktype, data, orig_len)
+    """
+    parser = PcapParser()
+    shift = None
+    with open_capture(file_location) as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            for record in parser.feed(chunk):
+                if shift is None:
+                    shift = 0 if at_timestamp is None else int(at_timestamp * 1000000000) - record.timestamp
+                data = record.data
+                if mapping is not None:
+                    data = bytearray(data)
+                    mapping.rewrite(record.linktype, data)
+                yield record.timestamp + shift, record.linktype, data, record.orig_len
+    parser.close()
+
+
+def merge_captures(sources, output_stream, linktype=None, nanosecond=True):
+    """
+    Merge packets of several sources into one pcap file ordered by timestamp (k-way merge)
+
+    Sources have to be ordered by timestamp, only one packet of every source is held in memory.
+    Packets with the same timestamp keep order of sources. Pcap file has one link type,
+    packets of other link types are skipped and their number is logged.
+
+    :param sources: list of iterables of (timestamp in nanoseconds, linktype, data, orig_len), see read_packets
+    :param output_stream: binary stream output pcap file is written to
+    :param linktype: link type of output file, link type of the first packet of the first source if not set
+    :param nanosecond: True to write timestamps with nanosecond resolution, otherwise microsecond
+    :return: number of written packets
+    """
+    sources = [iter(source) for source in sources]
+    if linktype is None:
+        first = next(sources[0], None) if sources else None
+        if first is not None:
+            linktype = first[1]
+            sources[0] = itertools.chain([first], sources[0])
+        else:
+            linktype = LINKTYPE_ETHERNET
+
+    writer = PcapWriter(output_stream, linktype, nanosecond=nanosecond)
+    packets = 0
+    skipped = 0
+    for timestamp, packet_linktype, data, orig_len in heapq.merge(*sources, key=lambda packet: packet[0]):
+        if packet_linktype != linktype:
+            skipped += 1
+            continue
+        writer.write(max(timestamp, 0), data, orig_len)
+        packets += 1
+    if skipped:
+        logger.warning("Skipped %s packets with link type other than %s", skipped, linktype)
+    return packets
+
+
+def prepare_capture(file_location, output_location, mapping=None, at_timestamp=None, nanosecond=True):
+    """
+    Write decompressed capture file with rewritten and shifted packets, see read_packets
+
+    :param file_location: capture file (optionally gzip compressed)
+    :param output_location: output pcap file
+    :param mapping: MixRewriteMapping, packets are not changed if not set
+    :param at_timestamp: unixtime (seconds) the first packet is moved to, packets are not shifted if not set
+    :param nanosecond: True to write timestamps with nanosecond resolution, otherwise microsecond
+    :raise PcapError: invalid capture file
+    :return: number of written packets
+    """
+    with open(output_location, "wb") as f:
+        return merge_captures([read_packets(file_location, mapping, at_timestamp)], f, nanosecond=nanosecond)
@@ -1,10 +1,10 @@
-from flask import send_file, request
+from flask import request
 from flask_restplus import Resource
 from flask_injector import inject
-from pathvalidate import sanitize_filename
 
-from traces_api.tools import escape
+from traces_api.tools import escape, send_capture
 from traces_api.api.restplus import api
+from traces_api.schemas import download_filter_fields
 from .schemas import ann_unit_details_response, ann_unit_find_response, ann_unit_find, ann_unit_update
 from .service import AnnotatedUnitService, AnnotatedUnitDoesntExistsException, OperatorEnum, UnableToRemoveAnnotatedUnitException
 from traces_api.modules.mix.service import MixService
@@ -40,6 +40,7 @@ class AnnUnitDownload(Resource):
         super().__init__(*args, **kwargs)
         self._service_ann_unit = service_ann_unit
 
+    @api.expect(download_filter_fields)
     @api.response(200, "Annotated unit returned")
     @ns.produces(["application/binary"])
     @api.doc(responses={404: "Annotated unit not found"})
@@ -47,17 +48,10 @@ class AnnUnitDownload(Resource):
         ann_unit = self._service_ann_unit.get_annotated_unit(id_annotated_unit)
         file = self._service_ann_unit.download_annotated_unit(id_annotated_unit)
 
-        file_name = "%s.%s" % (sanitize_filename(ann_unit.name), sanitize_filename(file.format))
-        if file.is_compressed():
-            file_name += ".gz"
-
-        return send_file(
-            file.location,
-            mimetype="application/vnd.tcpdump.pcap",
-            attachment_filename=file_name,
-            as_attachment=True,
-            cache_timeout=0
-        )
+        # Annotated unit is analyzed after normalization, analysis reports order of packets
+        capture_info = (ann_unit.dict()["stats"] or {}).get("capture_info") or {}
+        time_ordered = capture_info.get("Strict time order") == "True"
+        return send_capture(file, ann_unit.name, download_filter_fields.parse_args(), time_ordered)
 
 
 @ns.route('/<id_annotated_unit>/update')
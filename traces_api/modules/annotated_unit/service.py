@@ -1,4 +1,6 @@
+import os
 import json
+import functools
 import sqlalchemy.exc
 from enum import Enum
 from datetime import datetime
@@ -7,7 +9,7 @@ from sqlalchemy import desc, or_, and_
 from traces_api.database.model.annotated_unit import ModelAnnotatedUnit, ModelAnnotatedUnitLabel
 
 from traces_api.trace_tools import TraceAnalyzer, TraceNormalizer
-from traces_api.storage import FileStorage, File
+from traces_api.storage import FileStorage
 from traces_api.tools import escape
 
 
@@ -39,22 +41,75 @@ class OperatorEnum(Enum):
     OR = "OR"
 
 
+class NormalizedUnit:
+    """
+    Result of unit normalization
+    """
+
+    def __init__(self, file_location, labels, analyzed_data):
+        """
+        :param file_location: relative location of normalized file in storage
+        :param labels: labels returned by trace normalizer
+        :param analyzed_data: analyzed data of normalized file
+        """
+        self.file_location = file_location
+        self.labels = labels
+        self.analyzed_data = analyzed_data
+
+
+def normalize_unit_file(trace_normalizer, trace_analyzer, file_storage, location, format, configuration):
+    """
+    Normalize unit file into storage and analyze normalized file
+
+    Function is module level, so it can be run in worker process.
+    Normalized capture is compressed into storage while it is written by normalizer,
+    analyzers supporting streaming analyze it at the same time, so the capture is read only once.
+
+    :param trace_normalizer: TraceNormalizer
+    :param trace_analyzer: TraceAnalyzer
+    :param file_storage: FileStorage
+    :param location: absolute location of unit file
+    :param format: format of unit file
+    :param configuration: normalizer configuration
+    :return: NormalizedUnit
+    """
+    stream_analysis = getattr(trace_analyzer, "stream_analysis", None)
+    analysis = stream_analysis(os.path.basename(location)) if stream_analysis is not None else None
+
+    with file_storage.create_file(format=format, observers=[analysis] if analysis else []) as f:
+        labels = trace_normalizer.normalize_stream(location, f, configuration)
+
+    try:
+        if analysis is not None:
+            analyzed_data = analysis.result()
+        else:
+            analyzed_data = trace_analyzer.analyze(file_storage.get_file(f.file_name).location)
+    except Exception:
+        file_storage.remove_file(f.file_name)
+        raise
+    return NormalizedUnit(f.file_name, labels, analyzed_data)
+
+
 class AnnotatedUnitService:
     """
     This class allows to perform all business logic regarding to annotated units
     """
 
-    def __init__(self, session_maker, file_storage: FileStorage, trace_analyzer: TraceAnalyzer, trace_normalizer: TraceNormalizer):
+    def __init__(self, session_maker, file_storage: FileStorage, trace_analyzer: TraceAnalyzer, trace_normalizer: TraceNormalizer,
+                 normalized_analyzer=None):
         """
         :param session_maker: SqlAlchemy session maker
         :param file_storage: file storage used for storing datasets
         :param trace_analyzer: trace analyzer tool
         :param trace_normalizer: trace normalizer tool
+        :param normalized_analyzer: analyzer of normalized captures, trace_analyzer if not set,
+            analyzer supporting streaming (NativeTraceAnalyzer) analyzes capture while it is normalized
         """
         self._session_maker = session_maker
         self._file_storage = file_storage
         self._trace_analyzer = trace_analyzer
         self._trace_normalizer = trace_normalizer
+        self._normalized_analyzer = normalized_analyzer or trace_analyzer
 
     @property
     def _session(self):
@@ -73,16 +128,39 @@ class AnnotatedUnitService:
         :param labels: Annotated unit labels
         :return: new annotated unit
         """
-        new_ann_unit_file = File.create_new()
+        job = self.normalization_job(unit_file, mac_mapping, tcp_timestamp_mapping, ip_details)
+        return self.add_annotated_unit(name, description, labels, job())
+
+    def normalization_job(self, unit_file, mac_mapping, tcp_timestamp_mapping, ip_details):
+        """
+        Prepare normalization of unit file which can be run outside of request, in worker thread or process
+
+        Job doesn't touch database, its result is passed to add_annotated_unit.
 
+        :param unit_file: File of unit
+        :param mac_mapping:
+        :param tcp_timestamp_mapping:
+        :param ip_details:
+        :return: callable without arguments returning NormalizedUnit
+        """
         configuration = self._trace_normalizer.prepare_configuration(ip_details, mac_mapping, tcp_timestamp_mapping)
-        norm_out = self._trace_normalizer.normalize(unit_file.location, new_ann_unit_file.location, configuration)
+        return functools.partial(
+            normalize_unit_file, self._trace_normalizer, self._normalized_analyzer, self._file_storage,
+            unit_file.location, unit_file.format, configuration
+        )
 
-        analyzed_data:dict = escape(self._trace_analyzer.analyze(new_ann_unit_file.location))
-        del analyzed_data['ip.groups']
+    def add_annotated_unit(self, name, description, labels, normalized):
+        """
+        Add annotated unit created from normalized unit file into session, session is not committed
 
-        with open(new_ann_unit_file.location, "rb") as f:
-            ann_unit_file_name = self._file_storage.save_file(f, format=unit_file.format)
+        :param name: Name of annotated unit
+        :param description: Description of annotated unit
+        :param labels: Annotated unit labels
+        :param normalized: NormalizedUnit
+        :return: new annotated unit
+        """
+        analyzed_data = escape(normalized.analyzed_data)
+        del analyzed_data['ip.groups']
 
         annotated_unit = ModelAnnotatedUnit(
             name=name,
@@ -91,18 +169,26 @@ class AnnotatedUnitService:
             stats=json.dumps(analyzed_data),
             ip_details=json.dumps(
                 {
-                    "source_nodes" : norm_out["ip"]["ip.source"],
-                    "intermediate_nodes" : norm_out["ip"]["ip.intermediate"],
-                    "target_nodes" : norm_out["ip"]["ip.destination"]
+                    "source_nodes" : normalized.labels["ip"]["ip.source"],
+                    "intermediate_nodes" : normalized.labels["ip"]["ip.intermediate"],
+                    "target_nodes" : normalized.labels["ip"]["ip.destination"]
                 }
             ),
-            file_location=ann_unit_file_name,
+            file_location=normalized.file_location,
             labels=[ModelAnnotatedUnitLabel(label=l.lower()) for l in labels]
         )
 
         self._session.add(annotated_unit)
         return annotated_unit
 
+    def discard_normalized_unit(self, normalized):
+        """
+        Remove normalized file which was not saved as annotated unit
+
+        :param normalized: NormalizedUnit
+        """
+        self._file_storage.remove_file(normalized.file_location)
+
     def update_annotated_unit(self, id_annotated_unit, name=None, description=None, labels=None):
         """
         Update annotated unit
@@ -1,10 +1,10 @@
-from flask import send_file, request
+from flask import request
 from flask_restplus import Resource
 from flask_injector import inject
-from pathvalidate import sanitize_filename
 
 from traces_api.api.restplus import api
-from traces_api.tools import escape
+from traces_api.tools import escape, send_capture
+from traces_api.schemas import download_filter_fields
 from .schemas import mix_detail_response, mix_find, mix_find_response, mix_create, mix_create_response, mix_update
 from .schemas import mix_generate_status_response
 from .service import MixService, MixDoesntExistsException, AnnotatedUnitDoesntExistsException, OperatorEnum
@@ -70,6 +70,7 @@ class MixDownload(Resource):
         super().__init__(*args, **kwargs)
         self._service_mix = service_mix
 
+    @api.expect(download_filter_fields)
     @api.response(200, "Mix returned")
     @ns.produces(["application/binary"])
     @api.doc(responses={404: "Mix not found"})
@@ -77,17 +78,7 @@ class MixDownload(Resource):
         mix = self._service_mix.get_mix(id_mix)
         file = self._service_mix.download_mix(id_mix)
 
-        file_name = "%s.%s" % (sanitize_filename(mix.name), sanitize_filename(file.format))
-        if file.is_compressed():
-            file_name += ".gz"
-
-        return send_file(
-            file.location,
-            mimetype="application/vnd.tcpdump.pcap",
-            attachment_filename=file_name,
-            as_attachment=True,
-            cache_timeout=0
-        )
+        return send_capture(file, mix.name, download_filter_fields.parse_args())
 
 
 @ns.route('/find')
@@ -136,7 +127,7 @@ class MixGenerateStatus(Resource):
         mix_generation = self._service_mix.get_mix_generation(id_mix)
         if not mix_generation:
             raise MixDoesntExistsException()
-        return dict(progress=mix_generation.progress)
+        return dict(progress=mix_generation.progress, error=mix_generation.error)
 
 
 @ns.route('/<id_mix>/delete')
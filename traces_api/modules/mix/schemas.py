@@ -66,5 +66,6 @@ mix_find_response = api.model("MixFindResponse",
 
 
 mix_generate_status_response = api.model("MixGenerateStatus", dict(
-    progress=fields.Integer(min=0, max=100, example=10, description="Mix file generation progress in percent. (0-100%)")
+    progress=fields.Integer(min=0, max=100, example=10, description="Mix file generation progress in percent. (0-100%)"),
+    error=fields.String(description="Error of failed mix file generation, null unless generation failed permanently")
 ))
@@ -1,8 +1,11 @@
 import os
 import json
+import hashlib
+import shutil
+import tempfile
+import concurrent.futures
 from enum import Enum
 from datetime import datetime
-import multiprocessing
 
 from sqlalchemy import desc, update, and_ 
 import yaml
@@ -10,8 +13,10 @@ import yaml
 from traces_api.database.model.mix import ModelMix, ModelMixLabel, ModelMixOrigin, ModelMixFileGeneration
 
 from traces_api.modules.annotated_unit.service import AnnotatedUnitService
-from traces_api.trace_tools import TraceNormalizer, TraceMixing
+from traces_api.trace_tools import TraceNormalizer, TraceMixing, MixCheckpoints
 from traces_api.storage import FileStorage, File
+from traces_api.cache import FileCache
+from traces_api.jobs import JobQueue
 from traces_api.modules.unit.service import Mapping
 
 
@@ -44,7 +49,12 @@ class MixService:
     This class allows to perform all business logic regarding to mixes
     """
 
-    def __init__(self, session_maker, engine, annotated_unit_service: AnnotatedUnitService, file_storage: FileStorage, trace_normalizer: TraceNormalizer, trace_mixing: TraceMixing):
+    # type of background job generating mix file
+    JOB_MIX_GENERATION = "mix_generation"
+
+    def __init__(self, session_maker, engine, annotated_unit_service: AnnotatedUnitService, file_storage: FileStorage, trace_normalizer: TraceNormalizer, trace_mixing: TraceMixing,
+                 single_run=False, prepare_units=False, prepare_workers=None, checkpoint_cache: FileCache = None,
+                 job_queue: JobQueue = None):
         """
         :param session_maker: SqlAlchemy session maker
         :param engine: SqlAlchemy engine
@@ -52,12 +62,27 @@ class MixService:
         :param file_storage: file storage used for storing datasets
         :param trace_normalizer: trace normalizer tool
         :param trace_mixing: trace mixing tool
+        :param single_run: True to add all annotated units of mix in one mixer run (see TraceMixer.mix_all)
+            instead of one run per annotated unit
+        :param prepare_units: True to rewrite annotated units in parallel processes before mixing
+            (see TraceMixer.prepare), otherwise mixer rewrites them itself
+        :param prepare_workers: maximal number of annotated units prepared in parallel processes,
+            number of CPUs if not set
+        :param checkpoint_cache: FileCache for intermediate mixes of chained mixing (see MixCheckpoints),
+            None to disable checkpoints
+        :param job_queue: JobQueue mix generations are processed by (see traces_api.worker),
+            None to generate mixes synchronously
         """
         self._session_maker = session_maker
         self._engine = engine
         self._annotated_unit_service = annotated_unit_service
         self._file_storage = file_storage
         self._trace_normalizer = trace_normalizer
+        self._single_run = single_run
+        self._prepare_units = prepare_units
+        self._prepare_workers = prepare_workers
+        self._checkpoint_cache = checkpoint_cache
+        self._job_queue = job_queue
         self._trace_mixing = trace_mixing
 
     @property
@@ -79,37 +104,46 @@ class MixService:
         :param mix_generation_id:
         :param annotated_units_data:
         """
-
-        new_pid = os.fork()
-        if new_pid != 0:
-            exit(1)
-
         if not (all([self._exits_ann_unit(ann_unit["id_annotated_unit"]) for ann_unit in annotated_units_data])):
             raise AnnotatedUnitDoesntExistsException()
 
         self._update_mix_generation_progress(mix_generation_id, 1)
-        mixing = self._trace_mixing.create_new_mixer(File.create_new().location)
-
-        num_processed = 0
-        num_ann_units = len(annotated_units_data)
-        for ann_unit in annotated_units_data:
-            id_annotated_unit = ann_unit["id_annotated_unit"]
-
-            # new_ann_unit_file = File.create_new()
-            ann_unit_file = self._annotated_unit_service.download_annotated_unit(id_annotated_unit)
-            # configuration = self._trace_normalizer.prepare_configuration(ann_unit["ip_mapping"], ann_unit["mac_mapping"], ann_unit["timestamp"])
-            # self._trace_normalizer.normalize(ann_unit_file.location, new_ann_unit_file.location, configuration)
-
-
-            config = mixing.prepare_configuration(ann_unit['ip_mapping'], ann_unit['mac_mapping'], ann_unit['port_mapping'])
-            mixing.mix(ann_unit_file.location, config, ann_unit['at_timestamp'])
-
-            num_processed = num_processed + 1
-            self._update_mix_generation_progress(mix_generation_id, int(99*(num_processed/num_ann_units)))
-
+        if self._checkpoint_cache is not None:
+            # mix is created on the same filesystem as checkpoints, so checkpoints are hard linked, not copied,
+            # dot directories are ignored by cache
+            work_dir = tempfile.mkdtemp(dir=self._checkpoint_cache.folder, prefix=".tmp_")
+            mixing = self._trace_mixing.create_new_mixer(os.path.join(work_dir, "mix.pcap"))
+        else:
+            work_dir = None
+            mixing = self._trace_mixing.create_new_mixer(File.create_new().location)
         mix_file = File(mixing.get_mixed_file_location())
-        with open(mix_file.location, "rb") as f:
-            file_name = self._file_storage.save_file(f, format="pcap")
+
+        try:
+            annotated_units = [
+                (
+                    self._annotated_unit_service.download_annotated_unit(ann_unit["id_annotated_unit"]).location,
+                    mixing.prepare_configuration(ann_unit['ip_mapping'], ann_unit['mac_mapping'], ann_unit['port_mapping']),
+                    ann_unit['at_timestamp'],
+                ) for ann_unit in annotated_units_data
+            ]
+
+            # prepared units are stored next to the mix, they are removed when mix is generated
+            mix_dir = os.path.dirname(os.path.abspath(mix_file.location))
+            with tempfile.TemporaryDirectory(dir=mix_dir) as tmp_dir:
+                if self._single_run or mixing.SINGLE_PASS:
+                    mixing.mix_all(self._prepare_annotated_units(mixing, annotated_units, tmp_dir))
+                    self._update_mix_generation_progress(mix_generation_id, 99)
+                else:
+                    self._mix_chained(mixing, mix_generation_id, annotated_units, tmp_dir)
+
+            with open(mix_file.location, "rb") as f:
+                file_name = self._file_storage.save_file(f, format="pcap")
+        finally:
+            # failed generation is retried with new mix file
+            if os.path.exists(mix_file.location):
+                os.remove(mix_file.location)
+            if work_dir is not None:
+                shutil.rmtree(work_dir, ignore_errors=True)
 
         mix_generation = self.get_mix_generation_by_id_generation(mix_generation_id)
         mix_generation.file_location = file_name
@@ -118,6 +152,77 @@ class MixService:
         self._session.add(mix_generation)
         self._session.commit()
 
+    @property
+    def _mixer_version(self):
+        """
+        Version of mixer including preparation of annotated units, prepared units are rewritten into pcap files,
+        so mixes of prepared and not prepared units may differ
+        """
+        if self._prepare_units:
+            return "{}:prepared".format(self._trace_mixing.version)
+        return self._trace_mixing.version
+
+    def _prepare_annotated_units(self, mixing, annotated_units, tmp_dir):
+        """
+        Prepare annotated units for mixing in parallel processes (see TraceMixer.prepare)
+
+        Annotated units are returned unchanged when preparation is disabled.
+
+        :param mixing: TraceMixer
+        :param annotated_units: list of tuples (annotated unit file, config, at_timestamp)
+        :param tmp_dir: directory prepared units are stored in
+        :return: list of tuples (prepared file, config, at_timestamp) in order of annotated_units
+        """
+        if not self._prepare_units or not annotated_units:
+            return list(annotated_units)
+
+        cpus = os.cpu_count() or 1
+        workers = min(self._prepare_workers or cpus, cpus, len(annotated_units))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    mixing.prepare, annotated_unit_file, config, at_timestamp,
+                    os.path.join(tmp_dir, "prepared_{}.pcap".format(i))
+                ) for i, (annotated_unit_file, config, at_timestamp) in enumerate(annotated_units)
+            ]
+            return [future.result() for future in futures]
+
+    def _mix_chained(self, mixing, mix_generation_id, annotated_units, tmp_dir):
+        """
+        Add annotated units to mix one by one, progress is updated after every annotated unit
+
+        When checkpoints are enabled, mixing is resumed from mix of the longest already mixed prefix
+        of annotated units and mix is stored as checkpoint after every annotated unit.
+
+        :param mixing: TraceMixer
+        :param mix_generation_id:
+        :param annotated_units: list of tuples (annotated unit file, config, at_timestamp)
+        :param tmp_dir: directory prepared units are stored in
+        """
+        checkpoints = keys = None
+        num_processed = 0
+        if self._checkpoint_cache is not None:
+            checkpoints = MixCheckpoints(self._checkpoint_cache, self._mixer_version)
+            keys = checkpoints.prefix_keys(annotated_units)
+            num_processed, checkpoint = checkpoints.find(keys)
+            if checkpoint:
+                try:
+                    mixing.resume(checkpoint)
+                except FileNotFoundError:
+                    # checkpoint was evicted meanwhile
+                    num_processed = 0
+
+        num_ann_units = len(annotated_units)
+        prepared = self._prepare_annotated_units(mixing, annotated_units[num_processed:], tmp_dir)
+        for annotated_unit_file, config, at_timestamp in prepared:
+            mixing.mix(annotated_unit_file, config, at_timestamp)
+            if checkpoints:
+                checkpoints.store(keys[num_processed], mixing.get_mixed_file_location())
+
+            num_processed = num_processed + 1
+            self._update_mix_generation_progress(mix_generation_id, int(99*(num_processed/num_ann_units)))
+
     def create_mix(self, name, description, labels, annotated_units):
         """
         Create mix based on annotated_units
@@ -184,6 +289,9 @@ class MixService:
         """
         Start async mix file generation
 
+        Mix file is generated by worker processing job queue (see traces_api.worker),
+        mix with the same specification as already generated mix reuses its file.
+
         :param id_mix: id of existing mix
         :return: id_mix_generation
         """
@@ -192,39 +300,127 @@ class MixService:
         if not mix:
             raise MixDoesntExistsException(id_mix)
 
-        annotated_units_data = []
-        for origin in mix.origins:
-            annotated_units_data.append(dict(
-                id_annotated_unit=origin.id_annotated_unit,
-                ip_mapping=Mapping.create_from_dict(json.loads(origin.ip_mapping)),
-                mac_mapping=Mapping.create_from_dict(json.loads(origin.mac_mapping)),
-                port_mapping=json.loads(origin.port_mapping),
-                at_timestamp=origin.timestamp,
-            ))
-
+        annotated_units_data = self._annotated_units_data(mix)
         if not (all([self._exits_ann_unit(ann_unit["id_annotated_unit"]) for ann_unit in annotated_units_data])):
             raise AnnotatedUnitDoesntExistsException()
 
+        fingerprint = self._mix_fingerprint(mix)
+        generated = self._find_generated_mix(fingerprint)
+
         mix_generation = ModelMixFileGeneration(
             id_mix=mix.id_mix,
             creation_time=datetime.now(),
             expired=False,
             progress=0,
+            fingerprint=fingerprint,
         )
+        if generated:
+            # Mix with the same specification is already generated, its file is shared
+            mix_generation.file_location = generated.file_location
+            mix_generation.progress = 100
         self._session.add(mix_generation)
         self._session.commit()
         id_mix_generation = mix_generation.id_mix_generation
 
-        self._session_maker.remove()
-        self._engine.dispose()
+        if generated:
+            return id_mix_generation
 
-        p = multiprocessing.Process(target=self.generate_mix, args=(id_mix_generation, annotated_units_data))
-        p.daemon = True
-        p.start()
-        p.join()
+        if self._job_queue is not None:
+            self._job_queue.enqueue(self.JOB_MIX_GENERATION, dict(id_mix_generation=id_mix_generation))
+        else:
+            try:
+                self.generate_mix(id_mix_generation, annotated_units_data)
+            except Exception as e:
+                self.fail_mix_generation(id_mix_generation, str(e) or type(e).__name__)
+                raise
 
         return id_mix_generation
 
+    def run_mix_generation(self, id_mix_generation):
+        """
+        Generate mix file of queued mix generation, it is run by worker (see traces_api.worker)
+
+        :param id_mix_generation:
+        """
+        mix_generation = self.get_mix_generation_by_id_generation(id_mix_generation)
+        if not mix_generation:
+            raise MixDoesntExistsException(id_mix_generation)
+        if mix_generation.progress == 100:
+            # Generation already finished by previous attempt
+            return
+
+        self.generate_mix(id_mix_generation, self._annotated_units_data(self.get_mix(mix_generation.id_mix)))
+
+    def fail_mix_generation(self, id_mix_generation, error):
+        """
+        Mark mix generation as permanently failed, it is called when its job reaches maximal number of attempts
+
+        :param id_mix_generation:
+        :param error: error message
+        """
+        self._session.rollback()
+        q = update(ModelMixFileGeneration).values(error=(error or "")[:4096])\
+            .where(ModelMixFileGeneration.id_mix_generation == id_mix_generation)
+        self._session.execute(q)
+        self._session.commit()
+
+    @staticmethod
+    def _annotated_units_data(mix):
+        """
+        Create data of annotated units used for mix generation from mix origins
+
+        :param mix: ModelMix
+        :return: list of dicts
+        """
+        return [
+            dict(
+                id_annotated_unit=origin.id_annotated_unit,
+                ip_mapping=Mapping.create_from_dict(json.loads(origin.ip_mapping)),
+                mac_mapping=Mapping.create_from_dict(json.loads(origin.mac_mapping)),
+                port_mapping=json.loads(origin.port_mapping),
+                at_timestamp=origin.timestamp,
+            ) for origin in mix.origins
+        ]
+
+    def _mix_fingerprint(self, mix):
+        """
+        Compute fingerprint of mix specification
+
+        Fingerprint covers ordered annotated units (including their files) with mappings and timestamps
+        and version of mixer, mixes with the same fingerprint are generated into the same file.
+
+        :param mix: ModelMix
+        :return: sha256 hex digest
+        """
+        origins = []
+        for origin in mix.origins:
+            ann_unit = self._annotated_unit_service.get_annotated_unit(origin.id_annotated_unit)
+            origins.append(dict(
+                id_annotated_unit=origin.id_annotated_unit,
+                file_location=ann_unit.file_location if ann_unit else None,
+                ip_mapping=json.loads(origin.ip_mapping),
+                mac_mapping=json.loads(origin.mac_mapping),
+                port_mapping=json.loads(origin.port_mapping),
+                timestamp=origin.timestamp,
+            ))
+
+        specification = dict(origins=origins, mixer=self._mixer_version, single_run=self._single_run)
+        return hashlib.sha256(json.dumps(specification, sort_keys=True).encode()).hexdigest()
+
+    def _find_generated_mix(self, fingerprint):
+        """
+        Find completed mix file generation with given fingerprint whose file still exists
+
+        :param fingerprint: fingerprint of mix specification
+        :return: ModelMixFileGeneration or None
+        """
+        q = self._session.query(ModelMixFileGeneration).filter_by(fingerprint=fingerprint, expired=False, progress=100)
+        q = q.filter(ModelMixFileGeneration.file_location.isnot(None))
+        for mix_generation in q.order_by(desc(ModelMixFileGeneration.creation_time)):
+            if os.path.exists(self._file_storage.get_file(mix_generation.file_location).location):
+                return mix_generation
+        return None
+
     def get_mix(self, id_mix):
         """
         Get mix by id_mix from database
@@ -332,9 +528,23 @@ class MixService:
         if not mix:
             raise MixDoesntExistsException()
 
+        generations = self._session.query(ModelMixFileGeneration).filter_by(id_mix=id_mix)
+        file_locations = {g.file_location for g in generations if g.file_location}
+
+        generations.delete()
         self._session.delete(mix)
         self._session.commit()
 
+        # Mix files are shared by generations of mixes with the same fingerprint,
+        # file is removed with the last generation referencing it
+        for file_location in file_locations:
+            if self._session.query(ModelMixFileGeneration).filter_by(file_location=file_location).count():
+                continue
+            try:
+                self._file_storage.remove_file(file_location)
+            except FileNotFoundError:
+                pass
+
     def find_mixes_by_annotated_unit(self, id_annotated_unit):
         """
         Find all mixes containing specific annotated unit
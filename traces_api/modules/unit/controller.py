@@ -5,7 +5,9 @@ from flask_injector import inject
 from traces_api.api.restplus import api
 from traces_api.tools import escape
 from .schemas import unit_step1_fields, unit_step1_response, unit_step2_fields
+from .schemas import unit_upload_async_response, unit_analysis_response
 from .schemas import unit_step3_fields, unit_step3_response
+from .schemas import unit_normalize_batch, unit_normalize_batch_response
 from .schemas import unit_find, unit_find_response
 from .service import UnitService, UnitDoesntExistsException, InvalidUnitStageException, IPDetailsUnknownIPException
 from .service import Mapping, IPDetails
@@ -13,6 +15,25 @@ from .service import Mapping, IPDetails
 ns = api.namespace("unit", description="Unit")
 
 
+def normalize_arguments(data):
+    """
+    Convert normalization request of one unit into arguments of UnitService.unit_normalize
+
+    :param data: dict with keys id_unit, mac_mapping, ips, tcp_timestamp_mapping
+    :return: dict
+    """
+    return dict(
+        id_unit=data["id_unit"],
+        mac_mapping=Mapping.create_from_dict(data["mac_mapping"], keys=("mac","ips")),
+        ip_details=IPDetails(
+            data["ips"]["target_nodes"],
+            data["ips"]["intermediate_nodes"],
+            data["ips"]["source_nodes"]
+        ),
+        tcp_timestamp_mapping=Mapping.create_from_dict(data["tcp_timestamp_mapping"], keys=("ip","min"))
+    )
+
+
 @ns.route("/upload")
 class UnitSaveStep1(Resource):
 
@@ -34,6 +55,39 @@ class UnitSaveStep1(Resource):
         ))
 
 
+@ns.route("/upload_async")
+class UnitUploadAsync(Resource):
+
+    @inject
+    def __init__(self, service_unit: UnitService, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._service_unit = service_unit
+
+    @api.expect(unit_step1_fields)
+    @api.marshal_with(unit_upload_async_response)
+    def post(self):
+        args = unit_step1_fields.parse_args()
+
+        unit = self._service_unit.unit_upload_async(args["file"])
+
+        return dict(id_unit=unit.id_unit, stage=unit.stage)
+
+
+@ns.route('/<id_unit>/analysis')
+@api.doc(params={'id_unit': 'ID of unit'})
+class UnitAnalysisStatus(Resource):
+
+    @inject
+    def __init__(self, service_unit: UnitService, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._service_unit = service_unit
+
+    @api.marshal_with(unit_analysis_response)
+    @api.doc(responses={404: "Unit not found"})
+    def get(self, id_unit):
+        return self._service_unit.get_unit_analysis(id_unit).dict()
+
+
 @ns.route("/annotate")
 class UnitSaveStep2(Resource):
 
@@ -70,22 +124,27 @@ class UnitSaveStep3(Resource):
     def post(self):
         data = escape(request.json)
 
-        mac_mapping = Mapping.create_from_dict(data["mac_mapping"], keys=("mac","ips"))
-        tcp_timestamp_mapping = Mapping.create_from_dict(data["tcp_timestamp_mapping"], keys=("ip","min"))
-
-        id_annotated_unit = self._service_unit.unit_normalize(
-            id_unit=data["id_unit"],
-            mac_mapping=mac_mapping,
-            ip_details=IPDetails(
-                data["ips"]["target_nodes"],
-                data["ips"]["intermediate_nodes"],
-                data["ips"]["source_nodes"]
-            ),
-            tcp_timestamp_mapping=tcp_timestamp_mapping
-        )
+        id_annotated_unit = self._service_unit.unit_normalize(**normalize_arguments(data))
         return dict(id_annotated_unit=id_annotated_unit.id_annotated_unit)
 
 
+@ns.route("/normalize_batch")
+class UnitNormalizeBatch(Resource):
+
+    @inject
+    def __init__(self, service_unit: UnitService, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._service_unit = service_unit
+
+    @api.expect(unit_normalize_batch)
+    @api.marshal_with(unit_normalize_batch_response)
+    def post(self):
+        data = escape(request.json)
+
+        results = self._service_unit.unit_normalize_batch([normalize_arguments(item) for item in data["units"]])
+        return dict(units=[result.dict() for result in results])
+
+
 @ns.route('/<id_unit>')
 @api.doc(params={'id_unit': 'ID of unit'})
 class UnitDelete(Resource):
@@ -28,6 +28,23 @@ unit_step1_response = api.model("UnitStep1Response", dict(
 ))
 
 
+unit_upload_async_response = api.model("UnitUploadAsyncResponse", dict(
+    id_unit=unit_id,
+    stage=fields.String(example="analyzing", description="Unit stage", required=True),
+))
+
+
+unit_analysis_response = api.model("UnitAnalysisResponse", dict(
+    id_unit=unit_id,
+    stage=fields.String(
+        example="upload", required=True,
+        description="Unit stage - analyzing while analysis is running, analysis_failed if analysis failed"
+    ),
+    analytical_data=analytical_data,
+    error=fields.String(description="Error message if analysis failed"),
+))
+
+
 # Unit step 2
 
 unit_step2_fields = api.model("UnitStep2", dict(
@@ -52,6 +69,23 @@ unit_step3_response = api.model("UnitStep3Response", dict(
 ))
 
 
+unit_normalize_batch = api.model("UnitNormalizeBatch", dict(
+    units=fields.List(fields.Nested(unit_step3_fields), required=True)
+))
+
+unit_normalize_batch_response = api.model("UnitNormalizeBatchResponse", dict(
+    units=fields.List(fields.Nested(api.model("UnitNormalizeBatchItem", dict(
+        id_unit=unit_id,
+        status=fields.String(
+            example="created", required=True,
+            description="created, not_found, invalid_stage, duplicate (unit is already in batch) or failed"
+        ),
+        id_annotated_unit=fields.Integer(example=156, description="ID of newly created annotated unit"),
+        error=fields.String(description="Error message if normalization failed"),
+    ))))
+))
+
+
 # Unit find
 
 unit_find = api.model("UnitFind", dict(
@@ -1,4 +1,9 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
 import json
+import concurrent.futures
 
 from datetime import datetime
 from sqlalchemy import desc
@@ -106,6 +111,66 @@ class IPDetails:
         )
 
 
+class UnitAnalysis:
+    """
+    State of unit analysis
+    """
+
+    def __init__(self, id_unit, stage, analytical_data=None, error=None):
+        """
+        :param id_unit: ID of unit
+        :param stage: stage of unit, "analyzing" while analysis is running
+        :param analytical_data: analyzed data, None if analysis is not finished
+        :param error: error message if analysis failed
+        """
+        self.id_unit = id_unit
+        self.stage = stage
+        self.analytical_data = analytical_data
+        self.error = error
+
+    def dict(self):
+        """
+        Convert class to dict
+        :return: dict
+        """
+        return dict(
+            id_unit=self.id_unit,
+            stage=self.stage,
+            analytical_data=self.analytical_data,
+            error=self.error,
+        )
+
+
+class NormalizeBatchResult:
+    """
+    Result of normalization of one unit in batch
+    """
+
+    def __init__(self, id_unit, status, id_annotated_unit=None, error=None):
+        """
+        :param id_unit: ID of unit
+        :param status: "created", "not_found", "invalid_stage", "duplicate" or "failed"
+        :param id_annotated_unit: ID of created annotated unit
+        :param error: error message if normalization failed
+        """
+        self.id_unit = id_unit
+        self.status = status
+        self.id_annotated_unit = id_annotated_unit
+        self.error = error
+
+    def dict(self):
+        """
+        Convert class to dict
+        :return: dict
+        """
+        return dict(
+            id_unit=self.id_unit,
+            status=self.status,
+            id_annotated_unit=self.id_annotated_unit,
+            error=self.error,
+        )
+
+
 class UnitServiceAbstract:
     """
     This class allows to create unit and transform it into annotated unit.
@@ -123,6 +188,28 @@ class UnitServiceAbstract:
         """
         raise NotImplementedError()
 
+    def unit_upload_async(self, file):
+        """
+        Create unit step 1 without waiting for analysis
+
+        Uploaded unit is saved and analyzed in background, unit is in stage "analyzing" until analysis finishes.
+        Then it is in stage "upload" or "analysis_failed".
+        Use get_unit_analysis to get state and result of analysis.
+
+        :param file: Uploaded file
+        :return: unit
+        """
+        raise NotImplementedError()
+
+    def get_unit_analysis(self, id_unit):
+        """
+        Get state and result of unit analysis
+
+        :param id_unit: ID of existing unit
+        :return: UnitAnalysis
+        """
+        raise NotImplementedError()
+
     def unit_annotate(self, id_unit, name, description=None, labels=None):
         """
         Create unit step 2
@@ -159,6 +246,18 @@ class UnitServiceAbstract:
 
         raise NotImplementedError()
 
+    def unit_normalize_batch(self, items):
+        """
+        Create unit step 3 for many units at once
+
+        Units are normalized concurrently by worker pool, annotated units of all successfully
+        normalized units are saved in one transaction. Failure of one unit doesn't affect other units.
+
+        :param items: list of dicts with keys id_unit, mac_mapping, ip_details, tcp_timestamp_mapping
+        :return: list of NormalizeBatchResult in order of items
+        """
+        raise NotImplementedError()
+
     def unit_delete(self, id_unit):
         """
         Delete unit with given id
@@ -181,17 +280,28 @@ class UnitServiceAbstract:
 
 class UnitService(UnitServiceAbstract):
 
-    def __init__(self, session_maker, annotated_unit_service: AnnotatedUnitService, file_storage: FileStorage, trace_analyzer: TraceAnalyzer):
+    def __init__(self, session_maker, annotated_unit_service: AnnotatedUnitService, file_storage: FileStorage, trace_analyzer: TraceAnalyzer, analysis_workers=2,
+                 normalize_workers=None, normalize_processes=False):
         """
         :param session_maker: SqlAlchemy session maker
         :param annotated_unit_service: AnnotatedUnitService
         :param file_storage: file storage for storing datasets
         :param trace_analyzer: trace analyzer is used to extract analytical data from dataset
+        :param analysis_workers: maximal number of concurrently running background analyses
+        :param normalize_workers: maximal number of units normalized concurrently by unit_normalize_batch,
+            None means number of CPUs, it is never higher than number of CPUs
+        :param normalize_processes: normalize batch in worker processes instead of threads,
+            trace normalizer and analyzer have to be picklable
         """
         self._session_maker = session_maker
         self._annotated_unit_service = annotated_unit_service
         self._trace_analyzer = trace_analyzer
         self._file_storage = file_storage
+        self._analysis_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=analysis_workers, thread_name_prefix="unit-analysis"
+        )
+        self._normalize_workers = normalize_workers
+        self._normalize_processes = normalize_processes
 
     @property
     def _session(self):
@@ -201,19 +311,38 @@ class UnitService(UnitServiceAbstract):
         """
         Take unit from database using id_unit
 
+        Unit is always reloaded, it can be changed by background analysis using another session.
+
         :param id_unit: ID of existing unit
         :return: unit
         """
-        unit = self._session.query(ModelUnit).filter(ModelUnit.id_unit == id_unit).first()
+        unit = self._session.query(ModelUnit).populate_existing().filter(ModelUnit.id_unit == id_unit).first()
         return unit
 
-    def unit_upload(self, file):
+    def _save_unit_file(self, file, observers=()):
+        """
+        Save uploaded file to storage
+
+        :param file: Uploaded file
+        :param observers: objects receiving file content while it is saved
+        :return: relative file location
+        """
         if file.filename.endswith(".pcapng"):
             format = "pcapng"
         else:
             format = "pcap"
 
-        file_path = self._file_storage.save_file(file.stream, format)
+        return self._file_storage.save_file(file.stream, format, observers)
+
+    def unit_upload(self, file):
+        # Analyzers supporting streaming analyze the upload while it is stored, so the file is read only once
+        stream_analysis = getattr(self._trace_analyzer, "stream_analysis", None)
+        if stream_analysis is not None:
+            analysis = stream_analysis(file.filename)
+            file_path = self._save_unit_file(file, observers=[analysis])
+        else:
+            analysis = None
+            file_path = self._save_unit_file(file)
 
         unit = ModelUnit(
             creation_time=datetime.now(),
@@ -224,7 +353,68 @@ class UnitService(UnitServiceAbstract):
 
         self._session.add(unit)
         self._session.commit()
-        return unit, escape(self._trace_analyzer.analyze(self._file_storage.get_file(file_path).location))
+
+        if analysis is not None:
+            analytical_data = analysis.result()
+        else:
+            analytical_data = self._trace_analyzer.analyze(self._file_storage.get_file(file_path).location)
+
+        unit.analysis = json.dumps(analytical_data)
+        self._session.commit()
+        return unit, escape(analytical_data)
+
+    def unit_upload_async(self, file):
+        file_path = self._save_unit_file(file)
+
+        unit = ModelUnit(
+            creation_time=datetime.now(),
+            last_update_time=datetime.now(),
+            uploaded_file_location=file_path,
+            stage="analyzing"
+        )
+
+        self._session.add(unit)
+        self._session.commit()
+
+        self._analysis_executor.submit(self._analyze_unit, unit.id_unit, file_path)
+        return unit
+
+    def _analyze_unit(self, id_unit, file_path):
+        """
+        Analyze unit in background and store result to database
+
+        :param id_unit: ID of unit
+        :param file_path: relative location of unit file
+        """
+        # scoped session is bound to thread, so worker uses its own session
+        session = self._session_maker()
+        try:
+            values = dict(last_update_time=datetime.now())
+            try:
+                analytical_data = self._trace_analyzer.analyze(self._file_storage.get_file(file_path).location)
+                values.update(stage="upload", analysis=json.dumps(analytical_data))
+            except Exception as e:
+                logger.exception("Analysis of unit %s failed", id_unit)
+                values.update(stage="analysis_failed", analysis_error=(str(e) or type(e).__name__)[:255])
+
+            # Unit may be deleted while it is analyzed
+            session.query(ModelUnit)\
+                .filter(ModelUnit.id_unit == id_unit, ModelUnit.stage == "analyzing")\
+                .update(values, synchronize_session=False)
+            session.commit()
+        except Exception:
+            logger.exception("Unable to store analysis of unit %s", id_unit)
+            session.rollback()
+        finally:
+            self._session_maker.remove()
+
+    def get_unit_analysis(self, id_unit):
+        unit = self._get_unit(id_unit)
+        if not unit:
+            raise UnitDoesntExistsException()
+
+        analytical_data = escape(json.loads(unit.analysis)) if unit.analysis else None
+        return UnitAnalysis(unit.id_unit, unit.stage, analytical_data, unit.analysis_error)
 
     def unit_annotate(self, id_unit, name, description=None, labels=None):
         unit = self._get_unit(id_unit)
@@ -270,6 +460,93 @@ class UnitService(UnitServiceAbstract):
 
         return annotated_unit
 
+    def unit_normalize_batch(self, items):
+        results = [NormalizeBatchResult(item["id_unit"], None) for item in items]
+        units = {}
+        ids = {item["id_unit"] for item in items}
+        if ids:
+            units = {unit.id_unit: unit for unit in self._session.query(ModelUnit).filter(ModelUnit.id_unit.in_(ids))}
+
+        jobs = {}
+        scheduled = set()
+        for i, item in enumerate(items):
+            unit = units.get(item["id_unit"])
+            if unit is None:
+                results[i].status = "not_found"
+            elif unit.stage != "annotate":
+                results[i].status = "invalid_stage"
+            elif unit.id_unit in scheduled:
+                results[i].status = "duplicate"
+            else:
+                scheduled.add(unit.id_unit)
+                jobs[i] = (unit, self._annotated_unit_service.normalization_job(
+                    unit_file=self._file_storage.get_file(unit.uploaded_file_location),
+                    mac_mapping=item["mac_mapping"],
+                    tcp_timestamp_mapping=item["tcp_timestamp_mapping"],
+                    ip_details=item["ip_details"],
+                ))
+
+        normalized = self._run_normalization_jobs({i: job for i, (_, job) in jobs.items()}, results)
+        if not normalized:
+            return results
+
+        annotated_units = {}
+        for i, result in normalized.items():
+            unit = jobs[i][0]
+            unit_annotation = json.loads(unit.annotation)
+            annotated_units[i] = self._annotated_unit_service.add_annotated_unit(
+                name=unit_annotation["name"],
+                description=unit_annotation["description"],
+                labels=unit_annotation["labels"],
+                normalized=result
+            )
+            self._session.delete(unit)
+
+        try:
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            for result in normalized.values():
+                self._annotated_unit_service.discard_normalized_unit(result)
+            raise
+
+        for i, annotated_unit in annotated_units.items():
+            results[i].status = "created"
+            results[i].id_annotated_unit = annotated_unit.id_annotated_unit
+            self._file_storage.remove_file(jobs[i][0].uploaded_file_location)
+        return results
+
+    def _run_normalization_jobs(self, jobs, results):
+        """
+        Run normalization jobs in worker pool
+
+        :param jobs: dict index of item -> normalization job
+        :param results: list of NormalizeBatchResult, failed items are marked in it
+        :return: dict index of item -> NormalizedUnit of successfully normalized items
+        """
+        if not jobs:
+            return {}
+
+        cpus = os.cpu_count() or 1
+        workers = min(self._normalize_workers or cpus, cpus, len(jobs))
+        if self._normalize_processes:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="unit-normalize")
+
+        normalized = {}
+        with executor:
+            futures = {executor.submit(job): i for i, job in jobs.items()}
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                try:
+                    normalized[i] = future.result()
+                except Exception as e:
+                    logger.exception("Normalization of unit %s failed", results[i].id_unit)
+                    results[i].status = "failed"
+                    results[i].error = str(e) or type(e).__name__
+        return normalized
+
     @staticmethod
     def _validate_ip_details(ip_details, ip_mapping):
         """
@@ -0,0 +1,265 @@
+import struct
+import socket
+
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+PROTO_ICMP = 1
+PROTO_TCP = 6
+PROTO_UDP = 17
+PROTO_ICMPV6 = 58
+
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT_HEADER = 44
+
+TCP_FLAG_SYN = 0x02
+TCP_FLAG_ACK = 0x10
+
+TCP_OPTION_END = 0
+TCP_OPTION_NOP = 1
+TCP_OPTION_TIMESTAMP = 8
+
+
+class PacketHeaders:
+    """
+    Offsets and values of link, network and transport headers of one packet
+
+    Addresses are kept as raw bytes, use format_mac and format_ip to get their text representation.
+    Fields of layers which are not present in the packet are None.
+    """
+
+    __slots__ = (
+        "eth_src", "eth_dst", "eth_offset", "ip_version", "ip_src", "ip_dst", "l3_offset",
+        "protocol", "l4_offset", "src_port", "dst_port", "tcp_flags", "tcp_header_end",
+    )
+
+    def __init__(self):
+        self.eth_src = None
+        self.eth_dst = None
+        self.eth_offset = None
+        self.ip_version = None
+        self.ip_src = None
+        self.ip_dst = None
+        self.l3_offset = None
+        self.protocol = None
+        self.l4_offset = None
+        self.src_port = None
+        self.dst_port = None
+        self.tcp_flags = None
+        self.tcp_header_end = None
+
+
+def decode(linktype, data):
+    """
+    Decode headers of packet
+
+    Only headers required for analysis and rewriting are decoded (Ethernet, IPv4, IPv6, TCP, UDP).
+    Truncated or unknown headers are silently skipped.
+
+    :param linktype: link type of capture interface (LINKTYPE_*)
+    :param data: captured packet data
+    :return: PacketHeaders
+    """
+    headers = PacketHeaders()
+    length = len(data)
+
+    if linktype == LINKTYPE_ETHERNET:
+        if length < 14:
+            return headers
+        headers.eth_offset = 0
+        headers.eth_dst = bytes(data[0:6])
+        headers.eth_src = bytes(data[6:12])
+        ether_type, = struct.unpack_from("!H", data, 12)
+        offset = 14
+        while ether_type in ETHERTYPE_VLAN and length >= offset + 4:
+            ether_type, = struct.unpack_from("!H", data, offset + 2)
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if length < 16:
+            return headers
+        ether_type, = struct.unpack_from("!H", data, 14)
+        offset = 16
+    elif linktype == LINKTYPE_NULL:
+        if length < 4:
+            return headers
+        family, = struct.unpack_from("=I", data, 0)
+        if family not in (2, 0x02000000):
+            ether_type = ETHERTYPE_IPV6
+        else:
+            ether_type = ETHERTYPE_IPV4
+        offset = 4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if length < 1:
+            return headers
+        ether_type = ETHERTYPE_IPV6 if data[0] >> 4 == 6 else ETHERTYPE_IPV4
+        offset = 0
+    else:
+        return headers
+
+    if ether_type == ETHERTYPE_IPV4:
+        _decode_ipv4(headers, data, offset)
+    elif ether_type == ETHERTYPE_IPV6:
+        _decode_ipv6(headers, data, offset)
+
+    return headers
+
+
+def _decode_ipv4(headers, data, offset):
+    if len(data) < offset + 20 or data[offset] >> 4 != 4:
+        return
+
+    ihl = (data[offset] & 0x0F) * 4
+    fragment, = struct.unpack_from("!H", data, offset + 6)
+
+    headers.ip_version = 4
+    headers.l3_offset = offset
+    headers.protocol = data[offset + 9]
+    headers.ip_src = bytes(data[offset + 12:offset + 16])
+    headers.ip_dst = bytes(data[offset + 16:offset + 20])
+
+    # Transport header is present only in first fragment
+    if fragment & 0x1FFF == 0:
+        _decode_transport(headers, data, offset + ihl)
+
+
+def _decode_ipv6(headers, data, offset):
+    if len(data) < offset + 40 or data[offset] >> 4 != 6:
+        return
+
+    headers.ip_version = 6
+    headers.l3_offset = offset
+    headers.ip_src = bytes(data[offset + 8:offset + 24])
+    headers.ip_dst = bytes(data[offset + 24:offset + 40])
+
+    next_header = data[offset + 6]
+    offset += 40
+    while next_header in IPV6_EXTENSION_HEADERS or next_header == IPV6_FRAGMENT_HEADER:
+        if len(data) < offset + 8:
+            return
+        if next_header == IPV6_FRAGMENT_HEADER:
+            fragment, = struct.unpack_from("!H", data, offset + 2)
+            if fragment & 0xFFF8:
+                headers.protocol = data[offset]
+                return
+            header_length = 8
+        else:
+            header_length = (data[offset + 1] + 1) * 8
+        next_header = data[offset]
+        offset += header_length
+
+    headers.protocol = next_header
+    _decode_transport(headers, data, offset)
+
+
+def _decode_transport(headers, data, offset):
+    if headers.protocol == PROTO_TCP:
+        if len(data) < offset + 20:
+            return
+        headers.l4_offset = offset
+        headers.src_port, headers.dst_port = struct.unpack_from("!HH", data, offset)
+        headers.tcp_flags = data[offset + 13]
+        headers.tcp_header_end = min(offset + (data[offset + 12] >> 4) * 4, len(data))
+    elif headers.protocol == PROTO_UDP:
+        if len(data) < offset + 8:
+            return
+        headers.l4_offset = offset
+        headers.src_port, headers.dst_port = struct.unpack_from("!HH", data, offset)
+    elif headers.protocol in (PROTO_ICMP, PROTO_ICMPV6):
+        headers.l4_offset = offset
+
+
+def find_tcp_timestamp(data, headers):
+    """
+    Find TCP timestamp option in packet
+
+    :param data: captured packet data
+    :param headers: decoded PacketHeaders
+    :return: offset of TSval field (TSecr follows), None if option is not present
+    """
+    if headers.tcp_header_end is None:
+        return None
+
+    offset = headers.l4_offset + 20
+    end = headers.tcp_header_end
+    while offset < end:
+        kind = data[offset]
+        if kind == TCP_OPTION_END:
+            return None
+        if kind == TCP_OPTION_NOP:
+            offset += 1
+            continue
+        if offset + 1 >= end:
+            return None
+        option_length = data[offset + 1]
+        if option_length < 2:
+            return None
+        if kind == TCP_OPTION_TIMESTAMP:
+            if option_length != 10 or offset + 10 > end:
+                return None
+            return offset + 2
+        offset += option_length
+    return None
+
+
+_formatted_macs = {}
+_formatted_ips = {}
+
+
+def format_mac(mac):
+    """
+    Convert MAC address to text representation (e.g. 08:00:27:bd:c2:37)
+
+    :param mac: raw MAC address
+    :return: MAC address as string
+    """
+    text = _formatted_macs.get(mac)
+    if text is None:
+        text = ":".join("%02x" % b for b in mac)
+        if len(_formatted_macs) < 65536:
+            _formatted_macs[mac] = text
+    return text
+
+
+def format_ip(ip):
+    """
+    Convert IPv4 or IPv6 address to text representation
+
+    :param ip: raw IP address (4 or 16 bytes)
+    :return: IP address as string
+    """
+    text = _formatted_ips.get(ip)
+    if text is None:
+        text = socket.inet_ntop(socket.AF_INET if len(ip) == 4 else socket.AF_INET6, ip)
+        if len(_formatted_ips) < 65536:
+            _formatted_ips[ip] = text
+    return text
+
+
+def parse_mac(text):
+    """
+    Convert text representation of MAC address to raw bytes
+
+    :param text: MAC address as string
+    :return: raw MAC address
+    """
+    return bytes(int(part, 16) for part in text.replace("-", ":").split(":"))
+
+
+def parse_ip(text):
+    """
+    Convert text representation of IPv4 or IPv6 address to raw bytes
+
+    :param text: IP address as string
+    :return: raw IP address
+    """
+    family = socket.AF_INET6 if ":" in text else socket.AF_INET
+    return socket.inet_pton(family, text)
@@ -0,0 +1,366 @@
+import gzip
+import struct
+import hashlib
+from collections import namedtuple
+
+from traces_api.packet import LINKTYPE_ETHERNET
+
+
+PCAP_MAGIC_MICROSECONDS = 0xA1B2C3D4
+PCAP_MAGIC_NANOSECONDS = 0xA1B23C4D
+PCAPNG_BLOCK_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_BLOCK_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_BLOCK_PACKET = 0x00000002
+PCAPNG_BLOCK_SIMPLE_PACKET = 0x00000003
+PCAPNG_BLOCK_ENHANCED_PACKET = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_OPTION_IF_TSRESOL = 9
+PCAPNG_OPTION_SHB_USERAPPL = 4
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+PcapRecord = namedtuple("PcapRecord", ["number", "timestamp", "orig_len", "data", "linktype", "offset"])
+PcapRecord.__doc__ = """
+One packet read from capture file
+
+number - packet number counting from 0
+timestamp - packet timestamp in nanoseconds since epoch
+orig_len - original length of packet on wire
+data - captured bytes
+linktype - link type of interface the packet was captured on
+offset - offset of packet record in (uncompressed) capture file
+"""
+
+
+class PcapError(Exception):
+    """
+    Capture file is malformed or in unsupported format
+    """
+    pass
+
+
+class PcapParser:
+    """
+    Incremental parser of pcap and pcapng files
+
+    Parser does not need whole file at once - data can be fed in chunks of any size
+    and parsed packets are returned as soon as they are complete.
+
+    Example usage:
+        parser = PcapParser()
+        for chunk in stream:
+            for record in parser.feed(chunk):
+                ...
+        parser.close()
+    """
+
+    def __init__(self):
+        self.format = None
+        self.nanosecond = False
+        self.snaplen = None
+        self.linktypes = []
+        self.user_application = None
+        # offset after the last file header, pcapng section header or interface description block
+        self.headers_end = 0
+
+        self._buffer = bytearray()
+        self._position = 0
+        self._consumed = 0
+        self._number = 0
+        self._endian = "<"
+        self._interfaces = []
+        self._record_header = None
+
+    def feed(self, data):
+        """
+        Feed next chunk of capture file
+
+        :param data: bytes
+        :return: list of PcapRecord completed by this chunk
+        """
+        self._buffer += data
+        records = []
+
+        if self.format is None and not self._parse_file_header():
+            return records
+
+        if self.format == "pcap":
+            self._parse_pcap_records(records)
+        else:
+            self._parse_pcapng_blocks(records)
+
+        # Drop consumed data, offset of the buffer start in file is tracked to report record offsets
+        del self._buffer[:self._position]
+        self._consumed += self._position
+        self._position = 0
+        return records
+
+    def close(self):
+        """
+        Check that whole file was parsed
+
+        :raise PcapError: file is truncated
+        """
+        if self.format is None and self._buffer:
+            raise PcapError("Unknown capture file format")
+        if len(self._buffer) > self._position:
+            raise PcapError("Capture file is truncated")
+
+    @property
+    def linktype(self):
+        """
+        Link type of the first interface in file
+        """
+        return self.linktypes[0] if self.linktypes else LINKTYPE_ETHERNET
+
+    def _parse_file_header(self):
+        if len(self._buffer) < 4:
+            return False
+
+        magic_be, = struct.unpack_from(">I", self._buffer, 0)
+        magic_le, = struct.unpack_from("<I", self._buffer, 0)
+
+        if magic_be == PCAPNG_BLOCK_SECTION_HEADER:
+            self.format = "pcapng"
+            return True
+
+        for endian, magic in ((">", magic_be), ("<", magic_le)):
+            if magic in (PCAP_MAGIC_MICROSECONDS, PCAP_MAGIC_NANOSECONDS):
+                if len(self._buffer) < 24:
+                    return False
+                self._endian = endian
+                self._record_header = struct.Struct(endian + "IIII")
+                self.nanosecond = magic == PCAP_MAGIC_NANOSECONDS
+                self.snaplen, linktype = struct.unpack_from(endian + "II", self._buffer, 16)
+                self.linktypes.append(linktype & 0xFFFF)
+                self.format = "pcap"
+                self._position = 24
+                self.headers_end = 24
+                return True
+
+        raise PcapError("Unknown capture file format")
+
+    def _parse_pcap_records(self, records):
+        buffer = self._buffer
+        header = self._record_header
+        position = self._position
+        end = len(buffer)
+        multiplier = 1 if self.nanosecond else 1000
+        linktype = self.linktypes[0]
+        base = self._consumed
+
+        while position + 16 <= end:
+            ts_sec, ts_frac, incl_len, orig_len = header.unpack_from(buffer, position)
+            if position + 16 + incl_len > end:
+                break
+            data = bytes(buffer[position + 16:position + 16 + incl_len])
+            records.append(PcapRecord(
+                self._number, ts_sec * 1000000000 + ts_frac * multiplier, orig_len, data, linktype, base + position
+            ))
+            self._number += 1
+            position += 16 + incl_len
+
+        self._advance(position)
+
+    def _parse_pcapng_blocks(self, records):
+        buffer = self._buffer
+        position = self._position
+        end = len(buffer)
+        base = self._consumed
+
+        while position + 12 <= end:
+            block_type, = struct.unpack_from(self._endian + "I", buffer, position)
+
+            if block_type == PCAPNG_BLOCK_SECTION_HEADER:
+                if struct.unpack_from("<I", buffer, position + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                    self._endian = "<"
+                elif struct.unpack_from(">I", buffer, position + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                    self._endian = ">"
+                else:
+                    raise PcapError("Invalid pcapng byte order magic")
+                # New section, interface ids start from zero again
+                self._interfaces = []
+
+            block_length, = struct.unpack_from(self._endian + "I", buffer, position + 4)
+            if block_length < 12 or block_length % 4:
+                raise PcapError("Invalid pcapng block length")
+            if position + block_length > end:
+                break
+
+            body = memoryview(buffer)[position + 8:position + block_length - 4]
+            try:
+                self._parse_pcapng_block(block_type, body, base + position, records)
+            finally:
+                body.release()
+            position += block_length
+            if block_type in (PCAPNG_BLOCK_SECTION_HEADER, PCAPNG_BLOCK_INTERFACE_DESCRIPTION):
+                self.headers_end = base + position
+
+        self._advance(position)
+
+    def _parse_pcapng_block(self, block_type, body, offset, records):
+        endian = self._endian
+
+        if block_type == PCAPNG_BLOCK_SECTION_HEADER:
+            options = self._parse_pcapng_options(body[16:])
+            if PCAPNG_OPTION_SHB_USERAPPL in options:
+                self.user_application = options[PCAPNG_OPTION_SHB_USERAPPL].decode("utf-8", "replace").rstrip("\x00")
+
+        elif block_type == PCAPNG_BLOCK_INTERFACE_DESCRIPTION:
+            linktype, _, snaplen = struct.unpack_from(endian + "HHI", body, 0)
+            options = self._parse_pcapng_options(body[8:])
+            units_per_second = 1000000
+            if PCAPNG_OPTION_IF_TSRESOL in options:
+                resolution = options[PCAPNG_OPTION_IF_TSRESOL][0]
+                if resolution & 0x80:
+                    units_per_second = 2 ** (resolution & 0x7F)
+                else:
+                    units_per_second = 10 ** resolution
+            if units_per_second > 1000000:
+                self.nanosecond = True
+            self._interfaces.append((linktype, units_per_second))
+            self.linktypes.append(linktype)
+            if self.snaplen is None:
+                self.snaplen = snaplen
+
+        elif block_type in (PCAPNG_BLOCK_ENHANCED_PACKET, PCAPNG_BLOCK_PACKET):
+            if block_type == PCAPNG_BLOCK_ENHANCED_PACKET:
+                interface_id, ts_high, ts_low, caplen, orig_len = struct.unpack_from(endian + "IIIII", body, 0)
+            else:
+                interface_id, _, ts_high, ts_low, caplen, orig_len = struct.unpack_from(endian + "HHIIII", body, 0)
+            linktype, units_per_second = self._get_interface(interface_id)
+            units = (ts_high << 32) | ts_low
+            if units_per_second == 1000000:
+                timestamp = units * 1000
+            elif units_per_second == 1000000000:
+                timestamp = units
+            else:
+                timestamp = units * 1000000000 // units_per_second
+            records.append(PcapRecord(self._number, timestamp, orig_len, bytes(body[20:20 + caplen]), linktype, offset))
+            self._number += 1
+
+        elif block_type == PCAPNG_BLOCK_SIMPLE_PACKET:
+            linktype, _ = self._get_interface(0)
+            orig_len, = struct.unpack_from(endian + "I", body, 0)
+            caplen = min(orig_len, len(body) - 4)
+            records.append(PcapRecord(self._number, 0, orig_len, bytes(body[4:4 + caplen]), linktype, offset))
+            self._number += 1
+
+    def _parse_pcapng_options(self, data):
+        options = {}
+        position = 0
+        while position + 4 <= len(data):
+            code, length = struct.unpack_from(self._endian + "HH", data, position)
+            if code == 0:
+                break
+            options[code] = bytes(data[position + 4:position + 4 + length])
+            position += 4 + ((length + 3) & ~3)
+        return options
+
+    def _get_interface(self, interface_id):
+        if interface_id >= len(self._interfaces):
+            raise PcapError("Packet refers to unknown interface %s" % interface_id)
+        return self._interfaces[interface_id]
+
+    def _advance(self, position):
+        self._position = position
+
+
+class PcapWriter:
+    """
+    Write packets into pcap file
+
+    Example usage:
+        writer = PcapWriter(stream, linktype=LINKTYPE_ETHERNET)
+        writer.write(record.timestamp, record.data, record.orig_len)
+    """
+
+    def __init__(self, stream, linktype=LINKTYPE_ETHERNET, snaplen=262144, nanosecond=False, header=True):
+        """
+        :param stream: binary stream the file is written to
+        :param linktype: link type of packets
+        :param snaplen: maximal length of captured packet
+        :param nanosecond: True if nanosecond timestamp precision should be used
+        :param header: False to write packet records only, e.g. when file is written by parts
+        """
+        self._stream = stream
+        self._nanosecond = nanosecond
+        self._record_header = struct.Struct("<IIII")
+
+        if header:
+            magic = PCAP_MAGIC_NANOSECONDS if nanosecond else PCAP_MAGIC_MICROSECONDS
+            self._stream.write(struct.pack("<IHHiIII", magic, 2, 4, 0, 0, snaplen, linktype))
+
+    def write(self, timestamp, data, orig_len=None):
+        """
+        Write one packet
+
+        :param timestamp: packet timestamp in nanoseconds since epoch
+        :param data: captured bytes
+        :param orig_len: original length of packet, length of data is used when not set
+        """
+        ts_sec, ts_frac = divmod(timestamp, 1000000000)
+        if not self._nanosecond:
+            ts_frac //= 1000
+        if orig_len is None:
+            orig_len = len(data)
+        self._stream.write(self._record_header.pack(ts_sec, ts_frac, len(data), orig_len))
+        self._stream.write(data)
+
+
+def open_capture(file_location):
+    """
+    Open capture file for reading, gzip compressed files are decompressed transparently
+
+    :param file_location: path to pcap/pcapng file (optionally gzip compressed)
+    :return: binary file object
+    """
+    with open(file_location, "rb") as f:
+        magic = f.read(2)
+
+    if magic == GZIP_MAGIC:
+        return gzip.open(file_location, "rb")
+    return open(file_location, "rb")
+
+
+def capture_digest(file_location):
+    """
+    Compute SHA-256 of capture content
+
+    Gzip compressed files are hashed after decompression, so the same capture has the same digest
+    regardless of how it is stored.
+
+    :param file_location: path to pcap/pcapng file (optionally gzip compressed)
+    :return: hex digest
+    """
+    h = hashlib.sha256()
+    with open_capture(file_location) as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_records(stream, parser=None):
+    """
+    Read all packets from capture stream
+
+    :param stream: binary stream with pcap/pcapng file
+    :param parser: PcapParser to be used, new one is created if not set
+    :return: generator of PcapRecord
+    """
+    if parser is None:
+        parser = PcapParser()
+
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield from parser.feed(chunk)
+
+    parser.close()
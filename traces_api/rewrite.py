@@ -0,0 +1,533 @@
+import io
+import os
+import struct
+import itertools
+import collections
+import concurrent.futures
+
+from traces_api.checksum import update_checksum_at
+from traces_api.index import read_range
+from traces_api.pcap import PcapParser, PcapWriter, READ_CHUNK_SIZE, GZIP_MAGIC
+from traces_api.pcap import PCAP_MAGIC_MICROSECONDS, PCAP_MAGIC_NANOSECONDS
+from traces_api.packet import (
+    decode, find_tcp_timestamp, format_ip, parse_ip, parse_mac,
+    PROTO_TCP, PROTO_UDP, PROTO_ICMPV6, TCP_FLAG_ACK,
+)
+
+
+ETHERTYPE_ARP = 0x0806
+# hardware type, protocol type and address lengths of Ethernet/IPv4 ARP
+ARP_ETHERNET_IPV4 = b"\x00\x01\x08\x00\x06\x04"
+# offsets of (sender MAC, sender IP) and (target MAC, target IP) in ARP packet
+ARP_ADDRESSES = ((22, 28), (32, 38))
+
+# Second octet of normalized addresses of IP groups (240.<group>.x.x) and fourth octet of their MACs
+IP_GROUPS = (
+    ("source", "ip.source", 0),
+    ("intermediate", "ip.intermediate", 85),
+    ("destination", "ip.destination", 170),
+)
+
+NORMALIZED_MAC_PREFIX = b"\x08\x00\x27"
+
+
+def is_arp(headers, data):
+    """
+    :param headers: decoded PacketHeaders of packet
+    :param data: packet data
+    :return: True if packet is Ethernet/IPv4 ARP packet (the only ARP packets which are rewritten)
+    """
+    return (
+        headers.ip_version is None and len(data) >= 42 and (data[12] << 8 | data[13]) == ETHERTYPE_ARP
+        and data[14:20] == ARP_ETHERNET_IPV4
+    )
+
+
+def update_transport_checksum(view, headers, old, new):
+    """
+    Update TCP, UDP or ICMPv6 checksum after part of pseudo header or transport header changed
+
+    Zero UDP checksum means that checksum is not used, it is kept.
+
+    :param view: writable packet data
+    :param headers: decoded PacketHeaders of packet
+    :param old: original bytes of changed part, aligned to 16-bit words
+    :param new: new bytes of changed part
+    """
+    if headers.l4_offset is None:
+        return
+    if headers.protocol == PROTO_TCP:
+        update_checksum_at(view, headers.l4_offset + 16, old, new)
+    elif headers.protocol == PROTO_UDP:
+        checksum_offset = headers.l4_offset + 6
+        if view[checksum_offset:checksum_offset + 2] == b"\x00\x00":
+            return
+        update_checksum_at(view, checksum_offset, old, new)
+        if view[checksum_offset:checksum_offset + 2] == b"\x00\x00":
+            view[checksum_offset:checksum_offset + 2] = b"\xff\xff"
+    elif headers.protocol == PROTO_ICMPV6 and headers.ip_version == 6:
+        update_checksum_at(view, headers.l4_offset + 2, old, new)
+
+
+class RewriteMapping:
+    """
+    Address and timestamp changes applied by normalization
+
+    IPs of every group are replaced by 240.<group>.0.2, 240.<group>.0.3, ... in order of configuration,
+    MAC of every replaced IP is 08:00:27:<group>:xx:xx with the same index.
+    MACs of mac.associations take MAC of their first replaced IP. Other MACs take MAC of replaced IP
+    they are first seen with. TCP timestamps sent by IPs of tcp.timestamp.min are decreased by the minimum.
+
+    Example usage:
+        mapping = RewriteMapping.from_configuration(TraceNormalizer.prepare_configuration(...))
+        mapping.labels()  # {"ip": {"ip.source": [...], "ip.intermediate": [...], "ip.destination": [...]}}
+    """
+
+    def __init__(self, ip_map=None, mac_map=None, ip_macs=None, tcp_timestamp_offsets=None, labels=None):
+        """
+        :param ip_map: dict original raw IP -> new raw IP
+        :param mac_map: dict original raw MAC -> new raw MAC
+        :param ip_macs: dict new raw IP -> raw MAC which is assigned to MACs seen with this IP
+        :param tcp_timestamp_offsets: dict original raw IP -> value subtracted from TCP timestamps sent by IP
+        :param labels: dict of normalized IPs of every group
+        """
+        self.ip_map = ip_map or {}
+        self.mac_map = mac_map or {}
+        self.ip_macs = ip_macs or {}
+        self.tcp_timestamp_offsets = tcp_timestamp_offsets or {}
+        self._labels = labels or {label: [] for _, label, _ in IP_GROUPS}
+
+    @staticmethod
+    def from_configuration(configuration):
+        """
+        Create mapping from configuration created by TraceNormalizer.prepare_configuration
+
+        :param configuration: configuration dict
+        :raise ValueError: invalid address or IPv6 address in ip.groups of configuration
+        :return: RewriteMapping
+        """
+        ip_map = {}
+        ip_macs = {}
+        labels = {}
+        ip_groups = configuration.get("ip.groups") or {}
+        for group, label, group_octet in IP_GROUPS:
+            labels[label] = []
+            for i, ip in enumerate(ip_groups.get(group) or []):
+                original = parse_ip(ip)
+                # IPv6 addresses can't be replaced by IPv4 addresses in place
+                if len(original) != 4:
+                    raise ValueError("IPv6 address %s in %s can't be normalized" % (ip, label))
+                host = i + 2
+                new_ip = bytes((240, group_octet, (host >> 8) & 0xFF, host & 0xFF))
+                labels[label].append(format_ip(new_ip))
+                if original in ip_map:
+                    continue
+                ip_map[original] = new_ip
+                ip_macs[new_ip] = NORMALIZED_MAC_PREFIX + bytes((group_octet, (i >> 8) & 0xFF, i & 0xFF))
+
+        mac_map = {}
+        for association in configuration.get("mac.associations") or []:
+            for ip in association["ips"]:
+                new_ip = ip_map.get(parse_ip(ip))
+                if new_ip is not None:
+                    mac_map[parse_mac(association["mac"])] = ip_macs[new_ip]
+                    break
+
+        tcp_timestamp_offsets = {
+            parse_ip(item["ip"]): int(item["min"]) for item in configuration.get("tcp.timestamp.min") or []
+        }
+        return RewriteMapping(ip_map, mac_map, ip_macs, tcp_timestamp_offsets, labels)
+
+    def labels(self):
+        """
+        :return: normalized IPs of every group in the same format as labels of trace-normalizer
+        """
+        return {"ip": {label: list(ips) for label, ips in self._labels.items()}}
+
+
+class PacketRewriter:
+    """
+    Rewrite addresses and TCP timestamps of packets in place
+
+    Only changed header fields are written and checksums are updated incrementally,
+    packet payload is never copied.
+
+    Example usage:
+        rewriter = PacketRewriter(mapping)
+        data = bytearray(record.data)
+        rewriter.rewrite(record.linktype, data)
+    """
+
+    def __init__(self, mapping, learned_macs=None):
+        """
+        :param mapping: RewriteMapping
+        :param learned_macs: dict original raw MAC -> new raw MAC learned from previous packets,
+            used when capture is rewritten by parts
+        """
+        self._mapping = mapping
+        self._mac_map = dict(mapping.mac_map)
+        self._mac_map.update(learned_macs or {})
+
+    @property
+    def learned_macs(self):
+        """
+        MACs learned from packets seen so far
+
+        :return: dict original raw MAC -> new raw MAC
+        """
+        return {mac: new_mac for mac, new_mac in self._mac_map.items() if mac not in self._mapping.mac_map}
+
+    def learn(self, linktype, data):
+        """
+        Learn MACs of one packet in the same way as rewrite does, packet is not changed
+
+        :param linktype: link type of packet
+        :param data: packet data
+        """
+        headers = decode(linktype, data)
+        if headers.eth_offset is None:
+            return
+
+        ip_map = self._mapping.ip_map
+        if headers.ip_version == 4:
+            new_src = ip_map.get(headers.ip_src)
+            new_dst = ip_map.get(headers.ip_dst)
+        else:
+            new_src = new_dst = None
+
+        if is_arp(headers, data):
+            for mac_offset, ip_offset in ARP_ADDRESSES:
+                self._learn_mac(bytes(data[mac_offset:mac_offset + 6]), ip_map.get(bytes(data[ip_offset:ip_offset + 4])))
+        self._learn_mac(headers.eth_src, new_src)
+        self._learn_mac(headers.eth_dst, new_dst)
+
+    def rewrite(self, linktype, data):
+        """
+        Rewrite one packet
+
+        :param linktype: link type of packet
+        :param data: bytearray with packet data, it is modified
+        """
+        mapping = self._mapping
+        headers = decode(linktype, data)
+        view = memoryview(data)
+
+        if headers.ip_version == 4:
+            new_src = mapping.ip_map.get(headers.ip_src)
+            new_dst = mapping.ip_map.get(headers.ip_dst)
+        else:
+            new_src = new_dst = None
+
+        if headers.eth_offset is not None:
+            if is_arp(headers, data):
+                self._rewrite_arp(view)
+            self._learn_mac(headers.eth_src, new_src)
+            self._learn_mac(headers.eth_dst, new_dst)
+            self._rewrite_ethernet(view, headers)
+
+        if headers.l3_offset is None:
+            return
+
+        if headers.protocol == PROTO_TCP and headers.tcp_header_end is not None and mapping.tcp_timestamp_offsets:
+            self._rewrite_tcp_timestamp(view, headers)
+
+        if new_src is None and new_dst is None:
+            return
+
+        # Addresses are part of TCP/UDP pseudo header
+        l3 = headers.l3_offset
+        old_addresses = bytes(view[l3 + 12:l3 + 20])
+        if new_src is not None:
+            view[l3 + 12:l3 + 16] = new_src
+        if new_dst is not None:
+            view[l3 + 16:l3 + 20] = new_dst
+        new_addresses = view[l3 + 12:l3 + 20]
+
+        update_checksum_at(view, l3 + 10, old_addresses, new_addresses)
+        update_transport_checksum(view, headers, old_addresses, new_addresses)
+
+    def _learn_mac(self, mac, new_ip):
+        # Broadcast, multicast and zero MACs are never replaced
+        if new_ip is None or mac in self._mac_map or mac[0] & 1 or not any(mac):
+            return
+        self._mac_map[mac] = self._mapping.ip_macs[new_ip]
+
+    def _rewrite_ethernet(self, view, headers):
+        mac_map = self._mac_map
+        new_dst = mac_map.get(headers.eth_dst)
+        if new_dst is not None:
+            view[0:6] = new_dst
+        new_src = mac_map.get(headers.eth_src)
+        if new_src is not None:
+            view[6:12] = new_src
+
+    def _rewrite_arp(self, view):
+        mac_map = self._mac_map
+        ip_map = self._mapping.ip_map
+        for mac_offset, ip_offset in ARP_ADDRESSES:
+            new_ip = ip_map.get(bytes(view[ip_offset:ip_offset + 4]))
+            mac = bytes(view[mac_offset:mac_offset + 6])
+            self._learn_mac(mac, new_ip)
+            if mac in mac_map:
+                view[mac_offset:mac_offset + 6] = mac_map[mac]
+            if new_ip is not None:
+                view[ip_offset:ip_offset + 4] = new_ip
+
+    def _rewrite_tcp_timestamp(self, view, headers):
+        offset = find_tcp_timestamp(view, headers)
+        if offset is None:
+            return
+
+        offsets = self._mapping.tcp_timestamp_offsets
+        tsval, tsecr = struct.unpack_from("!II", view, offset)
+        new_tsval = (tsval - offsets.get(headers.ip_src, 0)) & 0xFFFFFFFF
+        # TSecr echoes TSval of the other side, it is valid only in segments with ACK
+        if headers.tcp_flags & TCP_FLAG_ACK:
+            new_tsecr = (tsecr - offsets.get(headers.ip_dst, 0)) & 0xFFFFFFFF
+        else:
+            new_tsecr = tsecr
+        if new_tsval == tsval and new_tsecr == tsecr:
+            return
+
+        # Update aligned 16-bit words containing both fields
+        start = offset - (offset - headers.l4_offset) % 2
+        end = start + 10 if start != offset else start + 8
+        old = bytes(view[start:end])
+        struct.pack_into("!II", view, offset, new_tsval, new_tsecr)
+        update_checksum_at(view, headers.l4_offset + 16, old, view[start:end])
+
+
+def rewrite_capture(input_stream, output_stream, mapping):
+    """
+    Normalize capture file in one pass
+
+    Timestamps are shifted so the first packet is captured at epoch time, addresses and TCP timestamps
+    are rewritten by PacketRewriter. Output is pcap file with link type of the first interface.
+
+    :param input_stream: binary stream of pcap or pcapng file
+    :param output_stream: binary stream output pcap file is written to
+    :param mapping: RewriteMapping
+    :raise PcapError: invalid capture file
+    :return: number of written packets
+    """
+    parser = PcapParser()
+    rewriter = PacketRewriter(mapping)
+    # Packets of every input chunk are written to output at once
+    buffer = io.BytesIO()
+    writer = None
+    shift = None
+    packets = 0
+
+    while True:
+        chunk = input_stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        records = parser.feed(chunk)
+        if writer is None and parser.linktypes:
+            writer = PcapWriter(buffer, parser.linktype, parser.snaplen or 262144, parser.nanosecond)
+
+        for record in records:
+            if shift is None:
+                shift = record.timestamp
+            data = bytearray(record.data)
+            rewriter.rewrite(record.linktype, data)
+            writer.write(max(record.timestamp - shift, 0), data, record.orig_len)
+            packets += 1
+
+        output_stream.write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+
+    parser.close()
+    if writer is None:
+        PcapWriter(buffer, parser.linktype, nanosecond=parser.nanosecond)
+    output_stream.write(buffer.getvalue())
+    return packets
+
+
+CapturePlan = collections.namedtuple("CapturePlan", ["header", "chunks"])
+CapturePlan.__doc__ = """
+Capture file split into parts at packet boundaries
+
+header - file headers preceding the first packet (pcap file header, pcapng section header and interfaces)
+chunks - list of (start, end, checkpoint) - offsets in decompressed file, end is None for the last part,
+    checkpoint is (offset in decompressed file, offset in file) where decompression of part can start
+"""
+
+
+def _scan_pcap_offsets(file_location, header):
+    """
+    Offsets of packet records in uncompressed pcap file, only record headers are read
+    """
+    endian = "<" if struct.unpack_from("<I", header)[0] in (PCAP_MAGIC_MICROSECONDS, PCAP_MAGIC_NANOSECONDS) else ">"
+    record_header = struct.Struct(endian + "IIII")
+    with open(file_location, "rb") as f:
+        offset = 24
+        f.seek(offset)
+        while True:
+            data = f.read(16)
+            if len(data) < 16:
+                return
+            yield offset
+            incl_len = record_header.unpack(data)[2]
+            f.seek(incl_len, os.SEEK_CUR)
+            offset += 16 + incl_len
+
+
+def plan_chunks(file_location, chunk_size, index=None):
+    """
+    Split capture file at packet boundaries into parts of approximately chunk_size bytes of decompressed data
+
+    Packet offsets are taken from packet index. Uncompressed pcap files without index are scanned,
+    other files can't be split without index, pcapng files with interfaces defined after the first packet
+    can't be split at all.
+
+    :param file_location: capture file (optionally gzip compressed)
+    :param chunk_size: size of part in bytes
+    :param index: PacketIndex of file
+    :return: CapturePlan or None when file can't be split
+    """
+    if index is not None:
+        # parts are parsed with headers before the first packet, pcapng interfaces defined later would be missing
+        if not len(index) or not index.headers_complete:
+            return None
+        header = b"".join(read_range(file_location, 0, index.data_offset))
+        offsets = index.offsets
+        checkpoint = index.checkpoint
+    else:
+        with open(file_location, "rb") as f:
+            header = f.read(24)
+        if header[:2] == GZIP_MAGIC:
+            return None
+        parser = PcapParser()
+        parser.feed(header)
+        if parser.format != "pcap":
+            return None
+        offsets = _scan_pcap_offsets(file_location, header)
+        checkpoint = lambda offset: (0, 0)
+
+    bounds = []
+    for offset in offsets:
+        if not bounds or offset - bounds[-1] >= chunk_size:
+            bounds.append(offset)
+
+    chunks = [
+        (start, end, checkpoint(start)) for start, end in zip(bounds, bounds[1:] + [None])
+    ]
+    return CapturePlan(header, chunks)
+
+
+def _read_chunk(file_location, header, chunk, parser=None):
+    """
+    Read packets of one part of capture file
+
+    :return: generator of PcapRecord
+    """
+    start, end, checkpoint = chunk
+    if parser is None:
+        parser = PcapParser()
+    parser.feed(header)
+    for data in read_range(file_location, start, end, checkpoint):
+        yield from parser.feed(data)
+    parser.close()
+
+
+def _learn_chunk(file_location, header, chunk, mapping):
+    """
+    Learn MACs of one part of capture file as if it was rewritten from its start
+
+    :return: tuple (dict original raw MAC -> new raw MAC, number of interfaces defined up to the end of part)
+    """
+    rewriter = PacketRewriter(mapping)
+    parser = PcapParser()
+    for record in _read_chunk(file_location, header, chunk, parser):
+        rewriter.learn(record.linktype, record.data)
+    return rewriter.learned_macs, len(parser.linktypes)
+
+
+def _rewrite_chunk(file_location, header, chunk, mapping, learned_macs, shift, nanosecond):
+    """
+    Rewrite one part of capture file
+
+    :return: tuple (pcap records without file header, number of packets)
+    """
+    rewriter = PacketRewriter(mapping, learned_macs)
+    output = io.BytesIO()
+    writer = PcapWriter(output, nanosecond=nanosecond, header=False)
+    packets = 0
+    for record in _read_chunk(file_location, header, chunk):
+        data = bytearray(record.data)
+        rewriter.rewrite(record.linktype, data)
+        writer.write(max(record.timestamp - shift, 0), data, record.orig_len)
+        packets += 1
+    return output.getvalue(), packets
+
+
+def rewrite_capture_parallel(file_location, output_stream, mapping, chunk_size, workers=None, index=None):
+    """
+    Normalize capture file by parts in worker processes, output is the same as output of rewrite_capture
+
+    Capture is split at packet boundaries (see plan_chunks). The only state rewrite_capture carries between
+    packets is timestamp of the first packet and MACs learned from previous packets. MACs learned
+    by every part on its own are collected in parallel pre-pass, rewriter of every part then starts
+    with MACs learned by all previous parts. Rewritten parts are written to output in order.
+    Pcapng files defining interfaces after the first packet are not split.
+
+    :param file_location: capture file (optionally gzip compressed)
+    :param output_stream: binary stream output pcap file is written to
+    :param mapping: RewriteMapping
+    :param chunk_size: size of part in bytes
+    :param workers: number of worker processes, number of CPUs if not set (never higher)
+    :param index: PacketIndex of file, only uncompressed pcap files are split without it
+    :raise PcapError: invalid capture file
+    :return: number of written packets or None when file can't be split into more parts,
+        nothing is written then and rewrite_capture should be used
+    """
+    plan = plan_chunks(file_location, chunk_size, index)
+    if plan is None or len(plan.chunks) < 2:
+        return None
+
+    header, chunks = plan
+    parser = PcapParser()
+    parser.feed(header)
+    first_chunk = _read_chunk(file_location, header, chunks[0])
+    shift = next(first_chunk).timestamp
+    first_chunk.close()
+
+    cpus = os.cpu_count() or 1
+    workers = min(workers or cpus, cpus, len(chunks))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        learned_macs = [None] * len(chunks)
+        if mapping.ip_map or parser.format != "pcap":
+            # MAC learned by the first part it is seen in wins
+            macs = {}
+            results = executor.map(
+                _learn_chunk, itertools.repeat(file_location), itertools.repeat(header), chunks, itertools.repeat(mapping)
+            )
+            for i, (learned, interfaces) in enumerate(results):
+                if interfaces != len(parser.linktypes):
+                    # Following parts would be parsed without the new interface
+                    return None
+                learned_macs[i] = dict(macs)
+                for mac, new_mac in learned.items():
+                    macs.setdefault(mac, new_mac)
+
+        PcapWriter(output_stream, parser.linktype, parser.snaplen or 262144, parser.nanosecond)
+        # Number of rewritten parts waiting in memory is limited
+        pending = collections.deque()
+        packets = 0
+        try:
+            for chunk, learned in zip(chunks, learned_macs):
+                pending.append(executor.submit(
+                    _rewrite_chunk, file_location, header, chunk, mapping, learned, shift, parser.nanosecond
+                ))
+                while len(pending) >= 2 * workers or (pending and chunk is chunks[-1]):
+                    data, chunk_packets = pending.popleft().result()
+                    output_stream.write(data)
+                    packets += chunk_packets
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    return packets
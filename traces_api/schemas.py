@@ -1,4 +1,6 @@
-from flask_restplus import fields
+import ipaddress
+
+from flask_restplus import fields, reqparse
 
 from traces_api.api.restplus import api
 
@@ -146,5 +148,30 @@ analytical_data = fields.Nested(api.model("AnalyticalData",
     'ip.searched_protocols' : fields.List(ip_searched_protocols),
     'ip.occurrences' : fields.List(ip_occurrences),
     'mac.associations' : fields.List(mac_associations),
+    # Present only when capture was analyzed approximately
+    'approximate' : fields.List(fields.String(example="tcp_conversations"), description='Fields which are not exact'),
+    'estimates' : fields.Nested(api.model("AnalysisEstimates", {
+        "distinct_ips": fields.Integer(),
+        "distinct_macs": fields.Integer(),
+        "tcp_conversations": fields.Integer(),
+    }), allow_null=True),
 }
 ))
+
+
+def _ip_address_argument(value):
+    return str(ipaddress.ip_address(value))
+
+
+def _port_argument(value):
+    port = int(value)
+    if not 0 <= port <= 65535:
+        raise ValueError("Port has to be between 0 and 65535")
+    return port
+
+
+download_filter_fields = reqparse.RequestParser()
+download_filter_fields.add_argument('start', type=float, location='args', help='Skip packets captured before (unixtime)')
+download_filter_fields.add_argument('end', type=float, location='args', help='Skip packets captured after (unixtime)')
+download_filter_fields.add_argument('ip', type=_ip_address_argument, location='args', help='Only packets from/to IP address')
+download_filter_fields.add_argument('port', type=_port_argument, location='args', help='Only packets from/to TCP/UDP port')
@@ -0,0 +1,124 @@
+import math
+import heapq
+import hashlib
+
+
+class HyperLogLog:
+    """
+    Estimate number of distinct values using constant memory
+
+    Standard error of estimate is about 1.04 / sqrt(2 ** precision),
+    default precision uses 4 KiB of memory and has error about 1.6%.
+
+    Example usage:
+        hll = HyperLogLog()
+        for ip in ips:
+            hll.add(ip)
+        hll.count()
+    """
+
+    def __init__(self, precision=12):
+        """
+        :param precision: number of bits used to select register (4 - 16)
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError("Precision has to be between 4 and 16")
+        self._precision = precision
+        self._registers = bytearray(1 << precision)
+
+    def add(self, value):
+        """
+        Add value
+
+        :param value: bytes or string
+        """
+        if isinstance(value, str):
+            value = value.encode()
+        h = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "little")
+
+        index = h & ((1 << self._precision) - 1)
+        remaining = h >> self._precision
+        bits = 64 - self._precision
+        # position of the first 1 bit in remaining bits
+        rank = bits - remaining.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def merge(self, other):
+        """
+        Add all values of other HyperLogLog with the same precision
+
+        :param other: HyperLogLog
+        """
+        if other._precision != self._precision:
+            raise ValueError("Precisions differ")
+        self._registers = bytearray(max(a, b) for a, b in zip(self._registers, other._registers))
+
+    def count(self):
+        """
+        :return: estimated number of distinct values
+        """
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more precise for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class HeavyHitters(dict):
+    """
+    Dict which keeps approximately the heaviest entries only
+
+    Table grows up to twice its capacity and then the lightest entries are removed,
+    so amortized cost of insert stays constant. Entries which are heavy over the whole stream
+    are kept, light entries may be removed and inserted again with part of their weight.
+
+    Example usage:
+        table = HeavyHitters(1000, weight=lambda value: value[0])
+        table.setdefault(key, [0])[0] += 1
+        removed = table.prune_if_full()
+    """
+
+    def __init__(self, capacity, weight, items=()):
+        """
+        :param capacity: number of entries kept after pruning
+        :param weight: function returning weight of value
+        :param items: initial entries
+        """
+        super().__init__(items)
+        self.capacity = capacity
+        self.weight = weight
+        self.truncated = False
+
+    def prune_if_full(self):
+        """
+        Prune table when it exceeded twice its capacity
+
+        :return: list of removed keys
+        """
+        if len(self) <= 2 * self.capacity:
+            return []
+        return self.prune()
+
+    def prune(self):
+        """
+        Remove the lightest entries so number of entries does not exceed capacity
+
+        :return: list of removed keys
+        """
+        if len(self) <= self.capacity:
+            return []
+
+        weight = self.weight
+        kept = heapq.nlargest(self.capacity, self.items(), key=lambda item: weight(item[1]))
+        kept_keys = {key for key, _ in kept}
+        removed = [key for key in self if key not in kept_keys]
+
+        self.clear()
+        self.update(kept)
+        self.truncated = True
+        return removed
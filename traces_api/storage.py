@@ -6,6 +6,13 @@ import os.path
 from datetime import datetime
 from pathvalidate import sanitize_filename
 
+from traces_api.compression import CHUNK_SIZE
+from traces_api.index import PacketIndex, PacketIndexBuilder, INDEX_SUFFIX
+
+
+# Uncompressed size of gzip members of stored files, indexed files can be read from beginning of any member
+CHECKPOINT_SIZE = 1024 * 1024
+
 
 class File:
     """
@@ -18,6 +25,7 @@ class File:
         :param location: Current file location
         """
         self.location = location
+        self._index = None
 
         if self.location.endswith(".gz"):
             self.format = self.location.split(".")[-2]
@@ -30,9 +38,31 @@ class File:
 
         :param new_location: New location of file
         """
+        if os.path.exists(self.index_location):
+            shutil.move(self.index_location, new_location + INDEX_SUFFIX)
         shutil.move(self.location, new_location)
         self.location = new_location
 
+    @property
+    def index_location(self):
+        """
+        Location of packet index sidecar of this file
+        """
+        return self.location + INDEX_SUFFIX
+
+    def index(self):
+        """
+        Load packet index of this file
+
+        :return: PacketIndex or None if file has no valid index
+        """
+        if self._index is None:
+            try:
+                self._index = PacketIndex.load(self.index_location)
+            except (OSError, ValueError):
+                return None
+        return self._index
+
     def is_compressed(self):
         """
         Is file compressed
@@ -55,18 +85,76 @@ class File:
         return File(location=random_file_path)
 
 
+class StoredFileWriter:
+    """
+    Binary stream writing new file of FileStorage
+
+    See FileStorage.create_file
+    """
+
+    def __init__(self, file_name, writer, index_builder=None, index_location=None):
+        """
+        :param file_name: relative location of file in storage
+        :param writer: CompressedWriter of file
+        :param index_builder: PacketIndexBuilder receiving content of file
+        :param index_location: location of packet index sidecar
+        """
+        self.file_name = file_name
+        self._writer = writer
+        self._index_builder = index_builder
+        self._index_location = index_location
+
+    def write(self, data):
+        """
+        :param data: bytes-like object
+        :return: number of written bytes
+        """
+        return self._writer.write(data)
+
+    def close(self):
+        """
+        Finish file and its packet index
+        """
+        self._writer.close()
+        if self._index_builder is not None:
+            index = self._index_builder.build(self._writer.checkpoints)
+            if index is not None:
+                index.save(self._index_location)
+            self._index_builder = None
+
+    def discard(self):
+        """
+        Close and remove unfinished file
+        """
+        self._writer.close()
+        self._index_builder = None
+        if os.path.exists(self._writer.name):
+            os.remove(self._writer.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
 class FileStorage:
 
-    def __init__(self, storage_folder, compression, subdirectories=True):
+    def __init__(self, storage_folder, compression, subdirectories=True, index=True):
         """
         :param storage_folder: Storage folder where files will be saved.
                                Application should have correct permissions to write to this folder.
         :param compression: Used for compressing files
         :param subdirectories: True if enable subdirectories in storage
+        :param index: True if packet index sidecar should be built for saved capture files
         """
         self._storage_folder = storage_folder
         self._compression = compression
         self._subdirectories = subdirectories
+        self._index = index
 
     @staticmethod
     def _generate_file_name():
@@ -78,12 +166,33 @@ class FileStorage:
         t = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
         return "{}_{}".format(t, str(uuid.uuid4())[:5])
 
-    def save_file(self, file_stream, format):
+    def save_file(self, file_stream, format, observers=()):
         """
         :param file_stream:
         :param format: file format (e.g. pcap, ...)
+        :param observers: objects with feed(chunk) method, they receive file content while it is saved
         :return: Relative file location
         """
+        with self.create_file(format, observers) as f:
+            shutil.copyfileobj(file_stream, f, CHUNK_SIZE)
+
+        return f.file_name
+
+    def create_file(self, format, observers=()):
+        """
+        Create new file in storage, content is written to returned stream and compressed on the fly
+
+        File is complete when the stream is closed, it is removed when exception is raised inside with block.
+
+        Example usage:
+            with file_storage.create_file("pcap") as f:
+                normalizer.normalize_stream(unit_file.location, f, configuration)
+            f.file_name
+
+        :param format: file format (e.g. pcap, ...)
+        :param observers: objects with feed(chunk) method, they receive file content while it is written
+        :return: StoredFileWriter
+        """
         if self._subdirectories:
             current_date = datetime.now().strftime("%Y-%m-%d")
 
@@ -96,9 +205,12 @@ class FileStorage:
 
         file_path = "{}/{}".format(self._storage_folder, file_name)
 
-        self._compression.compress(file_stream, file_path)
+        if not self._index:
+            return StoredFileWriter(file_name, self._compression.open_writer(file_path, observers))
 
-        return file_name
+        builder = PacketIndexBuilder()
+        writer = self._compression.open_writer(file_path, list(observers) + [builder], member_size=CHECKPOINT_SIZE)
+        return StoredFileWriter(file_name, writer, builder, file_path + INDEX_SUFFIX)
 
     def remove_file(self, relative_path):
         """
@@ -109,6 +221,8 @@ class FileStorage:
         """
         file_path = self._get_absolute_file_path(relative_path)
         os.remove(file_path)
+        if os.path.exists(file_path + INDEX_SUFFIX):
+            os.remove(file_path + INDEX_SUFFIX)
 
     def get_file(self, relative_path):
         """
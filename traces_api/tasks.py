@@ -0,0 +1,94 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import concurrent.futures
+
+
+class TaskError(Exception):
+    """
+    Task in task graph failed
+    """
+
+    def __init__(self, task, error):
+        """
+        :param task: name of failed task
+        :param error: exception raised by task
+        """
+        super().__init__("{}: {}".format(task, error))
+        self.task = task
+        self.error = error
+
+
+class TaskGraph:
+    """
+    Run tasks concurrently with respect to their dependencies
+
+    Every task is a function which gets results of tasks it depends on as keyword arguments.
+    Independent tasks are executed concurrently in thread pool, so tasks should spend most of time
+    outside of Python interpreter (e.g. waiting for subprocess).
+
+    Example usage:
+        graph = TaskGraph()
+        graph.add("a", lambda: 1)
+        graph.add("b", lambda: 2)
+        graph.add("sum", lambda a, b: a + b, depends=("a", "b"))
+        graph.run()["sum"]
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def add(self, name, function, depends=()):
+        """
+        Add task to graph
+
+        :param name: unique name of task, it is also name of keyword argument for dependent tasks
+        :param function: function executed by task
+        :param depends: names of tasks which have to finish before this task
+        """
+        if name in self._tasks:
+            raise ValueError("Task %s already exists" % name)
+        for dependency in depends:
+            if dependency not in self._tasks:
+                raise ValueError("Task %s depends on unknown task %s" % (name, dependency))
+        self._tasks[name] = (function, tuple(depends))
+
+    def run(self, max_workers=None):
+        """
+        Run all tasks and wait for them
+
+        When a task fails, no new tasks are started, running tasks are awaited and the first error is raised.
+
+        :param max_workers: maximal number of concurrently running tasks, number of tasks by default
+        :raise TaskError: task failed
+        :return: dict task name -> task result
+        """
+        results = {}
+        pending = dict(self._tasks)
+        error = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or max(len(pending), 1)) as executor:
+            running = {}
+            while pending or running:
+                if error is None:
+                    for name, (function, depends) in list(pending.items()):
+                        if all(d in results for d in depends):
+                            del pending[name]
+                            kwargs = {d: results[d] for d in depends}
+                            running[executor.submit(function, **kwargs)] = name
+                elif not running:
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        logger.debug("Task %s failed: %s", name, e)
+                        if error is None:
+                            error = TaskError(name, e)
+
+        if error is not None:
+            raise error from error.error
+        return results
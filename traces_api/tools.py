@@ -1,6 +1,11 @@
 import datetime
+import urllib.parse
 import flask
 
+from pathvalidate import sanitize_filename
+
+from traces_api.capture_filter import PacketFilter, filter_capture
+
 
 def escape(input):
     """
@@ -38,3 +43,66 @@ def escape_str(input):
     """
 
     return str(flask.escape(input))
+
+
+def send_capture(file, file_name, filter_args=None, time_ordered=False):
+    """
+    Send capture file as attachment, only selected packets are sent when filter is given
+
+    :param file: File
+    :param file_name: name of attachment without file extension
+    :param filter_args: parsed arguments of download_filter_fields
+    :param time_ordered: True if packets of file are known to be ordered by timestamp
+    :return: flask response
+    """
+    packet_filter = PacketFilter(
+        start=_to_nanoseconds(filter_args.get("start")),
+        end=_to_nanoseconds(filter_args.get("end")),
+        ip=filter_args.get("ip"),
+        port=filter_args.get("port"),
+    ) if filter_args else PacketFilter()
+
+    if packet_filter.is_empty():
+        file_name = "%s.%s" % (sanitize_filename(file_name), sanitize_filename(file.format))
+        if file.is_compressed():
+            file_name += ".gz"
+
+        return flask.send_file(
+            file.location,
+            mimetype="application/vnd.tcpdump.pcap",
+            attachment_filename=file_name,
+            as_attachment=True,
+            cache_timeout=0
+        )
+
+    chunks = filter_capture(file.location, packet_filter, file.index(), time_ordered)
+    return flask.Response(
+        flask.stream_with_context(chunks),
+        mimetype="application/vnd.tcpdump.pcap",
+        headers={
+            "Content-Disposition": content_disposition("%s.pcap" % sanitize_filename(file_name)),
+            "Cache-Control": "no-cache",
+        }
+    )
+
+
+def content_disposition(file_name):
+    """
+    Value of Content-Disposition header of attachment
+
+    File name is quoted, non-ASCII file name is encoded according to RFC 5987 with ASCII fallback.
+
+    :param file_name: name of attachment
+    :return: header value
+    """
+    fallback = file_name.encode("ascii", "ignore").decode("ascii").replace("\\", "\\\\").replace('"', '\\"')
+    value = 'attachment; filename="%s"' % fallback
+    if fallback != file_name:
+        value += "; filename*=UTF-8''%s" % urllib.parse.quote(file_name, safe="")
+    return value
+
+
+def _to_nanoseconds(timestamp):
+    if timestamp is None:
+        return None
+    return int(round(timestamp * 1000000000))
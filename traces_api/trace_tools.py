@@ -3,14 +3,23 @@ logger = logging.getLogger(__name__)
 
 import os.path
 import re
-import subprocess
+import ipaddress
 import json
 import tempfile
 import shutil
+import gzip
+import uuid
 from pathlib import Path
 import yaml
 
 from traces_api.compression import Compression
+from traces_api.containers import DockerRunner, FifoStream
+from traces_api.analysis import CaptureAnalysis
+from traces_api.merge import MixRewriteMapping, TIMESTAMP_GENERATION_SHIFT, merge_captures, prepare_capture, read_packets
+from traces_api.pcap import PcapError, capture_digest, open_capture
+from traces_api.rewrite import RewriteMapping, rewrite_capture, rewrite_capture_parallel
+from traces_api.storage import File
+from traces_api.tasks import TaskGraph, TaskError
 
 ## 3p libs
 import yaml
@@ -48,6 +57,29 @@ class TraceAnalyzer:
         https://github.com/CSIRT-MU/Trace-Share/tree/master/trace-analyzer
     """
 
+    # Increase when format of analysis changes
+    VERSION = "trace-analyzer-1"
+
+    def __init__(self, runner=None, approximate_analyzer=None, approximate_threshold=0):
+        """
+        :param runner: runner of trace-tools commands (DockerRunner or ContainerPool)
+        :param approximate_analyzer: NativeTraceAnalyzer with limits, used for files larger than approximate_threshold
+        :param approximate_threshold: size of file in bytes above which approximate_analyzer is used
+        """
+        self._runner = runner or DockerRunner()
+        self._approximate_analyzer = approximate_analyzer
+        self._approximate_threshold = approximate_threshold
+
+    @property
+    def version(self):
+        """
+        Version of analysis, results of different versions may differ
+        """
+        version = "{}:{}".format(self.VERSION, self._runner.image_id())
+        if self._approximate_analyzer is not None:
+            version += ":{}:{}".format(self._approximate_threshold, self._approximate_analyzer.version)
+        return version
+
     def analyze(self, filepath):
         """
         Analyze captured traffic dump
@@ -58,72 +90,249 @@ class TraceAnalyzer:
         - mac pairs
         - other capture information
 
+        trace-analyzer and crawler are independent, so they are executed concurrently.
+
         :param filepath: path to file to be analyzed
         :return: dict that contains analyzed information
         """
+        if self._approximate_analyzer is not None:
+            try:
+                if os.path.getsize(filepath) > self._approximate_threshold:
+                    return self._approximate_analyzer.analyze(filepath)
+            except OSError as e:
+                raise TraceAnalyzerError(str(e)) from e
+
+        graph = TaskGraph()
+        graph.add("trace_analyzer", lambda: self._run_trace_analyzer(filepath))
+        graph.add("crawler", lambda: self._run_crawler(filepath))
+        graph.add("merge", self._merge, depends=("trace_analyzer", "crawler"))
 
-        docker_params = "docker run --rm  -v \"{}\":/dumps/file.pcap trace-tools".format(filepath)
-        cmd = '{} python3 trace-analyzer/trace-analyzer.py -f "{}" -tcp -q'.format(docker_params, "/dumps/file.pcap")
-
-        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
-
-        stdout, stderr = p.communicate()
+        try:
+            return graph.run()["merge"]
+        except TaskError as e:
+            if isinstance(e.error, TraceAnalyzerError):
+                raise TraceAnalyzerError("{}: {}".format(e.task, e.error)) from e.error
+            raise TraceAnalyzerError(str(e)) from e.error
+
+    def _run_trace_analyzer(self, filepath):
+        p = self._runner.run(
+            ["python3", "trace-analyzer/trace-analyzer.py", "-f", "/dumps/file.pcap", "-a", "-q"],
+            [(filepath, "/dumps/file.pcap")]
+        )
 
         if p.returncode != 0:
+            logger.debug("Analyzer stderr: %s", p.stderr.decode())
             raise TraceAnalyzerError("error_code: %s" % p.returncode)
 
-        parts = re.split(b"\n", stdout)
-
+        parts = re.split(b"\n", p.stdout)
         try:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                target_path = filepath
-                docker_params_crawler = (
-                        'sudo docker run '
-                            '-v "{pcap_file}":/data/target.pcap '
-                            '-v "{output_dir}":/data/ '
-                            '--user $(id -u):$(id -g) '
-                            'trace-tools'
-                    ).format(
-                        pcap_file=target_path,
-                        output_dir=tmpdir,
-                    )
-                cmd = (
-                        '{docker_params} '
-                        'python trace-git/Trace-Normalizer/crawler.py '
-                            '-p /data/target.pcap '
-                            '-o /data/out.yml'
-                    ).format(
-                        docker_params=docker_params_crawler
-                    )
-
-                p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-                stdout, stderr = p.communicate()
-
-                if p.returncode != 0:
-                    raise TraceAnalyzerError("error_code: %s" % p.returncode)
-
-                # if __debug__: ## TODO Cleanup and update to logg
-                print("Analyzer stdout:", stdout)
-                print("Analyzer stderr:", stderr)
+            return dict(
+                tcp_conversations=json.loads(parts[0].decode()),
+                pairs_mac_ip=json.loads(parts[1].decode()),
+                capture_info=json.loads(parts[2].decode()),
+            )
+        except (json.decoder.JSONDecodeError, IndexError):
+            raise TraceAnalyzerError("invalid output")
+
+    def _run_crawler(self, filepath):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            p = self._runner.run(
+                ["python", "trace-git/Trace-Normalizer/crawler.py", "-p", "/data/target.pcap", "-o", "/data/out.yml"],
+                [(filepath, "/data/target.pcap"), (tmpdir, "/data/")]
+            )
+
+            logger.debug("Crawler stdout: %s", p.stdout.decode())
+            logger.debug("Crawler stderr: %s", p.stderr.decode())
 
+            if p.returncode != 0:
+                raise TraceAnalyzerError("error_code: %s" % p.returncode)
+
+            try:
                 output = Path(tmpdir) / 'out.yml'
                 with output.open('r') as handle:
-                    raw_crawler_stats = yaml.load(handle.read(), Loader=yaml.FullLoader)
-        except Exception as e:
-            raise TraceAnalyzerError(f"{stderr}") from e ## TODO cleanup
+                    return yaml.load(handle.read(), Loader=yaml.FullLoader)
+            except (OSError, yaml.YAMLError) as e:
+                raise TraceAnalyzerError(p.stderr.decode()) from e
+
+    @staticmethod
+    def _merge(trace_analyzer, crawler):
+        out = dict(trace_analyzer)
+        out.update(crawler)
+        return out
+
+
+class NativeTraceAnalyzer:
+    """
+    Analyze captured traffic dump in process
+
+    Provides the same information as TraceAnalyzer, but reads the capture only once
+    and does not need docker. Gzip compressed captures are supported.
+    """
+
+    # Increase when format of analysis changes
+    VERSION = "native-1"
+
+    def __init__(self, limits=None, approximate_threshold=0, spill_max_entries=None):
+        """
+        :param limits: AnalysisLimits of approximate analysis, None to always analyze exactly
+        :param approximate_threshold: size of file in bytes above which approximate analysis is used
+        :param spill_max_entries: number of entries of exact analysis tables kept in memory, larger tables are
+                                  spilled to disk, None for no limit
+        """
+        self._limits = limits
+        self._approximate_threshold = approximate_threshold
+        self._spill_max_entries = spill_max_entries
+
+    @property
+    def version(self):
+        """
+        Version of analysis, results of different versions may differ
+        """
+        if self._limits is not None:
+            return "{}:{}:{}".format(self.VERSION, self._approximate_threshold, ",".join(map(str, self._limits)))
+        return self.VERSION
 
+    def analyze(self, filepath):
+        """
+        Analyze captured traffic dump
+
+        :param filepath: path to file to be analyzed
+        :return: dict that contains analyzed information
+        """
         try:
-            out = dict(
-                tcp_conversations=json.loads(parts[0].decode()),
-                pairs_mac_ip=json.loads(parts[1].decode()),
-                capture_info=json.loads(parts[2].decode()),
+            return CaptureAnalysis.analyze_file(
+                filepath, self._limits, self._approximate_threshold, self._spill_max_entries
             )
-            out.update(raw_crawler_stats)
-        except json.decoder.JSONDecodeError:
-            raise TraceAnalyzerError()
+        except (OSError, PcapError) as e:
+            raise TraceAnalyzerError(str(e)) from e
 
-        return out
+    def stream_analysis(self, file_name):
+        """
+        Start analysis of file which is fed in chunks (e.g. while it is uploaded)
+
+        :param file_name: name of analyzed file
+        :return: StreamingTraceAnalysis
+        """
+        return StreamingTraceAnalysis(
+            CaptureAnalysis(file_name, self._limits, self._approximate_threshold, self._spill_max_entries)
+        )
+
+
+class StreamingTraceAnalysis:
+    """
+    Analysis of captured traffic dump fed in chunks
+
+    Errors in capture are reported by result(), so the file can be stored even if it can not be analyzed.
+
+    Example usage:
+        analysis = NativeTraceAnalyzer().stream_analysis("file.pcap")
+        file_storage.save_file(stream, "pcap", observers=[analysis])
+        analysis.result()
+    """
+
+    def __init__(self, analysis):
+        """
+        :param analysis: CaptureAnalysis
+        """
+        self._analysis = analysis
+        self._error = None
+
+    def feed(self, data):
+        """
+        Feed next chunk of file
+
+        :param data: bytes
+        """
+        if self._error is not None:
+            return
+        try:
+            self._analysis.feed(data)
+        except PcapError as e:
+            self._error = e
+
+    def result(self):
+        """
+        Finish analysis
+
+        :return: dict that contains analyzed information
+        """
+        if self._error is None:
+            try:
+                return self._analysis.result()
+            except PcapError as e:
+                self._error = e
+        raise TraceAnalyzerError(str(self._error)) from self._error
+
+
+class CachedTraceAnalyzer:
+    """
+    Trace analyzer with persistent cache of analysis results
+
+    Results are identified by SHA-256 of capture content and version of analyzer,
+    so identical captures are analyzed only once.
+    Note that capture_info of cached result describes the file which was analyzed first (e.g. file name).
+
+    Example usage:
+        analyzer = CachedTraceAnalyzer(TraceAnalyzer(), FileCache(cache_dir, max_size))
+        analyzer.analyze(filepath)
+        analyzer.hits, analyzer.misses
+    """
+
+    def __init__(self, trace_analyzer, cache):
+        """
+        :param trace_analyzer: TraceAnalyzer or NativeTraceAnalyzer used on cache miss
+        :param cache: FileCache where results are stored
+        """
+        self._trace_analyzer = trace_analyzer
+        self._cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        return self._trace_analyzer.version
+
+    @property
+    def stream_analysis(self):
+        """
+        Streaming analysis of wrapped analyzer, AttributeError is raised when it is not supported
+
+        Streaming analysis overlaps with upload, so it is not slower than cache lookup.
+        """
+        return self._trace_analyzer.stream_analysis
+
+    def analyze(self, filepath):
+        """
+        Analyze captured traffic dump, cached result is used when available
+
+        :param filepath: path to file to be analyzed
+        :return: dict that contains analyzed information
+        """
+        try:
+            key = self._cache.key("analysis", capture_digest(filepath), self.version)
+        except OSError as e:
+            raise TraceAnalyzerError(str(e)) from e
+
+        result = self._cache.get_json(key)
+        if result is not None:
+            self.hits += 1
+            logger.info("Analysis of %s loaded from cache, %s", filepath, self.stats())
+            return result
+
+        self.misses += 1
+        logger.info("Analysis of %s not found in cache, %s", filepath, self.stats())
+        result = self._trace_analyzer.analyze(filepath)
+        self._cache.put_json(key, result)
+        return result
+
+    def stats(self):
+        """
+        Cache statistics
+
+        :return: dict with number of hits and misses of this analyzer and statistics of whole cache
+            (shared by all processes)
+        """
+        return dict(hits=self.hits, misses=self.misses, cache=self._cache.stats())
 
 
 class TraceNormalizer:
@@ -137,6 +346,22 @@ class TraceNormalizer:
         https://github.com/CSIRT-MU/Trace-Share/tree/master/trace-normalizer
     """
 
+    # Increase when output of normalization changes
+    VERSION = "trace-normalizer-1"
+
+    def __init__(self, runner=None):
+        """
+        :param runner: runner of trace-tools commands (DockerRunner or ContainerPool)
+        """
+        self._runner = runner or DockerRunner()
+
+    @property
+    def version(self):
+        """
+        Version of normalizer, outputs of different versions may differ
+        """
+        return "{}:{}".format(self.VERSION, self._runner.image_id())
+
     def normalize(self, target_file_location, output_file_location, configuration):
 
         with tempfile.NamedTemporaryFile(
@@ -150,37 +375,22 @@ class TraceNormalizer:
 
             configuration_file = f.name
 
-            docker_params = (
-                    'docker run '
-                        '--rm '
-                        '-v "{target_file_location}":/data/target.pcap '
-                        '-v "{output_file_location}":/data/output.pcap '
-                        '-v "{configuration_file}":/data/config.conf '
-                        '-v "{output_dir}":/data/ '
-                        '--user $(id -u):$(id -g) '
-                        'trace-tools'
-                ).format(
-                    target_file_location=target_file_location,
-                    output_file_location=output_file_location, 
-                    configuration_file=configuration_file,
-                    output_dir=tmpdir
-                )
-            cmd = (
-                    '{docker_param} python3 trace-git/Trace-Normalizer/normalizer.py '
-                        '-p "{input_pcap}" '
-                        '-o "{output_path}" '
-                        '-l "/data/labels.yaml" '
-                        '-c "{config_path}"'
-                ).format(
-                    docker_param=docker_params, 
-                    input_pcap="/data/target.pcap", 
-                    output_path="/data/output.pcap", 
-                    config_path="/data/config.conf"
-                )
-
-            p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-            stdout, stderr = p.communicate()
+            p = self._runner.run(
+                [
+                    "python3", "trace-git/Trace-Normalizer/normalizer.py",
+                    "-p", "/data/target.pcap",
+                    "-o", "/data/output.pcap",
+                    "-l", "/data/labels.yaml",
+                    "-c", "/data/config.conf",
+                ],
+                [
+                    (target_file_location, "/data/target.pcap"),
+                    (output_file_location, "/data/output.pcap"),
+                    (configuration_file, "/data/config.conf"),
+                    (tmpdir, "/data/"),
+                ]
+            )
+            stdout, stderr = p.stdout, p.stderr
 
             # if __debug__: ## TODO Cleanup and update to logg
 
@@ -200,6 +410,20 @@ class TraceNormalizer:
                 output_data = yaml.load(handle.read(), Loader=yaml.FullLoader)
         return output_data
 
+    def normalize_stream(self, target_file_location, output_stream, configuration):
+        """
+        Normalize capture file and write normalized capture to stream
+
+        Output of trace-normalizer is a named pipe, so normalized capture is not stored in a temporary file.
+
+        :param target_file_location: capture file to be normalized (optionally gzip compressed)
+        :param output_stream: binary stream normalized capture is written to (e.g. FileStorage.create_file)
+        :param configuration: configuration dict created by prepare_configuration
+        :return: labels dict with normalized IPs
+        """
+        with FifoStream(output_stream) as fifo:
+            return self.normalize(target_file_location, fifo.path, configuration)
+
 
     @staticmethod
     def prepare_configuration(
@@ -257,6 +481,248 @@ class TraceNormalizer:
 
 
 
+class NativeTraceNormalizer(TraceNormalizer):
+    """
+    Normalize captured traffic dump in process
+
+    Timestamps, IP addresses, MAC addresses and TCP timestamps are rewritten in one pass over the capture
+    (see traces_api.rewrite), instead of chain of full-file rewrites of trace-normalizer. Uses the same
+    configuration and returns labels in the same format as TraceNormalizer.
+    Gzip compressed captures are supported, output is pcap file with link type of the first interface
+    (pcapng captures are converted, their comments and other metadata are not kept).
+    Only IPv4 addresses of ip.groups can be normalized, configuration with IPv6 address is rejected.
+    """
+
+    # Increase when output of normalization changes
+    VERSION = "native-normalizer-1"
+
+    def __init__(self, chunk_size=None, workers=None):
+        """
+        :param chunk_size: size of parts in bytes pcap files larger than that are split into
+            and normalized in parallel (with identical output), None to normalize every file in one process
+        :param workers: number of worker processes used for parallel normalization, number of CPUs if not set
+        """
+        super().__init__()
+        self._chunk_size = chunk_size
+        self._workers = workers
+
+    @property
+    def version(self):
+        return self.VERSION
+
+    def normalize(self, target_file_location, output_file_location, configuration):
+        """
+        Normalize capture file
+
+        :param target_file_location: capture file to be normalized
+        :param output_file_location: normalized capture file
+        :param configuration: configuration dict created by prepare_configuration
+        :return: labels dict with normalized IPs
+        """
+        try:
+            with open(output_file_location, "wb") as f_out:
+                return self.normalize_stream(target_file_location, f_out, configuration)
+        except OSError as e:
+            raise TraceNormalizerError(str(e)) from e
+
+    def normalize_stream(self, target_file_location, output_stream, configuration):
+        """
+        Normalize capture file and write normalized capture to stream
+
+        :param target_file_location: capture file to be normalized (optionally gzip compressed)
+        :param output_stream: binary stream normalized capture is written to (e.g. FileStorage.create_file)
+        :param configuration: configuration dict created by prepare_configuration
+        :return: labels dict with normalized IPs
+        """
+        try:
+            mapping = RewriteMapping.from_configuration(configuration)
+            packets = None
+            if self._chunk_size:
+                packets = rewrite_capture_parallel(
+                    target_file_location, output_stream, mapping, self._chunk_size, self._workers,
+                    File(target_file_location).index()
+                )
+            if packets is None:
+                with open_capture(target_file_location) as f_in:
+                    rewrite_capture(f_in, output_stream, mapping)
+        except (OSError, PcapError, ValueError, KeyError) as e:
+            logger.error("TraceNormalizerError %s", e)
+            raise TraceNormalizerError(str(e)) from e
+        return mapping.labels()
+
+
+class CachedTraceNormalizer(TraceNormalizer):
+    """
+    Trace normalizer with persistent cache of normalized captures
+
+    Outputs are identified by SHA-256 of capture content, canonical configuration and version of normalizer
+    (including id of trace-tools image), so identical capture normalized with identical configuration
+    is normalized only once. Cache entry contains gzip compressed normalized capture and labels yaml.
+
+    Example usage:
+        normalizer = CachedTraceNormalizer(TraceNormalizer(), FileCache(cache_dir, max_size))
+        normalizer.normalize_stream(target_file_location, output_stream, configuration)
+        normalizer.hits, normalizer.misses
+    """
+
+    CAPTURE_FILE = "normalized.pcap.gz"
+    LABELS_FILE = "labels.yaml"
+
+    def __init__(self, trace_normalizer, cache):
+        """
+        :param trace_normalizer: TraceNormalizer or NativeTraceNormalizer used on cache miss
+        :param cache: FileCache where outputs are stored
+        """
+        super().__init__()
+        self._trace_normalizer = trace_normalizer
+        self._cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        return self._trace_normalizer.version
+
+    @staticmethod
+    def canonical_configuration(configuration):
+        """
+        Canonical form of configuration, configurations with the same effect have the same canonical form
+
+        Order of IPs is kept, it decides about normalized addresses.
+        Addresses are written in one format, empty mac.associations is always a list.
+
+        :param configuration: configuration dict created by prepare_configuration
+        :return: configuration dict
+        """
+        def ip(value):
+            try:
+                return ipaddress.ip_address(value).compressed
+            except ValueError:
+                return value
+
+        ip_groups = configuration.get("ip.groups") or {}
+        return {
+            "ip.groups": {
+                group: [ip(i) for i in ip_groups.get(group) or []]
+                for group in ("source", "intermediate", "destination")
+            },
+            "mac.associations": [
+                dict(mac=str(association["mac"]).lower(), ips=[ip(i) for i in association["ips"]])
+                for association in configuration.get("mac.associations") or []
+            ],
+            "tcp.timestamp.min": [
+                dict(ip=ip(item["ip"]), min=int(item["min"]))
+                for item in configuration.get("tcp.timestamp.min") or []
+            ],
+        }
+
+    def _key(self, target_file_location, configuration):
+        try:
+            return self._cache.key(
+                "normalization", capture_digest(target_file_location),
+                self.canonical_configuration(configuration), self.version, self.CAPTURE_FILE
+            )
+        except OSError as e:
+            raise TraceNormalizerError(str(e)) from e
+        except (KeyError, TypeError, ValueError) as e:
+            raise TraceNormalizerError("Invalid configuration: %s" % e) from e
+
+    def _load(self, key, output_stream):
+        """
+        Copy cached output to stream
+
+        :return: labels or None when output is not cached
+        """
+        path = self._cache.get(key)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, self.LABELS_FILE), "r") as f:
+                labels = yaml.load(f, Loader=yaml.SafeLoader)
+            with gzip.open(os.path.join(path, self.CAPTURE_FILE), "rb") as f:
+                shutil.copyfileobj(f, output_stream)
+        except FileNotFoundError:
+            # Entry evicted concurrently, nothing was written yet
+            logger.warning("Cache entry %s removed while it was read", key)
+            return None
+        return labels
+
+    def normalize(self, target_file_location, output_file_location, configuration):
+        """
+        Normalize capture file, cached output is used when available
+
+        :param target_file_location: capture file to be normalized
+        :param output_file_location: normalized capture file
+        :param configuration: configuration dict created by prepare_configuration
+        :return: labels dict with normalized IPs
+        """
+        try:
+            with open(output_file_location, "wb") as f_out:
+                return self.normalize_stream(target_file_location, f_out, configuration)
+        except OSError as e:
+            raise TraceNormalizerError(str(e)) from e
+
+    def normalize_stream(self, target_file_location, output_stream, configuration):
+        """
+        Normalize capture file and write normalized capture to stream, cached output is used when available
+
+        On cache miss output of wrapped normalizer is written to stream and compressed into cache at the same time.
+
+        :param target_file_location: capture file to be normalized (optionally gzip compressed)
+        :param output_stream: binary stream normalized capture is written to (e.g. FileStorage.create_file)
+        :param configuration: configuration dict created by prepare_configuration
+        :return: labels dict with normalized IPs
+        """
+        key = self._key(target_file_location, configuration)
+
+        labels = self._load(key, output_stream)
+        if labels is not None:
+            self.hits += 1
+            logger.info("Normalization of %s loaded from cache, %s", target_file_location, self.stats())
+            return labels
+
+        self.misses += 1
+        logger.info("Normalization of %s not found in cache, %s", target_file_location, self.stats())
+        with tempfile.NamedTemporaryFile(dir=self._cache.folder, prefix=".tmp_", delete=False) as f:
+            copy_location = f.name
+        try:
+            with Compression.open_writer(copy_location) as copy:
+                labels = self._trace_normalizer.normalize_stream(
+                    target_file_location, _TeeStream(output_stream, copy), configuration
+                )
+            self._cache.put(key, {
+                self.CAPTURE_FILE: copy_location,
+                self.LABELS_FILE: yaml.dump(labels).encode(),
+            })
+        finally:
+            if os.path.exists(copy_location):
+                os.remove(copy_location)
+        return labels
+
+    def stats(self):
+        """
+        Cache statistics
+
+        :return: dict with number of hits and misses of this normalizer and statistics of whole cache
+            (shared by all processes)
+        """
+        return dict(hits=self.hits, misses=self.misses, cache=self._cache.stats())
+
+
+class _TeeStream:
+    """
+    Binary stream writing everything to two streams
+    """
+
+    def __init__(self, stream, copy):
+        self._stream = stream
+        self._copy = copy
+
+    def write(self, data):
+        self._copy.write(data)
+        return self._stream.write(data)
+
+
 class TraceMixer:
     """
     One specific mixing operation
@@ -268,10 +734,19 @@ class TraceMixer:
     """
 
     BASE_PCAP_FILE = EXT_FOLDER + "/trace-mixer/base.pcap"
+    # Increase when mixed file changes
+    VERSION = "id2t-mixer-1"
+    # True if adding all annotated units in one run (mix_all) gives the same mix as adding them one by one
+    SINGLE_PASS = False
 
-    def __init__(self, output_location):
+    def __init__(self, output_location, runner=None):
+        """
+        :param output_location: location of mixed file
+        :param runner: runner of trace-tools commands (DockerRunner or ContainerPool)
+        """
         self._previous_pcap = self.BASE_PCAP_FILE
         self._output_location = output_location
+        self._runner = runner or DockerRunner()
 
     def mix(self, annotated_unit_file, config, at_timestamp):
         """
@@ -280,66 +755,77 @@ class TraceMixer:
         :return:
         """
 
-        self._mix(annotated_unit_file, config, at_timestamp)
+        self._mix([(annotated_unit_file, config, at_timestamp)])
 
         self._previous_pcap = self._output_location
 
-    def _mix(self, annotated_unit_file, config, at_timestamp):
-        with tempfile.NamedTemporaryFile(mode="wb") as f_tmp, \
-            tempfile.NamedTemporaryFile(mode="w") as tmp_config, \
-            tempfile.TemporaryDirectory() as tmp_dir:
-            with open(self._previous_pcap, "rb") as f_previouse:
-                f_tmp.write(f_previouse.read())
-            f_tmp.flush()
-            f_tmp.file.close()
-            tmp_file = f_tmp.name
+    def mix_all(self, annotated_units):
+        """
+        Add several annotated units to mix in one mixer run
 
-            tmp_config.write(yaml.dump(config))
-            tmp_config.flush()
-            tmp_config_path = tmp_config.name
+        Every annotated unit is one Mix attack of the same ID2T invocation, ID2T generates packets of all attacks
+        and merges them with the previous mix once. Timestamps of all units are generated using statistics
+        of the previous mix, not of the mix containing previous units as in mix.
 
-            tmp_dir_name = tmp_dir
+        :param annotated_units: list of tuples (annotated unit file, config, at_timestamp)
+        """
+        if not annotated_units:
+            return
 
-            config['atk.file'] = '/data/mix_file.pcap'
+        self._mix(annotated_units)
 
-            dec_anot_unit_file = str(
-                Path(tmp_dir_name) / 'decompressed_annotated_unit.pcap'
-            )
-            Compression.decompress_file(annotated_unit_file, dec_anot_unit_file)
-
-            docker_params = (
-                    'docker run '
-                        '--rm '
-                        '-v "{}":/data/target.pcap '
-                        '-v "{}":/data/config.yaml '
-                        '-v "{}":/output ' 
-                        '-v "{}":/data/mix_file.pcap '
-                        '--user $(id -u):$(id -g) '
-                        'trace-tools'
-                ).format(
-                    tmp_file, 
-                    tmp_config_path,
-                    tmp_dir_name, #pick from here 
-                    dec_anot_unit_file
-                )
+        self._previous_pcap = self._output_location
 
-            cmd = (
-                    '{} ./trace-git/ID2T/id2t '
-                        '-i "{}" '
-                        '-o "{}" '
-                        '-a Mix '
-                            'custom.payload.file={} '
-                            'inject.at-timestamp={} '
-                ).format(
-                    docker_params, 
-                    "/data/target.pcap", 
-                    "/output/output.pcap",
-                    "/data/config.yaml",
-                    at_timestamp
-                )
+    def _mix(self, annotated_units):
+        """
+        Mix annotated units into previous mix
+
+        Previous mix is mounted to container directly and new mix is moved over output location,
+        so no mix is copied or read into memory. Working directory is created next to output location,
+        so the move is a rename.
+
+        :param annotated_units: list of tuples (annotated unit file, config, at_timestamp)
+        """
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(self._output_location))) as tmp_dir:
+            command = [
+                "./trace-git/ID2T/id2t",
+                "-i", "/data/target.pcap",
+                "-o", "/output/output.pcap",
+            ]
+            volumes = [(self._previous_pcap, "/data/target.pcap")]
+            configs = []
+
+            for i, (annotated_unit_file, config, at_timestamp) in enumerate(annotated_units):
+                tmp_config_path = os.path.join(tmp_dir, 'config_{}.yaml'.format(i))
+                configs.append((tmp_config_path, config, '/data/mix_file_{}.pcap'.format(i)))
+
+                dec_anot_unit_file = annotated_unit_file
+                if File(annotated_unit_file).is_compressed():
+                    dec_anot_unit_file = os.path.join(tmp_dir, 'decompressed_annotated_unit_{}.pcap'.format(i))
+                    Compression.decompress_file(annotated_unit_file, dec_anot_unit_file)
+
+                command += [
+                    "-a", "Mix",
+                    "custom.payload.file=/data/config_{}.yaml".format(i),
+                    "inject.at-timestamp={}".format(at_timestamp),
+                ]
+                volumes += [
+                    (tmp_config_path, "/data/config_{}.yaml".format(i)),
+                    (dec_anot_unit_file, "/data/mix_file_{}.pcap".format(i)),
+                ]
+
+            output_dir = os.path.join(tmp_dir, 'output')
+            os.mkdir(output_dir)
+            volumes.append((output_dir, "/output"))
+
+            # configs are written when all volumes are known, pooled containers see annotated units at host paths
+            for tmp_config_path, config, mix_file in configs:
+                config['atk.file'] = self._runner.container_path(mix_file, volumes)
+                with open(tmp_config_path, "w") as tmp_config:
+                    tmp_config.write(yaml.dump(config))
 
-            p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout, stderr = p.communicate()
+            p = self._runner.run(command, volumes)
+            stdout, stderr = p.stdout, p.stderr
 
             if p.returncode != 0:
                 logger.debug("Mix stdout: %s", stdout.decode())
@@ -347,12 +833,56 @@ class TraceMixer:
                 logger.error("TraceMixerError error_code %s", p.returncode)
                 raise TraceMixerError("error_code: %s" % p.returncode)
 
-            output_pcap = Path(tmp_dir_name) / 'output.pcap'
-            if not output_pcap.exists():
+            output_pcap = os.path.join(output_dir, 'output.pcap')
+            if not os.path.exists(output_pcap):
                 logger.error("Pcap file doesn't exist")
                 raise TraceMixerError("")
 
-            shutil.move(str(output_pcap), self._output_location)
+            os.replace(output_pcap, self._output_location)
+
+    def resume(self, mix_file_location):
+        """
+        Continue mixing from already generated mix instead of base capture
+
+        Mix is hard linked to output location (copied when it is on another filesystem). Mixer never changes
+        output file in place, new mix is always moved over it, so the linked mix is not modified.
+
+        :param mix_file_location: mix of annotated units added before (e.g. checkpoint, see MixCheckpoints)
+        """
+        link_or_copy(mix_file_location, self._output_location)
+        self._previous_pcap = self._output_location
+
+    @staticmethod
+    def prepare(annotated_unit_file, config, at_timestamp, output_location):
+        """
+        Prepare annotated unit for mixing, units can be prepared in parallel worker processes
+
+        Annotated unit is decompressed and its IPs, MACs and ports are rewritten according to config,
+        so mixer only generates timestamps of prepared unit.
+
+        :param annotated_unit_file: annotated unit file (optionally gzip compressed)
+        :param config: configuration created by prepare_configuration
+        :param at_timestamp: unixtime the annotated unit is added at
+        :param output_location: location of prepared unit (uncompressed pcap)
+        :raise TraceMixerError: invalid annotated unit or configuration
+        :return: tuple (prepared file, config, at_timestamp) to be passed to mix or mix_all
+        """
+        return TraceMixer._prepare(annotated_unit_file, config, at_timestamp, output_location, shift=False)
+
+    @staticmethod
+    def _prepare(annotated_unit_file, config, at_timestamp, output_location, shift):
+        try:
+            mapping = MixRewriteMapping.from_configuration(config)
+            prepare_capture(
+                annotated_unit_file, output_location, None if mapping.empty else mapping,
+                at_timestamp if shift else None, nanosecond=shift
+            )
+        except (ValueError, PcapError) as ex:
+            logger.error("TraceMixerError %s", ex)
+            raise TraceMixerError(str(ex))
+
+        config = dict(config, **{'ip.map': [], 'mac.map': [], 'port.ip.map': []})
+        return output_location, config, None if shift else at_timestamp
 
     @staticmethod
     def prepare_configuration(
@@ -391,18 +921,197 @@ class TraceMixer:
         return self._output_location
 
 
+class MergeTraceMixer(TraceMixer):
+    """
+    Mixer adding annotated units by in-process k-way merge of capture files
+
+    Annotated units are only shifted to at_timestamp, so no statistics of previous mix are needed
+    and all units are merged with the previous mix in one streaming pass without ID2T container.
+    Configurations using other timestamp generation are mixed by ID2T.
+
+    Example usage:
+        tm = MergeTraceMixer(output_location)
+        tm.mix_all([(ann_unit1, config1, at_timestamp1), (ann_unit2, config2, at_timestamp2)])
+    """
+
+    VERSION = "merge-mixer-1"
+    SINGLE_PASS = True
+
+    def _mix(self, annotated_units):
+        """
+        Merge annotated units with previous mix
+
+        New mix is written next to output location and moved over it, previous mix can be the output location.
+
+        :param annotated_units: list of tuples (annotated unit file, config, at_timestamp)
+        """
+        if any(config['timestamp']['generation'] != TIMESTAMP_GENERATION_SHIFT for _, config, _ in annotated_units):
+            return super()._mix(annotated_units)
+
+        sources = [read_packets(self._previous_pcap)]
+        for annotated_unit_file, config, at_timestamp in annotated_units:
+            try:
+                mapping = MixRewriteMapping.from_configuration(config)
+            except ValueError as ex:
+                raise TraceMixerError(str(ex))
+            sources.append(read_packets(annotated_unit_file, None if mapping.empty else mapping, at_timestamp))
+
+        output_dir = os.path.dirname(os.path.abspath(self._output_location))
+        f = tempfile.NamedTemporaryFile(dir=output_dir, suffix=".pcap", delete=False)
+        try:
+            with f:
+                merge_captures(sources, f)
+            os.replace(f.name, self._output_location)
+        except PcapError as ex:
+            logger.error("TraceMixerError %s", ex)
+            raise TraceMixerError(str(ex))
+        finally:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+    @staticmethod
+    def prepare(annotated_unit_file, config, at_timestamp, output_location):
+        """
+        Prepare annotated unit for mixing, see TraceMixer.prepare
+
+        Annotated unit using shift timestamp generation is also shifted to at_timestamp,
+        so prepared units are only merged.
+        """
+        if config['timestamp']['generation'] != TIMESTAMP_GENERATION_SHIFT:
+            return TraceMixer.prepare(annotated_unit_file, config, at_timestamp, output_location)
+        return TraceMixer._prepare(annotated_unit_file, config, at_timestamp, output_location, shift=True)
+
+    @staticmethod
+    def prepare_configuration(ip_mapping, mac_mapping, port_mapping):
+        configuration = TraceMixer.prepare_configuration(ip_mapping, mac_mapping, port_mapping)
+        configuration['timestamp']['generation'] = TIMESTAMP_GENERATION_SHIFT
+        return configuration
+
+
+class MixCheckpoints:
+    """
+    Cache of intermediate mixes of chained mixing
+
+    Mix of the first k annotated units is stored under key of the ordered prefix of k annotated units
+    (files, configurations and timestamps) and mixer version. Mixes sharing their first annotated units
+    are resumed from the longest stored prefix. Checkpoints are evicted by FileCache in LRU order.
+
+    Example usage:
+        checkpoints = MixCheckpoints(cache, trace_mixing.version)
+        keys = checkpoints.prefix_keys(annotated_units)
+        num_mixed, checkpoint = checkpoints.find(keys)
+    """
+
+    MIX_FILE = "mix.pcap"
+
+    def __init__(self, cache, version):
+        """
+        :param cache: FileCache checkpoints are stored in
+        :param version: version of mixer, see TraceMixing.version
+        """
+        self._cache = cache
+        self._version = version
+
+    def prefix_keys(self, annotated_units):
+        """
+        Compute keys of all prefixes of annotated units
+
+        :param annotated_units: list of tuples (annotated unit file, config, at_timestamp)
+        :return: list of cache keys, i-th key belongs to the first i + 1 annotated units
+        """
+        keys = []
+        key = self._cache.key("mix-checkpoint", self._version)
+        for annotated_unit_file, config, at_timestamp in annotated_units:
+            key = self._cache.key("mix-checkpoint", key, annotated_unit_file, config, at_timestamp)
+            keys.append(key)
+        return keys
+
+    def find(self, keys):
+        """
+        Find checkpoint of the longest prefix
+
+        :param keys: keys of prefixes, see prefix_keys
+        :return: tuple (number of annotated units in checkpoint, checkpoint file), (0, None) if there is no checkpoint
+        """
+        for i in reversed(range(len(keys))):
+            path = self._cache.get(keys[i])
+            if path is not None and os.path.exists(os.path.join(path, self.MIX_FILE)):
+                return i + 1, os.path.join(path, self.MIX_FILE)
+        return 0, None
+
+    def store(self, key, mix_file_location):
+        """
+        Store intermediate mix
+
+        Mix is hard linked into cache, it is copied only when it is on another filesystem than cache.
+        Mixer moves every new mix over the previous one, so stored mix is never changed.
+
+        :param key: key of prefix of annotated units contained in mix
+        :param mix_file_location: mix file
+        """
+        location = os.path.join(self._cache.folder, ".tmp_%s" % uuid.uuid4())
+        link_or_copy(mix_file_location, location)
+        try:
+            self._cache.put(key, {self.MIX_FILE: location})
+        finally:
+            if os.path.exists(location):
+                os.remove(location)
+
+
+def link_or_copy(source, target):
+    """
+    Hard link file to target location, file is copied when it can't be linked (e.g. to another filesystem)
+
+    Existing target is replaced atomically.
+
+    :param source: existing file
+    :param target: target location
+    """
+    tmp_location = os.path.join(os.path.dirname(os.path.abspath(target)), ".tmp_%s" % uuid.uuid4())
+    try:
+        os.link(source, tmp_location)
+    except OSError:
+        shutil.copyfile(source, tmp_location)
+    try:
+        os.replace(tmp_location, target)
+    except BaseException:
+        os.remove(tmp_location)
+        raise
+
+
 class TraceMixing:
     """
     Provide ability to combine multiple annotated units into one mix
     """
-    @staticmethod
-    def create_new_mixer(output_location):
+
+    def __init__(self, runner=None, timestamp_generation=None):
+        """
+        :param runner: runner of trace-tools commands (DockerRunner or ContainerPool)
+        :param timestamp_generation: timestamp generation of mixed annotated units,
+            "shift" mixes by in-process merge (MergeTraceMixer), annotated units are mixed by ID2T
+            with tcp_avg_shift timestamp generation otherwise
+        """
+        self._runner = runner
+        self._timestamp_generation = timestamp_generation
+
+    @property
+    def version(self):
+        """
+        Version of mixer, mixes of the same annotated units generated by different versions may differ
+        """
+        if self._timestamp_generation == TIMESTAMP_GENERATION_SHIFT:
+            return MergeTraceMixer.VERSION
+        return "{}:{}".format(TraceMixer.VERSION, (self._runner or DockerRunner()).image_id())
+
+    def create_new_mixer(self, output_location):
         """
         Create one Trace mixer instance
         :param output_location
         :return: TraceMixer
         """
-        return TraceMixer(output_location)
+        if self._timestamp_generation == TIMESTAMP_GENERATION_SHIFT:
+            return MergeTraceMixer(output_location, self._runner)
+        return TraceMixer(output_location, self._runner)
 
 
 if __name__ == "__main__":
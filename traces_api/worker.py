@@ -0,0 +1,199 @@
+"""
+Worker processing background jobs of job queue (mix generation)
+
+Usage:
+    python -m traces_api.worker [--config config.ini] [--workers 2]
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import json
+import signal
+import socket
+import argparse
+import threading
+import multiprocessing
+
+from traces_api.config import Config
+from traces_api.jobs import JobQueue, JOB_FAILED
+
+
+class Worker:
+    """
+    Run jobs claimed from job queue one by one
+
+    Heartbeats of running job are sent from separate thread, so long jobs are not considered crashed.
+    Failed job is returned to queue and retried by any worker until maximal number of attempts is reached,
+    then failure handler of its type is called.
+
+    Example usage:
+        worker = Worker(job_queue, {"mix_generation": handler}, "worker-1", {"mix_generation": failure_handler})
+        worker.run(stop_event)
+    """
+
+    def __init__(self, job_queue: JobQueue, handlers, name, failure_handlers=None, poll_interval=1,
+                 heartbeat_interval=10):
+        """
+        :param job_queue: JobQueue
+        :param handlers: dict job type -> callable receiving job payload
+        :param name: identification of worker stored in claimed jobs
+        :param failure_handlers: dict job type -> callable receiving payload and error of permanently failed job
+        :param poll_interval: seconds between polls of queue when it is empty
+        :param heartbeat_interval: seconds between heartbeats of running job
+        """
+        self._job_queue = job_queue
+        self._handlers = handlers
+        self._failure_handlers = failure_handlers or {}
+        self._name = name
+        self._poll_interval = poll_interval
+        self._heartbeat_interval = heartbeat_interval
+
+    def run_once(self):
+        """
+        Recover jobs of crashed workers, then claim and run one job
+
+        :return: True if job was run, False when queue is empty
+        """
+        for id_job in self._job_queue.recover_stale():
+            recovered = self._job_queue.get_job(id_job)
+            if recovered is not None and recovered.status == JOB_FAILED:
+                self._job_failed(id_job, recovered.type, json.loads(recovered.payload), recovered.error)
+
+        job = self._job_queue.claim(self._name)
+        if job is None:
+            return False
+
+        logger.info("Running job %s (%s, attempt %s)", job.id_job, job.type, job.attempts)
+        stop_heartbeats = threading.Event()
+        heartbeats = threading.Thread(
+            target=self._send_heartbeats, args=(job.id_job, stop_heartbeats), name="job-heartbeat", daemon=True
+        )
+        heartbeats.start()
+        try:
+            handler = self._handlers.get(job.type)
+            if handler is None:
+                raise ValueError("Unknown job type %s" % job.type)
+            handler(job.payload)
+        except Exception as e:
+            logger.exception("Job %s failed", job.id_job)
+            error = str(e) or type(e).__name__
+        else:
+            error = None
+        finally:
+            stop_heartbeats.set()
+            heartbeats.join()
+
+        if error is None:
+            self._job_queue.complete(job)
+        elif self._job_queue.fail(job, error) is False:
+            self._job_failed(job.id_job, job.type, job.payload, error)
+        return True
+
+    def _job_failed(self, id_job, job_type, payload, error):
+        """
+        Call failure handler of permanently failed job
+
+        :param id_job:
+        :param job_type:
+        :param payload: json data of job
+        :param error: error message
+        """
+        logger.error("Job %s failed permanently: %s", id_job, error)
+        handler = self._failure_handlers.get(job_type)
+        if handler is not None:
+            handler(payload, error)
+
+    def run(self, stop_event):
+        """
+        Run jobs until stop_event is set, running job is always finished
+
+        :param stop_event: threading.Event
+        """
+        while not stop_event.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                # e.g. database is not available, try it again later
+                logger.exception("Worker %s failed to process job queue", self._name)
+            stop_event.wait(self._poll_interval)
+
+    def _send_heartbeats(self, id_job, stop_event):
+        while not stop_event.wait(self._heartbeat_interval):
+            try:
+                self._job_queue.heartbeat(id_job)
+            except Exception:
+                logger.exception("Heartbeat of job %s failed", id_job)
+
+
+def run_worker(config_file):
+    """
+    Run one worker process until it receives SIGTERM or SIGINT
+
+    :param config_file: location of configuration file
+    """
+    # app module configures all services and imports flask, it is imported in worker process only
+    from app import FlaskApp, prepare_database
+    from traces_api.modules.mix.service import MixService
+    from traces_api.containers import DockerRunner
+
+    config = Config(config_file)
+    engine, session_maker = prepare_database(config.get("database", "connection_string"))
+    services = FlaskApp(session_maker, engine, config).create_services()
+    mix_service = services[MixService]
+
+    handlers = {
+        MixService.JOB_MIX_GENERATION: lambda payload: mix_service.run_mix_generation(payload["id_mix_generation"]),
+    }
+    failure_handlers = {
+        MixService.JOB_MIX_GENERATION:
+            lambda payload, error: mix_service.fail_mix_generation(payload["id_mix_generation"], error),
+    }
+    worker = Worker(
+        services[JobQueue], handlers, "{}:{}".format(socket.gethostname(), os.getpid()), failure_handlers,
+        poll_interval=float(config.get("worker", "poll_interval") or 1),
+        heartbeat_interval=float(config.get("worker", "heartbeat_interval") or 10),
+    )
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop_event.set())
+    try:
+        worker.run(stop_event)
+    finally:
+        # worker process exits without atexit handlers, pooled containers would keep running
+        services[DockerRunner].close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process background jobs of Trace-API (mix generation)")
+    parser.add_argument("--config", default="config.ini", help="configuration file")
+    parser.add_argument("--workers", type=int, help="number of worker processes, [worker] workers in config by default")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+
+    config = Config(args.config)
+    workers = args.workers or int(config.get("worker", "workers") or 0) or 1
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(args.config,), name="worker-%s" % i) for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+
+    def stop(signum, frame):
+        # Workers finish their running jobs
+        for p in processes:
+            if p.is_alive():
+                os.kill(p.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()